@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Bytes per job held by a process keeping the last build of every job in
+memory, for three representations of the same builds :
+
+ - eval : the full api/python build record, what the plugins used to keep
+ - tree : the dict of the api/json?tree= projection
+ - state : the jenkins_state.BuildState record of the daemon and webhook
+
+The size of each object is summed once, shared objects (small integers,
+interned strings) included only the first time they are met. The memory
+of the process while it builds --jobs BuildState records is reported as
+well :
+
+ $ python benchmarks/bench_memory.py --jobs 100000 --payload-size 4000
+
+"""
+
+from optparse import OptionParser
+import gc
+import json
+import os
+import resource
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from check_jenkins_batch import BUILD_FIELDS
+from fake_jenkins import FakeJenkins
+from jenkins_state import BuildState
+
+
+def deep_size(obj, seen):
+    """ sys.getsizeof of *obj* and of everything it holds, once each """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif hasattr(obj, '__slots__'):
+        for name in obj.__slots__:
+            size += deep_size(getattr(obj, name, None), seen)
+    return size
+
+
+def rss():
+    """ Memory of the process now, in bytes, its peak without /proc """
+    try:
+        pages = int(open('/proc/self/statm').read().split()[1])
+        return pages * resource.getpagesize()
+    except IOError:
+        # ru_maxrss is in kB on Linux, what has no /proc gives bytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--jobs', type='int', default=100000,
+                      help='Jobs held in memory for the process measure')
+    parser.add_option('--sample', type='int', default=2000,
+                      help='Jobs measured object by object')
+    parser.add_option('--payload-size', type='int', default=4000,
+                      help='Size of a full build record, its actions')
+    options, arguments = parser.parse_args()
+
+    jenkins = FakeJenkins(jobs=max(options.jobs, options.sample),
+                          payload_size=options.payload_size, history=1)
+    fields = BUILD_FIELDS.split(',')
+
+    samples = {'eval': [], 'tree': [], 'state': []}
+    for name in jenkins.job_names[:options.sample]:
+        build = jenkins.last_build(name)
+        # Every job is its own reply, nothing is shared between them
+        samples['eval'].append(eval(repr(jenkins.padded(build))))
+        tree = json.loads(json.dumps(dict([(field, build[field])
+                                           for field in fields])))
+        samples['tree'].append(tree)
+        samples['state'].append(BuildState.from_build(tree))
+
+    print '%-8s %14s %16s' % ('', 'bytes per job', 'for %s jobs' % options.jobs)
+    for kind in ('eval', 'tree', 'state'):
+        seen = set()
+        per_job = float(deep_size(samples[kind], seen) -
+                        sys.getsizeof(samples[kind])) / options.sample
+        print '%-8s %14.0f %13.1f MB' % (kind, per_job,
+                                          per_job * options.jobs / 2 ** 20)
+    del samples
+    gc.collect()
+
+    before = rss()
+    states = {}
+    for name in jenkins.job_names[:options.jobs]:
+        build = jenkins.last_build(name)
+        states[name] = BuildState.from_build(json.loads(json.dumps(
+                            dict([(field, build[field]) for field in fields]))))
+        # The fake keeps what it served, a daemon would not
+        del jenkins._builds[name]
+    print
+    print 'process grew %.1f MB holding %s BuildState (%.0f bytes per job, ' \
+          'name and dict slot included)' % (
+            (rss() - before) / 2.0 ** 20, len(states),
+            float(rss() - before) / len(states))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Compare the old fetch path (eval of the full api/python build record) with
+the new one (json.loads of the api/json?tree= projection).
+
+The payload mimics what Jenkins returns for the lastBuild of a pipeline job
+with a large changeSet, many actions and artifacts, the sizes can be tuned
+to match a build recorded on your own master :
+
+ $ python benchmarks/bench_parse.py --changes 500 --artifacts 300
+
+"""
+
+from optparse import OptionParser
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from check_jenkins import BUILD_TREE
+
+
+def build_record(changes, artifacts, actions):
+    """ A lastBuild record shaped like the Jenkins one """
+    url = 'https://ci.example.com/job/team/job/pipeline/job/master/1234/'
+    return {
+        '_class': 'org.jenkinsci.plugins.workflow.job.WorkflowRun',
+        'actions': [{'_class': 'hudson.model.ParametersAction',
+                     'parameters': [{'name': 'PARAM_%s' % i,
+                                     'value': 'value-%s' % i}
+                                    for i in range(20)]}] +
+                   [{'_class': 'hudson.plugins.git.util.BuildData',
+                     'buildsByBranchName': dict(
+                        ('refs/remotes/origin/branch-%s' % i,
+                         {'buildNumber': i, 'buildResult': None,
+                          'marked': {'SHA1': '%040x' % i,
+                                     'branch': [{'SHA1': '%040x' % i,
+                                                 'name': 'branch-%s' % i}]}})
+                        for i in range(actions)),
+                     'remoteUrls': ['https://git.example.com/team/repo.git']}],
+        'artifacts': [{'displayPath': 'artifact-%s.jar' % i,
+                       'fileName': 'artifact-%s.jar' % i,
+                       'relativePath': 'build/libs/artifact-%s.jar' % i}
+                      for i in range(artifacts)],
+        'building': False,
+        'description': None,
+        'displayName': '#1234',
+        'duration': 4213000,
+        'estimatedDuration': 4020000,
+        'executor': None,
+        'fullDisplayName': 'team >> pipeline >> master #1234',
+        'id': '1234',
+        'keepLog': False,
+        'number': 1234,
+        'queueId': 98765,
+        'result': 'SUCCESS',
+        'timestamp': 1328483562000,
+        'url': url,
+        'changeSets': [{'_class': 'hudson.plugins.git.GitChangeSetList',
+                        'items': [{'affectedPaths': ['src/module-%s/File%s.java' % (i % 7, i)
+                                                     for i in range(i % 5 + 1)],
+                                   'commitId': '%040x' % i,
+                                   'timestamp': 1328483562000 - i * 1000,
+                                   'author': {'absoluteUrl': 'https://ci.example.com/user/dev%s' % (i % 30),
+                                              'fullName': 'Developer %s' % (i % 30)},
+                                   'msg': 'Change number %s of the release train' % i,
+                                   'paths': [{'editType': 'edit',
+                                              'file': 'src/module-%s/File%s.java' % (i % 7, i)}]}
+                                  for i in range(changes)],
+                        'kind': 'git'}],
+    }
+
+
+def projection(record):
+    """ What Jenkins sends back for ?tree=BUILD_TREE """
+    return dict((field, record[field]) for field in BUILD_TREE.split(','))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--changes', type='int', default=500)
+    parser.add_option('--artifacts', type='int', default=300)
+    parser.add_option('--actions', type='int', default=200)
+    parser.add_option('-n', '--number', type='int', default=50)
+    options, arguments = parser.parse_args()
+
+    record = build_record(options.changes, options.artifacts, options.actions)
+    # api/python is the repr of the record, with None/True/False literals
+    before = repr(record)
+    after = json.dumps(projection(record))
+
+    assert eval(before)['result'] == json.loads(after)['result']
+
+    before_time = timeit.timeit(lambda: eval(before), number=options.number)
+    after_time = timeit.timeit(lambda: json.loads(after), number=options.number)
+
+    print '%-32s %10s %14s' % ('', 'bytes', 'parse (ms)')
+    print '%-32s %10s %14.3f' % ('before: api/python + eval', len(before),
+                                  before_time * 1000 / options.number)
+    print '%-32s %10s %14.3f' % ('after: api/json?tree= + json', len(after),
+                                  after_time * 1000 / options.number)
+    print
+    print 'payload %.0fx smaller, parse %.0fx faster' % (
+            float(len(before)) / len(after), before_time / after_time)
+
+
+if __name__ == '__main__':
+    main()
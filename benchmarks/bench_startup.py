@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Startup cost of the plugins : which imports a check answered by the
+--cache pays for, and how long a whole check takes end to end, against a
+local stub Jenkins and from the cache.
+
+ $ python benchmarks/bench_startup.py
+ $ python benchmarks/bench_startup.py --plugin check_jenkins_lsb.py -n 50
+ $ python benchmarks/bench_startup.py --plugin check_jenkins_combined.py \
+        --extra '--lsb-warning 1d --lsb-critical 2d'
+
+The import breakdown is measured in a fresh interpreter by timing every
+import statement of a check served by the cache, python 2 has no -X
+importtime, the output follows its layout : self and cumulative
+microseconds, nested modules indented. The network modules that check
+loaded are listed after it, there should be none.
+
+"""
+
+from optparse import OptionParser
+import BaseHTTPServer
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# What a request to Jenkins loads, a check from the cache should not
+NETWORK_MODULES = ('urllib', 'urllib2', 'httplib', 'ssl', 'socket', 'base64')
+
+# Ran with python -c in the child, prints one line per module imported
+IMPORT_TIMER = r"""
+import __builtin__, sys, time
+_real_import = __builtin__.__import__
+_stack = [[0.0]]
+_lines = []
+def _timed_import(name, *args, **kwargs):
+    before = set(sys.modules)
+    _stack.append([0.0])
+    start = time.time()
+    try:
+        return _real_import(name, *args, **kwargs)
+    finally:
+        spent = time.time() - start
+        children = _stack.pop()[0]
+        _stack[-1][0] += spent
+        new = [module for module in set(sys.modules) - before
+               if sys.modules[module] is not None]
+        if new:
+            _lines.append((len(_stack) - 1, name, spent - children, spent))
+__builtin__.__import__ = _timed_import
+sys.argv = [%(plugin)r] + %(arguments)r
+sys.path.insert(0, %(root)r)
+try:
+    execfile(%(path)r, {'__name__': '__main__'})
+except SystemExit:
+    pass
+__builtin__.__import__ = _real_import
+sys.stderr.write('import time: self [us] | cumulative | imported package\n')
+for depth, name, own, total in reversed(_lines):
+    sys.stderr.write('import time: %%9d | %%10d | %%s%%s\n' %% (
+        own * 1e6, total * 1e6, '  ' * depth, name))
+sys.stderr.write('network modules loaded: %%s\n' %% (', '.join([
+    module for module in %(network)r if sys.modules.get(module)]) or 'none'))
+"""
+
+
+class StubJenkins(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Any url is a successful finished build """
+
+    def do_GET(self):
+        body = json.dumps({'number': 6, 'building': False,
+                           'result': 'SUCCESS', 'duration': 17852,
+                           'timestamp': int(time.time() * 1000),
+                           'estimatedDuration': 17000,
+                           'url': 'http://localhost/job/test/6/'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--plugin', default='check_jenkins.py')
+    parser.add_option('--python', default=sys.executable)
+    parser.add_option('-n', '--number', type='int', default=20)
+    parser.add_option('--extra', default='',
+                      help='More arguments for the plugin, ex: --lsb-warning 1d')
+    options, arguments = parser.parse_args()
+
+    path = os.path.join(ROOT, options.plugin)
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubJenkins)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    tmp = tempfile.mkdtemp()
+    check = ['-H', '127.0.0.1', '-P', str(server.server_address[1]),
+                 '-j', 'test', '-w', '10', '-c', '20'] + options.extra.split()
+    cached = check + ['--cache', os.path.join(tmp, 'cache.db'),
+                          '--cache-ttl', '3600']
+    # Fills the cache, every run after it is a cache hit
+    subprocess.call([options.python, path] + cached,
+                    stdout=open(os.devnull, 'w'))
+    subprocess.call([options.python, '-c', IMPORT_TIMER % {
+                        'plugin': options.plugin, 'root': ROOT, 'path': path,
+                        'arguments': cached, 'network': NETWORK_MODULES}],
+                    stdout=open(os.devnull, 'w'))
+
+    timings = {}
+    for kind, command in (('jenkins', check), ('cache', cached)):
+        timings[kind] = []
+        for i in range(options.number):
+            start = time.time()
+            subprocess.call([options.python, path] + command,
+                            stdout=open(os.devnull, 'w'))
+            timings[kind].append(time.time() - start)
+    server.shutdown()
+    shutil.rmtree(tmp)
+
+    print
+    print '%s, %s runs of each' % (options.plugin, options.number)
+    start = time.time()
+    for i in range(options.number):
+        subprocess.call([options.python, '-c', 'pass'])
+    print 'bare interpreter : %.1f ms per run' % (
+            (time.time() - start) * 1000 / options.number)
+    for kind, label in (('jenkins', 'stub Jenkins'), ('cache', '--cache hit')):
+        print '%-13s wall time (ms) : min %.1f  p50 %.1f  p90 %.1f  max %.1f' % (
+                label, min(timings[kind]) * 1000,
+                percentile(timings[kind], 0.5) * 1000,
+                percentile(timings[kind], 0.9) * 1000,
+                max(timings[kind]) * 1000)
+
+
+if __name__ == '__main__':
+    main()
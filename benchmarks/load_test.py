@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Run the plugins against fake_jenkins.py the way a busy Nagios does : many
+checks at once on thousands of jobs. Reports checks per second, latency
+percentiles and the memory of a plugin run.
+
+ $ python benchmarks/load_test.py --jobs 5000 --checks 2000 --concurrency 32
+ $ python benchmarks/load_test.py --plugin check_jenkins_lsb.py --latency 50 --error-rate 0.05
+
+The fake Jenkins runs in its own process so it does not compete with the
+load driver for the interpreter lock.
+
+"""
+
+from optparse import OptionParser
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Arguments of each plugin, %s is the job name
+PLUGIN_ARGS = {
+    'check_jenkins.py': ['-j', '%s', '-w', '60', '-c', '120'],
+    'check_jenkins_lsb.py': ['-j', '%s', '-w', '1d', '-c', '2d'],
+}
+
+
+def percentile(values, fraction):
+    """ Nearest rank percentile of *values*
+
+    >>> percentile(range(1, 101), 0.99)
+    99
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(len(values) * fraction)) - 1)]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('fake_jenkins.py did not start on port %s' % port)
+
+
+def run_check(command):
+    """ (seconds, exit code, max rss in KB) of one plugin run """
+    start = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    process.stdout.read()
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status)
+    return time.time() - start, process.returncode, usage.ru_maxrss
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--plugin', default='check_jenkins.py',
+                      choices=sorted(PLUGIN_ARGS))
+    parser.add_option('--python', default=sys.executable)
+    parser.add_option('--port', type='int', default=18080)
+    parser.add_option('--jobs', type='int', default=5000)
+    parser.add_option('--checks', type='int', default=1000)
+    parser.add_option('--concurrency', type='int', default=16)
+    parser.add_option('--latency', type='float', default=0,
+                      help='Mean latency of fake Jenkins in milliseconds')
+    parser.add_option('--error-rate', type='float', default=0)
+    parser.add_option('--payload-size', type='int', default=0)
+    parser.add_option('--extra', default='',
+                      help='More arguments for the plugin, ex: --cache FILE')
+    options, arguments = parser.parse_args()
+
+    server = subprocess.Popen([options.python,
+                               os.path.join(ROOT, 'fake_jenkins.py'),
+                               '--port', str(options.port),
+                               '--jobs', str(options.jobs),
+                               '--latency', str(options.latency),
+                               '--error-rate', str(options.error_rate),
+                               '--payload-size', str(options.payload_size)],
+                              stdout=open(os.devnull, 'w'))
+    try:
+        wait_for_port(options.port)
+
+        rng = random.Random(42)
+        queue = [rng.randint(0, options.jobs - 1)
+                 for i in range(options.checks)]
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                lock.acquire()
+                if not queue:
+                    lock.release()
+                    return
+                job = queue.pop()
+                lock.release()
+                command = [options.python,
+                           os.path.join(ROOT, options.plugin),
+                           '-H', '127.0.0.1', '-P', str(options.port)] + [
+                           arg.replace('%s', 'job-%05d' % job)
+                           for arg in PLUGIN_ARGS[options.plugin]] + \
+                          options.extra.split()
+                result = run_check(command)
+                lock.acquire()
+                results.append(result)
+                lock.release()
+
+        start = time.time()
+        threads = [threading.Thread(target=worker)
+                   for i in range(options.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [seconds * 1000 for seconds, code, rss in results]
+    codes = [code for seconds, code, rss in results]
+    rss = [kb for seconds, code, kb in results]
+
+    print '%s : %s checks, %s at once, %s jobs' % (
+            options.plugin, len(results), options.concurrency, options.jobs)
+    print 'throughput     : %.1f checks/s' % (len(results) / elapsed)
+    print 'latency (ms)   : p50 %.1f  p99 %.1f  max %.1f' % (
+            percentile(latencies, 0.5), percentile(latencies, 0.99),
+            max(latencies))
+    print 'memory (KB)    : max rss p50 %s  max %s' % (
+            percentile(rss, 0.5), max(rss))
+    print 'exit codes     : %s' % ', '.join(['%s=%s' % (code, codes.count(code))
+                                             for code in sorted(set(codes))])
+
+
+if __name__ == '__main__':
+    main()
@@ -23,34 +23,39 @@ down version with nagios specific code"""
 from optparse import OptionParser, OptionGroup
 from datetime import timedelta, datetime
 from time import strftime, gmtime
-import base64
-import urllib2
-from urllib2 import HTTPError, URLError
-from urllib import quote
-from socket import setdefaulttimeout
+import json
+from jenkins_http import BodyReader, Timings
+from jenkins_http import describe_error, get_reply
+from jenkins_common import add_deadline_options, add_fetch_options
+from jenkins_common import fetch_context, quote
+# urllib2, base64 and socket are imported when they are needed, startup time
+# matters when Nagios runs thousands of checks per minute
+
+# Only the fields check_result needs, the full build record of a pipeline
+# can be hundreds of KB of actions, changeSet and artifacts
+BUILD_TREE = 'number,building,result,timestamp,duration,url,estimatedDuration'
 
 class CheckJenkins(object):
 
-    def get_data(self, url, username, password, timeout):
+    def get_data(self, url, username, password, timeout, cache=None,
+                 reader=None, timings=None, breaker=None, deadline=None,
+                 retries=0, flight=None):
         """
         Initialize the connection to Jenkins
+        The reply is fetched by jenkins_http.get_reply, which describes
+        the other parameters
         """
 
-        request = urllib2.Request(url)
-        request.add_header('User-Agent',
-                'check_jenkins/%s %s' % (__version__, __url__))
-        if (username and password):
-            base64string = base64.b64encode('%s:%s' % (username, password))
-            request.add_header("Authorization", "Basic %s" % base64string)
-
         try:
-            setdefaulttimeout(timeout)
-            return urllib2.urlopen(request).read()
-        except HTTPError:
-            print 'CRITICAL: Error on %s does the job exist or ever ran ?' % url
-            raise SystemExit, 2
-        except URLError:
-            print 'CRITICAL: Error on %s Double check the server name' % url
+            return get_reply(url, username, password, timeout, cache, reader,
+                             timings, breaker, deadline, retries, flight)
+        except Exception, error:
+            # The network modules are loaded to look at the error, a reply
+            # of the cache never needs them
+            status, message = describe_error(url, error)
+            if status == 'UNKNOWN':
+                raise
+            print '%s: %s' % (status, message)
             raise SystemExit, 2
 
 
@@ -69,6 +74,17 @@ class CheckJenkins(object):
             return strftime("%H:%M:%S", gmtime(time_delta.seconds))
 
 
+    def thresholds(self, params):
+        """
+        (warning, critical) running times in seconds, the adaptive ones
+        derived from the durations of the job when main() found them,
+        -w and -c otherwise
+        """
+        if params.get('thresholds'):
+            return params['thresholds']
+        return params['warning'] * 60, params['critical'] * 60
+
+
     def check_result(self, params, server):
         """
         From the server response and input parameter
@@ -78,6 +94,7 @@ class CheckJenkins(object):
         http://javadoc.jenkins-ci.org/hudson/model/Result.html
         """
         if server['building']:
+            warning, critical = self.thresholds(params)
             # I assume Server and client are on the same TimeZone
             # the API doesn't tell me where is the server (only /systemInfo)
             job_started = datetime.fromtimestamp(int(server['timestamp']) / 1000)
@@ -87,13 +104,13 @@ class CheckJenkins(object):
             # we want python >= 2.4 so we will do it ourselves
             seconds_since_start = time_delta.seconds + time_delta.days * 86400
             job_duration = self.seconds2human(seconds_since_start)
-            if (seconds_since_start >= params['critical'] * 60):
+            if (seconds_since_start >= critical):
                 msg = '%s has been running for %s, see %sconsole#footer' % (
                                 params['job'],
                                 job_duration,
                                 server['url'])
                 status = 'CRITICAL'
-            elif (seconds_since_start >= params['warning'] * 60):
+            elif (seconds_since_start >= warning):
                 msg = '%s has been running for %s, see %sconsole#footer' % (
                                 params['job'],
                                 job_duration,
@@ -136,6 +153,43 @@ class CheckJenkins(object):
         return(status, msg)
 
 
+    def perfdata(self, params, server):
+        """
+        Nagios performance data of the build : how long it ran, or has been
+        running, against the thresholds, all in seconds
+
+        >>> CheckJenkins().perfdata({'warning': 10, 'critical': 42}, {'building': False, 'duration': 17852})
+        'duration=17s;600;2520;0'
+        >>> CheckJenkins().perfdata({'warning': 10, 'critical': 42, 'now': datetime.fromtimestamp(1328487161)}, {'building': True, 'timestamp': '1328483562000'})
+        'duration=3599s;600;2520;0'
+        """
+        if server['building']:
+            job_started = datetime.fromtimestamp(int(server['timestamp']) / 1000)
+            time_delta = (params['now'] - job_started)
+            seconds = time_delta.seconds + time_delta.days * 86400
+        else:
+            seconds = server['duration'] / 1000
+        warning, critical = self.thresholds(params)
+        return 'duration=%ss;%s;%s;0' % (seconds, warning, critical)
+
+
+    def last_finished(self, server):
+        """
+        Number of the last finished build, for the history : the one
+        before it when the build is still running, None when unknown
+
+        >>> CheckJenkins().last_finished({'building': False, 'number': 6})
+        6
+        >>> CheckJenkins().last_finished({'building': True, 'number': 6})
+        5
+        >>> CheckJenkins().last_finished({'building': True})
+        """
+        number = server.get('number')
+        if number and server['building']:
+            return number - 1
+        return number
+
+
     def usage(self):
         """
         Return usage text so it can be used on failed human interactions
@@ -197,8 +251,7 @@ class CheckJenkins(object):
                             help='Jenkins username')
         connection.add_option('-p', '--password', type='string',
                             help='Jenkins password')
-        connection.add_option('-t', '--timeout', type='int', default=10,
-                            help='Connection timeout in seconds')
+        add_deadline_options(connection)
         connection.add_option('-P', '--port', type='int',
                             help='Jenkins port',
                             default=80)
@@ -207,8 +260,33 @@ class CheckJenkins(object):
                             default='/')
         connection.add_option('-S', '--ssl', action="store_true", default=False,
                             help='If the connection requires ssl')
+        connection.add_option('--max-size', type='int',
+                            help='Stop reading replies larger than this, in bytes')
         parser.add_option_group(connection)
 
+        add_fetch_options(parser)
+
+        history = OptionGroup(parser, "History Options",
+                        "Keep the builds of the job on disk, for trends")
+        history.add_option('--history', type='string', metavar='DIR',
+                            help='History directory, no history if not set')
+        history.add_option('--history-size', type='int', default=500,
+                            help='Builds kept per job')
+        history.add_option('--history-max-age', type='int', default=30,
+                            metavar='DAYS',
+                            help='Histories of the jobs not checked for that '
+                                 'long are removed, now and then')
+        history.add_option('--adaptive', action='store_true', default=False,
+                            help='Running time thresholds from the durations '
+                                 'of the job : p95 for warning, p99 x factor '
+                                 'for critical, needs --history')
+        history.add_option('--adaptive-factor', type='float', default=1.5,
+                            help='Factor applied to the p99 for critical')
+        history.add_option('--adaptive-min-builds', type='int', default=20,
+                            help='Successful builds needed before -w and -c '
+                                 'are replaced')
+        parser.add_option_group(history)
+
         extra = OptionGroup(parser, "Extra Options")
         extra.add_option('-v', action='store_true', dest='verbose', default=False,
                             help='Verbose mode')
@@ -248,6 +326,12 @@ class CheckJenkins(object):
             print self.usage()
             raise SystemExit, 2
 
+        if (options.adaptive and options.history == None):
+            print "\n--history DIR"
+            print "\n--adaptive learns the durations of the job from its history"
+            print self.usage()
+            raise SystemExit, 2
+
         return vars(options)
 
        
@@ -286,26 +370,80 @@ if __name__ == '__main__':
     if (user_in['prefix'] != '/'):
         user_in['prefix'] = '/%s/' % user_in['prefix']
 
-    user_in['url'] = "%s://%s:%s%sjob/%s/lastBuild/api/python" % (protocol,
+    user_in['job_url'] = "%s://%s:%s%sjob/%s/" % (
+                        protocol,
                         user_in['hostname'],
                         user_in['port'],
                         user_in['prefix'],
                         quote(user_in['job']))
+    user_in['url'] = "%slastBuild/api/json?tree=%s" % (user_in['job_url'],
+                                                       BUILD_TREE)
 
     # Get the current time, no need to get the microseconds
     user_in['now'] = datetime.now().replace(microsecond=0)
 
     verboseprint("CLI Arguments : ", user_in)
 
-    jenkins_out = eval(jen.get_data(user_in['url'], user_in['username'],
+    context = fetch_context(user_in)
+    cache = context['cache']
+
+    timings = Timings()
+    reader = BodyReader(user_in['max_size'], timings)
+    jenkins_out = timings.timed('parse', json.loads,
+        jen.get_data(user_in['url'], user_in['username'],
         user_in['password'],
-        user_in['timeout']))
+        user_in['timeout'],
+        reader=reader,
+        timings=timings,
+        **context))
+
+    if cache and cache.last_source != 'jenkins':
+        verboseprint("Cache hit (%s) for" % cache.last_source, user_in['url'])
+    if reader.transferred:
+        verboseprint("Transfer : %s bytes, %s bytes decoded" % (
+                        reader.transferred, reader.decoded))
 
     verboseprint("Reply from server :", jenkins_out)
 
-    status, message = jen.check_result(user_in, jenkins_out)
+    if user_in['history']:
+        from jenkins_history import HistoryStore, history_url
+        from jenkins_http import fetch
+        store = HistoryStore(user_in['history'], user_in['history_size'])
 
-    print '%s - %s' % (status, message)
+        def builds(start, end):
+            return json.loads(fetch(history_url(user_in['job_url'], start, end),
+                                    user_in['username'], user_in['password'],
+                                    user_in['timeout'], reader))['builds']
+        # The history is a bonus, it never fails the check
+        try:
+            history = store.update(user_in['job_url'], builds,
+                                   latest=jen.last_finished(jenkins_out))
+            verboseprint("History : %s builds up to #%s" % (len(history),
+                                                            history.watermark))
+            pruned = store.maybe_prune(user_in['history_max_age'] * 86400)
+            if pruned is not None:
+                verboseprint("History : %s old jobs removed" % pruned)
+            if user_in['adaptive']:
+                from jenkins_quantiles import DurationSketch
+                sketch_path = store.sketch_path(user_in['job_url'])
+                sketch = DurationSketch.load(sketch_path)
+                if sketch.update(history):
+                    sketch.save(sketch_path)
+                if sketch.count >= user_in['adaptive_min_builds']:
+                    user_in['thresholds'] = sketch.thresholds(
+                                                user_in['adaptive_factor'])
+                    verboseprint("Adaptive thresholds : %ss / %ss from %s builds" % (
+                                    user_in['thresholds'] + (sketch.count,)))
+        except Exception, error:
+            verboseprint("History not updated :", error)
+
+    status, message = timings.timed('check', jen.check_result, user_in,
+                                    jenkins_out)
+
+    # Job figures first, then where the time of the check itself went
+    print '%s - %s | %s %s' % (status, message,
+                               jen.perfdata(user_in, jenkins_out),
+                               timings.perfdata())
     # Exit statuses recognized by Nagios
     if   status == 'OK':
         raise SystemExit, 0
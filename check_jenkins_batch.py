@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Check many Jenkins jobs with a single request to the api, jobs are picked
+from a list, a view or a folder.
+
+https://wiki.jenkins-ci.org/display/JENKINS/Remote+access+API
+http://nagiosplug.sourceforge.net/developer-guidelines.html
+
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_batch.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+import json
+
+from check_jenkins import CheckJenkins
+import check_jenkins_lsb
+from jenkins_common import base_url, job_path, worst_status, nagios_exit, quote
+from jenkins_common import add_deadline_options, nagios_output
+from jenkins_http import Deadline
+
+
+BUILD_FIELDS = 'number,building,result,timestamp,duration,url'
+LSB_FIELDS = 'number,timestamp,url'
+
+
+def tree_url(root):
+    """ Api url returning the last builds of every job below *root*
+
+    >>> tree_url('http://ci:80/view/nightly/') # doctest: +ELLIPSIS
+    'http://ci:80/view/nightly/api/json?tree=jobs[name,url,lastBuild[number,...]]'
+    """
+    return '%sapi/json?tree=jobs[name,url,lastBuild[%s],lastSuccessfulBuild[%s]]' % (
+                root, BUILD_FIELDS, LSB_FIELDS)
+
+
+def batch_root(params):
+    """ Url of the container (server, view or folder) listing the jobs
+
+    >>> params = {'hostname': 'ci', 'port': 80, 'prefix': '/', 'ssl': False}
+    >>> batch_root(dict(params, view=None, folder=None))
+    'http://ci:80/'
+    >>> batch_root(dict(params, view='nightly builds', folder=None))
+    'http://ci:80/view/nightly%20builds/'
+    >>> batch_root(dict(params, view=None, folder='team/data'))
+    'http://ci:80/job/team/job/data/'
+    """
+    root = base_url(params)
+    if params['folder']:
+        root += job_path(params['folder'])
+    if params['view']:
+        root += 'view/%s/' % quote(params['view'])
+    return root
+
+
+def check_job(params, job, rule=None):
+    """ Run the existing checks on one job of the api reply
+
+    *params* needs warning and critical in minutes (check_jenkins) and
+    optionally lsb_warning and lsb_critical with units (check_jenkins_lsb).
+    The settings of a jenkins_rules *rule* replace them, the rule of the
+    job is looked up in params['rules'] when not given.
+
+    >>> in_p = {'warning': 60, 'critical': 120, 'lsb_warning': None,
+    ...         'lsb_critical': None, 'now': datetime.fromtimestamp(1328487161)}
+    >>> check_job(in_p, {'name': 'test', 'lastBuild': {'building': False,
+    ...     'result': 'SUCCESS', 'duration': 17852,
+    ...     'url': 'http://localhost/job/test/6/'}})
+    ('OK', 'test exited normally after 00:00:17')
+    >>> check_job(in_p, {'name': 'new', 'lastBuild': None})
+    ('UNKNOWN', 'new has never run')
+    >>> check_job(in_p, {'name': 'test', 'lastBuild': {'building': True,
+    ...     'timestamp': '1328483562000', 'url': 'http://localhost/job/test/6/'}},
+    ...     {'thresholds': [600, 1800]})[0]
+    'CRITICAL'
+    """
+    if rule is None and params.get('rules'):
+        rule = params['rules'].lookup(job['name'])
+    rule = rule or {}
+    check = rule.get('check')
+    lsb_warning = rule.get('lsb_warning', params['lsb_warning'])
+    lsb_critical = rule.get('lsb_critical', params['lsb_critical'])
+
+    job_params = {'job': job['name'],
+                  'warning': params['warning'],
+                  'critical': params['critical'],
+                  'thresholds': rule.get('thresholds'),
+                  'now': params['now']}
+
+    if check == 'lsb':
+        status, msg = None, None
+    elif job.get('lastBuild'):
+        status, msg = CheckJenkins().check_result(job_params, job['lastBuild'])
+    else:
+        return ('UNKNOWN', '%s has never run' % job['name'])
+
+    if check in ('lsb', 'both') and not (lsb_warning and lsb_critical):
+        return ('UNKNOWN', '%s needs lsb-warning and lsb-critical for its '
+                           'rule' % job['name'])
+    if check != 'build' and lsb_warning and lsb_critical:
+        lsb_params = dict(job_params, warning=lsb_warning,
+                          critical=lsb_critical)
+        if job.get('lastSuccessfulBuild'):
+            lsb_status, lsb_msg = check_jenkins_lsb.check_result(lsb_params,
+                                            job['lastSuccessfulBuild'])
+        else:
+            lsb_status = 'CRITICAL'
+            lsb_msg = '%s never ran successfully' % job['name']
+        if status is None:
+            return (lsb_status, lsb_msg)
+        if worst_status([status, lsb_status]) != status:
+            status = lsb_status
+        msg = '%s, %s' % (msg, lsb_msg)
+
+    return (status, msg)
+
+
+def check_jobs(params, reply):
+    """ Check every job of the api reply, restricted to params['jobs']
+    when given, the jobs whose rule says skip are left out. Returns a
+    list of (job, status, message)
+
+    >>> in_p = {'warning': 60, 'critical': 120, 'lsb_warning': None,
+    ...         'lsb_critical': None, 'jobs': ['test', 'gone'],
+    ...         'now': datetime(2012, 2, 5, 16, 12, 41)}
+    >>> check_jobs(in_p, {'jobs': [{'name': 'test', 'lastBuild': None},
+    ...                            {'name': 'other', 'lastBuild': None}]})
+    [('test', 'UNKNOWN', 'test has never run'), ('gone', 'UNKNOWN', 'gone does not exist')]
+    """
+    by_name = dict([(job['name'], job) for job in reply.get('jobs', [])])
+    if params['jobs']:
+        names = params['jobs']
+    else:
+        names = sorted(by_name)
+
+    results = []
+    for name in names:
+        rule = params.get('rules') and params['rules'].lookup(name) or {}
+        if rule.get('check') == 'skip':
+            continue
+        if name in by_name:
+            status, msg = check_job(params, by_name[name], rule)
+        else:
+            status, msg = ('UNKNOWN', '%s does not exist' % name)
+        results.append((name, status, msg))
+    return results
+
+
+def summary(results, what='jobs'):
+    """ First line of the plugin output, Nagios only keeps that one
+    on the status page
+
+    >>> summary([('a', 'OK', ''), ('b', 'CRITICAL', ''), ('c', 'OK', '')])
+    'CRITICAL - 3 jobs: 1 critical, 0 warning, 0 unknown, 2 ok'
+    """
+    statuses = [status for name, status, msg in results]
+    return '%s - %s %s: %s critical, %s warning, %s unknown, %s ok' % (
+                worst_status(statuses), len(statuses), what,
+                statuses.count('CRITICAL'), statuses.count('WARNING'),
+                statuses.count('UNKNOWN'), statuses.count('OK'))
+
+
+def recursive_reply(params, verboseprint):
+    """ Batch reply of every job below the root, see jenkins_discovery """
+    from jenkins_discovery import discover, discover_cached, fetch_builds
+    from jenkins_http import fetch, describe_error
+
+    root = batch_root(params)
+
+    def get(url):
+        return fetch(url, params['username'], params['password'],
+                     params['timeout'])
+
+    try:
+        cache = None
+        if params['discovery_cache']:
+            from jenkins_cache import open_cache
+            cache = open_cache(params['discovery_cache'],
+                               params['discovery_ttl'])
+        if cache:
+            jobs = discover_cached(root, get, params['workers'], cache,
+                                   params['username'], params['password'])
+        else:
+            jobs = discover(root, get, params['workers'])
+        verboseprint("Jobs found :", len(jobs))
+        if params['jobs']:
+            # Only the folders of the jobs asked for
+            wanted = set(params['jobs'])
+            jobs = [job for job in jobs if job[0] in wanted]
+        return fetch_builds(jobs, get, params['workers'])
+    except Exception, error:
+        status, message = describe_error(root, error)
+        print nagios_output('%s - %s' % (status, message))
+        nagios_exit(status)
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER [-j JOB,JOB | --view VIEW | --folder FOLDER] -w WARNING -c CRITICAL
+
+    Run check_jenkins (and optionally check_jenkins_lsb) on many jobs
+    with a single call to the Jenkins api
+    Warning and Critical are defined in minutes
+
+    Ex :
+
+    check_jenkins_batch.py -H ci.jenkins-ci.org --view nightly -w 10 -c 42
+    will check every job of the view nightly is successful
+    or not stuck for more than 10 (warn) 42 minutes (critical alert)
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """A Nagios plugin to check the status of many
+Jenkins jobs at once."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-j', '--job', type='string', action='append',
+                        dest='jobs', default=[],
+                        help='Job to check, can be repeated or comma separated')
+
+    parser.add_option('--view', type='string',
+                        help='Check the jobs of this view')
+
+    parser.add_option('--folder', type='string',
+                        help='Check the jobs of this folder, ex: team/data')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    parser.add_option('--rules', type='string', metavar='FILE',
+                        help='Thresholds and checks per job, -w and -c are '
+                             'for the jobs no rule matches, see jenkins_rules.py')
+
+    lsb = OptionGroup(parser, "Last Successful Build Options",
+                    "Also run check_jenkins_lsb on each job")
+    lsb.add_option('--lsb-warning', type='string',
+                        help='Warning threshold, units s, m, h, d')
+    lsb.add_option('--lsb-critical', type='string',
+                        help='Critical threshold, units s, m, h, d')
+    parser.add_option_group(lsb)
+
+    discovery = OptionGroup(parser, "Discovery Options",
+                    "Check the jobs of the sub folders and multibranch "
+                    "projects too")
+    discovery.add_option('-r', '--recursive', action='store_true',
+                        default=False,
+                        help='Find the jobs through every sub folder, '
+                             '-j takes paths like team/project/master')
+    discovery.add_option('--workers', type='int', default=8,
+                        help='Maximum number of requests at once')
+    discovery.add_option('--discovery-cache', type='string', metavar='FILE',
+                        help='Cache file keeping the jobs found')
+    discovery.add_option('--discovery-ttl', type='int', default=3600,
+                        help='Seconds the jobs found are reused')
+    parser.add_option_group(discovery)
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    add_deadline_options(connection)
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    parser.add_option_group(connection)
+
+    extra = OptionGroup(parser, "Extra Options")
+    extra.add_option('-v', action='store_true', dest='verbose',
+                        default=False,
+                        help='Verbose mode')
+    parser.add_option_group(extra)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None):
+        print "\n-w MINUTES"
+        print "\nHow many minutes the jobs should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.critical == None):
+        print "\n-c MINUTES"
+        print "\nHow many minutes maximum the jobs should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    if (bool(options.lsb_warning) != bool(options.lsb_critical)):
+        print "\n--lsb-warning / --lsb-critical"
+        print "\nBoth thresholds are needed to check the last successful build"
+        print usage()
+        raise SystemExit, 2
+
+    # -j a,b -j c
+    options.jobs = [job for jobs in options.jobs
+                    for job in jobs.split(',') if job]
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    # Command Line Parameters
+    user_in = controller()
+
+    if user_in['verbose']:
+        def verboseprint(*args):
+            """ http://stackoverflow.com/a/5980173 print only when verbose ON"""
+            # Print each argument separately so caller doesn't need to
+            # stuff everything to be printed into a single string
+            print
+            for arg in args:
+                print arg,
+            print
+    else:
+        verboseprint = lambda *a: None      # do-nothing function
+
+    user_in['url'] = tree_url(batch_root(user_in))
+
+    # Get the current time, no need to get the microseconds
+    user_in['now'] = datetime.now().replace(microsecond=0)
+
+    verboseprint("CLI Arguments : ", user_in)
+
+    if user_in['rules']:
+        from jenkins_rules import load_index
+        user_in['rules'] = load_index(user_in['rules'])
+
+    if user_in['recursive']:
+        jenkins_out = recursive_reply(user_in, verboseprint)
+    else:
+        jenkins_out = json.loads(CheckJenkins().get_data(user_in['url'],
+                        user_in['username'],
+                        user_in['password'],
+                        user_in['timeout'],
+                        deadline=Deadline(user_in['timeout'],
+                                          user_in['connect_timeout'],
+                                          user_in['tls_timeout']),
+                        retries=user_in['retries']))
+
+    verboseprint("Reply from server :", jenkins_out)
+
+    results = check_jobs(user_in, jenkins_out)
+
+    print summary(results)
+    for name, status, message in results:
+        print nagios_output('%s - %s' % (status, message))
+
+    nagios_exit(worst_status([status for name, status, msg in results]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Same check as check_jenkins.py, but the last build comes from
+check_jenkins_daemon.py over a local Unix socket : no request to Jenkins.
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+import json
+import socket
+
+from check_jenkins import CheckJenkins
+from jenkins_common import nagios_exit
+
+
+def query_daemon(path, request, timeout):
+    """ Send one json request to the daemon, return its decoded reply.
+    *path* is its Unix socket, or its (host, port) when it listens on TCP """
+    if isinstance(path, tuple):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(request) + '\n')
+        reply = sock.makefile().readline()
+    finally:
+        sock.close()
+    return json.loads(reply)
+
+
+def check_reply(params, reply):
+    """ check_jenkins rules on the daemon reply, with the thresholds of the
+    rules file of the daemon when it has one for the job
+
+    >>> in_p = {'job': 'test', 'warning': 60, 'critical': 120, 'max_age': 300,
+    ...         'now': datetime(2012, 2, 5, 16, 12, 41)}
+    >>> check_reply(in_p, {'build': {'building': False, 'result': 'SUCCESS',
+    ...     'duration': 17852, 'url': 'http://localhost/job/test/6/'}, 'age': 4})
+    ('OK', 'test exited normally after 00:00:17')
+    >>> check_reply(in_p, {'build': {}, 'age': 900})
+    ('UNKNOWN', 'test was last polled 900s ago, is check_jenkins_daemon.py stuck ?')
+    >>> check_reply(in_p, {'build': None, 'age': 4})
+    ('UNKNOWN', 'test has never run')
+    >>> check_reply(in_p, {'error': 'boom'})
+    ('UNKNOWN', 'boom')
+    >>> check_reply(in_p, {'build': {}, 'age': 4, 'rule': {'check': 'skip'}})
+    ('OK', 'test is not checked, the rules of check_jenkins_daemon.py skip it')
+    """
+    if 'error' in reply:
+        return ('UNKNOWN', reply['error'])
+    if reply['age'] > params['max_age']:
+        return ('UNKNOWN', '%s was last polled %ss ago, is check_jenkins_daemon.py stuck ?' % (
+                    params['job'], reply['age']))
+    rule = reply.get('rule') or {}
+    if rule.get('check') == 'skip':
+        return ('OK', '%s is not checked, the rules of check_jenkins_daemon.py skip it' % (
+                    params['job']))
+    if rule.get('thresholds'):
+        params = dict(params, thresholds=rule['thresholds'])
+    if not reply['build']:
+        return ('UNKNOWN', '%s has never run' % params['job'])
+    return CheckJenkins().check_result(params, reply['build'])
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """A Nagios plugin to check the status of a Jenkins job
+polled by check_jenkins_daemon.py"""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description,
+                            usage=CheckJenkins().usage(), version=version)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+    parser.add_option('-j', '--job', type='string',
+                        help='Job, use quotes if it contains space')
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    daemon = OptionGroup(parser, "Daemon Options")
+    daemon.add_option('-s', '--socket', type='string',
+                        default='/tmp/check_jenkins.sock',
+                        help='Unix socket of check_jenkins_daemon.py')
+    daemon.add_option('--address', type='string', metavar='HOST:PORT',
+                        help='TCP address of check_jenkins_daemon.py --listen, '
+                             'instead of --socket')
+    daemon.add_option('-t', '--timeout', type='int', default=10,
+                        help='Timeout in seconds')
+    daemon.add_option('--max-age', type='int', default=300,
+                        help='UNKNOWN when the daemon data is older, in seconds')
+    parser.add_option_group(daemon)
+
+    options, arguments = parser.parse_args()
+
+    for name, flag in (('hostname', '-H'), ('job', '-j'),
+                       ('warning', '-w'), ('critical', '-c')):
+        if getattr(options, name) == None:
+            print "\n%s is required, use --help for usage" % flag
+            raise SystemExit, 3
+
+    if options.address:
+        host, sep, port = options.address.rpartition(':')
+        if not (sep and port.isdigit()):
+            print "\n--address HOST:PORT, use --help for usage"
+            raise SystemExit, 3
+        options.socket = (host, int(port))
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    user_in = controller()
+    user_in['now'] = datetime.now().replace(microsecond=0)
+
+    try:
+        reply = query_daemon(user_in['socket'],
+                             {'hostname': user_in['hostname'],
+                              'job': user_in['job']},
+                             user_in['timeout'])
+    except (socket.error, ValueError), error:
+        reply = {'error': 'check_jenkins_daemon.py on %s : %s' % (
+                    user_in['address'] or user_in['socket'], error)}
+
+    status, message = check_reply(user_in, reply)
+
+    print '%s - %s' % (status, message)
+    nagios_exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+check_jenkins and check_jenkins_lsb on the same job with a single request
+and a single process : lastBuild, lastSuccessfulBuild and lastCompletedBuild
+come from one job/NAME/api/json?tree=... call, both rule sets are applied
+and the worse status is reported with both messages.
+
+https://wiki.jenkins-ci.org/display/JENKINS/Remote+access+API
+http://nagiosplug.sourceforge.net/developer-guidelines.html
+
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_combined.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+import json
+
+from check_jenkins import CheckJenkins, BUILD_TREE
+from check_jenkins_batch import check_job
+import check_jenkins_lsb
+from jenkins_common import base_url, job_path, worst_status, nagios_exit
+from jenkins_common import add_deadline_options, add_fetch_options
+from jenkins_common import fetch_context
+from jenkins_http import BodyReader, Timings
+
+
+def combined_url(params):
+    """ The three builds of the job in one api call
+
+    >>> combined_url({'hostname': 'ci', 'port': 80, 'prefix': '/', 'ssl': False, 'job': 'team/nightly'}) # doctest: +ELLIPSIS
+    'http://ci:80/job/team/job/nightly/api/json?tree=lastBuild[number,...],lastSuccessfulBuild[...],lastCompletedBuild[...]'
+    """
+    return '%s%sapi/json?tree=%s' % (base_url(params), job_path(params['job']),
+                ','.join(['%s[%s]' % (build, BUILD_TREE) for build in
+                          ('lastBuild', 'lastSuccessfulBuild',
+                           'lastCompletedBuild')]))
+
+
+def check_combined(params, job):
+    """
+    check_result of check_jenkins on lastBuild and of check_jenkins_lsb on
+    lastSuccessfulBuild, the worse status wins. While a build runs, the
+    outcome of the previous one (lastCompletedBuild) is not forgotten.
+
+    >>> in_p = {'job': 'test', 'warning': 60, 'critical': 120, 'lsb_warning': '1d',
+    ...         'lsb_critical': '2d', 'now': datetime.fromtimestamp(1328487161)}
+    >>> failed = {'building': False, 'result': 'FAILURE', 'duration': 17852,
+    ...           'timestamp': '1328483562000', 'url': 'http://localhost/job/test/6/'}
+    >>> success = {'building': False, 'result': 'SUCCESS', 'duration': 17852,
+    ...            'timestamp': '1328483562000', 'url': 'http://localhost/job/test/5/'}
+    >>> check_combined(in_p, {'lastBuild': failed, 'lastSuccessfulBuild': success,
+    ...                       'lastCompletedBuild': failed})
+    ('CRITICAL', 'test exited with an error, see http://localhost/job/test/6/console#footer, test last successful run was 0:59:59 ago - see http://localhost/job/test/buildTimeTrend')
+    >>> running = {'building': True, 'result': None, 'timestamp': '1328483562000',
+    ...            'url': 'http://localhost/job/test/7/'}
+    >>> check_combined(in_p, {'lastBuild': running, 'lastSuccessfulBuild': success,
+    ...                       'lastCompletedBuild': failed})[0]
+    'CRITICAL'
+    """
+    status, msg = check_job(params, dict(job, name=params['job']))
+
+    last, completed = job.get('lastBuild'), job.get('lastCompletedBuild')
+    if last and last['building'] and completed:
+        previous_status, previous_msg = CheckJenkins().check_result(
+                                            params, completed)
+        if previous_status != 'OK':
+            status = worst_status([status, previous_status])
+            msg = '%s, previous build : %s' % (msg, previous_msg)
+
+    return (status, msg)
+
+
+def perfdata(params, job):
+    """ duration of lastBuild and since_success of lastSuccessfulBuild """
+    fields = []
+    if job.get('lastBuild'):
+        fields.append(CheckJenkins().perfdata(params, job['lastBuild']))
+    if job.get('lastSuccessfulBuild'):
+        lsb_params = dict(params, warning=params['lsb_warning'],
+                          critical=params['lsb_critical'])
+        # Its duration is the one of an older build, only since_success
+        fields.append(check_jenkins_lsb.perfdata(lsb_params,
+                            job['lastSuccessfulBuild']).split()[0])
+    return ' '.join(fields)
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER -j JOB -w WARNING -c CRITICAL --lsb-warning WARNING --lsb-critical CRITICAL
+
+    Run check_jenkins and check_jenkins_lsb on a job with one request
+    Warning and Critical are defined in minutes, the lsb ones with units
+
+    Ex :
+
+    check_jenkins_combined.py -H ci.jenkins-ci.org -j infa_release.rss -w 10 -c 42 --lsb-warning 1d --lsb-critical 3d
+    will check if the job infa_release.rss is successful, not stuck for
+    more than 10 (warn) 42 minutes (critical) and succeeded less than
+    1 (warn) 3 days (critical) ago
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """A Nagios plugin to check both the last build and
+the last successful build of a Jenkins job."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-j', '--job', type='string',
+                        help='Job, use quotes if it contains space')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    lsb = OptionGroup(parser, "Last Successful Build Options")
+    lsb.add_option('--lsb-warning', type='string',
+                        help='Warning threshold, units s, m, h, d')
+    lsb.add_option('--lsb-critical', type='string',
+                        help='Critical threshold, units s, m, h, d')
+    parser.add_option_group(lsb)
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    add_deadline_options(connection)
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    connection.add_option('--max-size', type='int',
+                        help='Stop reading replies larger than this, in bytes')
+    parser.add_option_group(connection)
+
+    add_fetch_options(parser)
+
+    extra = OptionGroup(parser, "Extra Options")
+    extra.add_option('-v', action='store_true', dest='verbose',
+                        default=False,
+                        help='Verbose mode')
+    parser.add_option_group(extra)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.job == None):
+        print "\n-j JOB"
+        print "\nWe need the name of the job to check its health"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None or options.critical == None):
+        print "\n-w MINUTES -c MINUTES"
+        print "\nHow many minutes the job should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.lsb_warning == None or options.lsb_critical == None):
+        print "\n--lsb-warning --lsb-critical"
+        print "\nHow long since the last successful build for an alert ?"
+        print "ex: 3h or 180m or 10800s - default unit is minutes "
+        print usage()
+        raise SystemExit, 2
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    # Command Line Parameters
+    user_in = controller()
+
+    if user_in['verbose']:
+        def verboseprint(*args):
+            """ http://stackoverflow.com/a/5980173 print only when verbose ON"""
+            # Print each argument separately so caller doesn't need to
+            # stuff everything to be printed into a single string
+            print
+            for arg in args:
+                print arg,
+            print
+    else:
+        verboseprint = lambda *a: None      # do-nothing function
+
+    user_in['url'] = combined_url(user_in)
+
+    # Get the current time, no need to get the microseconds
+    user_in['now'] = datetime.now().replace(microsecond=0)
+
+    verboseprint("CLI Arguments : ", user_in)
+
+    context = fetch_context(user_in)
+    cache = context['cache']
+
+    timings = Timings()
+    reader = BodyReader(user_in['max_size'], timings)
+    jenkins_out = timings.timed('parse', json.loads,
+                        CheckJenkins().get_data(user_in['url'],
+                        user_in['username'],
+                        user_in['password'],
+                        user_in['timeout'],
+                        reader=reader,
+                        timings=timings,
+                        **context))
+
+    if cache and cache.last_source != 'jenkins':
+        verboseprint("Cache hit (%s) for" % cache.last_source, user_in['url'])
+
+    verboseprint("Reply from server :", jenkins_out)
+
+    status, message = timings.timed('check', check_combined, user_in,
+                                    jenkins_out)
+
+    print '%s - %s | %s %s' % (status, message,
+                               perfdata(user_in, jenkins_out),
+                               timings.perfdata())
+    nagios_exit(status)
+
+
+if __name__ == '__main__':
+    main()
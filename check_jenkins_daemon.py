@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Poll Jenkins on a schedule and keep the last build of every job in memory,
+check_jenkins_client.py asks this daemon over a local Unix socket instead of
+going to Jenkins for every Nagios check.
+
+The protocol is one line of json per request and per reply :
+
+ -> {"hostname": "ci.example.com", "job": "nightly"}
+ <- {"build": {"building": false, "result": "SUCCESS", ...}, "age": 12}
+
+Several daemons can share the jobs (--node, --member, see jenkins_shard.py) :
+each polls only the jobs hashing to it, and forwards the requests for the
+other jobs to their node, over the TCP port of --listen. A node lists the
+names of the jobs every --discovery-interval seconds, then asks Jenkins for
+the last build of its own jobs only, one small request each.
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+import json
+import os
+import threading
+import time
+import SocketServer
+
+from check_jenkins_batch import tree_url, batch_root, BUILD_FIELDS
+from check_jenkins_multi import fan_out
+from jenkins_common import job_path
+from jenkins_http import ConnectionPool, HTTPStatusError
+from jenkins_state import BuildState
+
+# The names only, for the nodes sharing the jobs
+NAMES_TREE = 'jobs[name]'
+JOB_TREE = 'name,lastBuild[%s]' % BUILD_FIELDS
+
+
+class StatusCache(object):
+    """
+    Last build of every job, as a jenkins_state.BuildState, with the time
+    of the poll that brought it. Only *jobs* are kept when given. The
+    settings of the jenkins_rules.RulesFile *rules* matching a job are
+    sent with it. With the jenkins_shard.Shard *shard*, only the jobs of
+    this node are kept.
+    """
+
+    def __init__(self, hostname, jobs=None, rules=None, shard=None):
+        self.hostname = hostname
+        self.jobs = jobs and set(jobs)
+        self.rules = rules
+        self.shard = shard
+        self.last_error = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def update(self, reply, now=None):
+        """ Store the jobs of an api reply (the tree_url projection) """
+        now = now or time.time()
+        self._lock.acquire()
+        try:
+            for job in reply.get('jobs', []):
+                if not self.keeps(job['name']):
+                    continue
+                self._jobs[job['name']] = (
+                        BuildState.from_build(job.get('lastBuild')), now)
+            self.last_error = None
+        finally:
+            self._lock.release()
+
+    def keeps(self, name):
+        """ Whether the job *name* is one of this daemon """
+        if self.jobs and name not in self.jobs:
+            return False
+        return not self.shard or self.shard.owns(self.hostname, name)
+
+    def lookup(self, hostname, job, now=None):
+        """ Reply to a client request, as a dict ready to be sent
+
+        >>> cache = StatusCache('ci', ['test'])
+        >>> cache.update({'jobs': [{'name': 'test', 'lastBuild': {'number': 6}},
+        ...                        {'name': 'nope', 'lastBuild': None}]}, 100)
+        >>> cache.lookup('ci', 'test', 130)
+        {'age': 30, 'build': {'number': 6}}
+        >>> cache.lookup('other', 'test')
+        {'error': 'this daemon polls ci, not other'}
+        >>> cache.lookup('ci', 'nope')
+        {'error': 'nope is not polled by this daemon'}
+        """
+        if hostname != self.hostname:
+            return {'error': 'this daemon polls %s, not %s' % (
+                                self.hostname, hostname)}
+        self._lock.acquire()
+        try:
+            entry = self._jobs.get(job)
+            last_error = self.last_error
+        finally:
+            self._lock.release()
+
+        if entry is None:
+            if last_error:
+                return {'error': last_error}
+            return {'error': '%s is not polled by this daemon' % job}
+        build, polled = entry
+        reply = {'build': build and build.as_dict(),
+                 'age': int((now or time.time()) - polled)}
+        if self.rules:
+            from jenkins_rules import RulesError
+            try:
+                rule = self.rules.current().lookup(job)
+            except (RulesError, IOError, OSError), error:
+                return {'error': 'Rules not loaded : %s' % error}
+            if rule:
+                reply['rule'] = rule
+        return reply
+
+
+class Poller(threading.Thread):
+    """
+    Fetch every job with a single tree= request each *interval* seconds
+    """
+
+    def __init__(self, cache, url, username, password, interval, pool):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.cache = cache
+        self.url = url
+        self.username = username
+        self.password = password
+        self.interval = interval
+        self.pool = pool
+        self.stopped = threading.Event()
+
+    def poll(self):
+        """ One round trip to Jenkins, errors are kept for the clients """
+        try:
+            body = self.pool.get(self.url, self.username, self.password)
+            self.cache.update(json.loads(body))
+        except Exception, error:
+            self.cache.last_error = 'Error on %s : %s' % (self.url, error)
+
+    def run(self):
+        while not self.stopped.isSet():
+            started = time.time()
+            self.poll()
+            self.stopped.wait(max(0, self.interval - (time.time() - started)))
+
+
+class ShardPoller(Poller):
+    """
+    Poller of a node sharing the jobs : the names of the jobs below *root*
+    are listed every *discovery* seconds, the last build of the jobs of
+    this node only is fetched each *interval*, *workers* requests at a time
+    """
+
+    def __init__(self, cache, root, username, password, interval, pool,
+                 discovery=600, workers=4):
+        Poller.__init__(self, cache, root + 'api/json?tree=' + NAMES_TREE,
+                        username, password, interval, pool)
+        self.root = root
+        self.discovery = discovery
+        self.workers = workers
+        self.owned = None
+        self.discovered = None
+
+    def discover(self):
+        """ The names of the jobs of this node, from one names only request """
+        body = self.pool.get(self.url, self.username, self.password)
+        self.owned = [job['name'] for job in json.loads(body).get('jobs', [])
+                      if self.cache.keeps(job['name'])]
+        self.discovered = time.time()
+
+    def job_url(self, name):
+        return '%s%sapi/json?tree=%s' % (self.root, job_path(name), JOB_TREE)
+
+    def poll(self):
+        """ The jobs of this node, a job failing does not hide the others """
+        try:
+            if (self.owned is None or
+                    time.time() - self.discovered >= self.discovery):
+                self.discover()
+        except Exception, error:
+            self.cache.last_error = 'Error on %s : %s' % (self.url, error)
+            return
+        replies = fan_out([('jenkins', name) for name in self.owned],
+                          lambda target: json.loads(self.pool.get(
+                                self.job_url(target[1]), self.username,
+                                self.password)),
+                          self.workers, self.workers)
+        jobs = []
+        errors = []
+        for name, reply in zip(self.owned, replies):
+            if isinstance(reply, HTTPStatusError) and reply.status == 404:
+                # Deleted since the discovery, gone from the next one
+                continue
+            if isinstance(reply, Exception):
+                errors.append('Error on %s : %s' % (self.job_url(name), reply))
+                continue
+            jobs.append(dict(reply, name=name))
+        self.cache.update({'jobs': jobs})
+        if errors:
+            self.cache.last_error = errors[0]
+
+
+class StatusHandler(SocketServer.StreamRequestHandler):
+    """ One json request line, one json reply line. The requests for the
+    jobs of another node are sent to it, once. """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if not isinstance(request, dict):
+                raise ValueError('not an object')
+            shard = self.server.cache.shard
+            owner = shard and shard.owner(request.get('hostname'),
+                                          request.get('job'))
+            if owner and owner != shard.node and not request.get('forwarded'):
+                reply = shard.forward(owner, request)
+            else:
+                reply = self.server.cache.lookup(request.get('hostname'),
+                                                 request.get('job'))
+        except ValueError:
+            reply = {'error': 'invalid request'}
+        self.wfile.write(json.dumps(reply) + '\n')
+
+
+class StatusServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, cache):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path, StatusHandler)
+        self.cache = cache
+
+
+class StatusTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """ Same requests as StatusServer, from the other nodes and the
+    clients on other hosts """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cache):
+        SocketServer.TCPServer.__init__(self, address, StatusHandler)
+        self.cache = cache
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER [-j JOB,JOB | --view VIEW | --folder FOLDER]
+
+    Poll the last build of the jobs every --interval seconds and serve
+    them to check_jenkins_client.py on a local socket
+
+    Ex :
+
+    check_jenkins_daemon.py -H ci.jenkins-ci.org --view nightly -i 30
+    check_jenkins_client.py -H ci.jenkins-ci.org -j infa_release.rss -w 10 -c 42
+
+    Sharing the jobs between two nodes, on the first one :
+
+    check_jenkins_daemon.py -H ci.jenkins-ci.org --node a --member a=mon1:9120,b=mon2:9120
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """Keep the status of Jenkins jobs in memory for
+check_jenkins_client.py"""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-j', '--job', type='string', action='append',
+                        dest='jobs', default=[],
+                        help='Job to poll, can be repeated or comma separated')
+
+    parser.add_option('--view', type='string',
+                        help='Poll the jobs of this view')
+
+    parser.add_option('--folder', type='string',
+                        help='Poll the jobs of this folder, ex: team/data')
+
+    parser.add_option('-i', '--interval', type='int', default=60,
+                        help='Seconds between two polls')
+
+    parser.add_option('-s', '--socket', type='string',
+                        default='/tmp/check_jenkins.sock',
+                        help='Unix socket to listen to')
+
+    parser.add_option('--rules', type='string', metavar='FILE',
+                        help='Thresholds per job sent to the clients, '
+                             'see jenkins_rules.py')
+
+    sharding = OptionGroup(parser, "Sharding Options",
+                    "Share the jobs between several daemons")
+    sharding.add_option('--node', type='string',
+                        help='Id of this daemon among the members')
+    sharding.add_option('--member', type='string', action='append',
+                        dest='members', default=[], metavar='ID=HOST:PORT',
+                        help='Every daemon sharing the jobs, this one '
+                             'included, can be repeated or comma separated')
+    sharding.add_option('--vnodes', type='int', default=100,
+                        help='Points of each member on the hash ring')
+    sharding.add_option('--discovery-interval', type='int', default=600,
+                        help='Seconds between two listings of the jobs, '
+                             'each node polls only its own in between')
+    sharding.add_option('--workers', type='int', default=4,
+                        help='Requests to Jenkins at a time for the jobs '
+                             'of this node')
+    sharding.add_option('--listen', type='string', metavar='HOST:PORT',
+                        help='TCP address of the requests of the other nodes '
+                             'and remote clients, default the one of --node')
+    parser.add_option_group(sharding)
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    connection.add_option('-t', '--timeout', type='int', default=10,
+                        help='Connection timeout in seconds')
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    parser.add_option_group(connection)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    options.jobs = [job for jobs in options.jobs
+                    for job in jobs.split(',') if job]
+
+    options.members = [member for members in options.members
+                       for member in members.split(',') if member]
+    if (bool(options.node) != bool(options.members)):
+        print "\n--node ID --member ID=HOST:PORT"
+        print "\nSharding needs the id of this daemon and every member"
+        print usage()
+        raise SystemExit, 2
+
+    if options.members:
+        from jenkins_shard import parse_members
+        try:
+            options.members = parse_members(options.members)
+        except ValueError, error:
+            print "\n%s" % error
+            raise SystemExit, 2
+        if options.node not in options.members:
+            print "\n--node %s is not one of the --member" % options.node
+            raise SystemExit, 2
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    user_in = controller()
+
+    rules = None
+    if user_in['rules']:
+        from jenkins_rules import RulesFile
+        rules = RulesFile(user_in['rules'])
+    shard = None
+    if user_in['node']:
+        from jenkins_shard import Shard
+        shard = Shard(user_in['node'], user_in['members'], user_in['vnodes'],
+                      user_in['timeout'])
+    cache = StatusCache(user_in['hostname'], user_in['jobs'], rules, shard)
+    if shard:
+        poller = ShardPoller(cache, batch_root(user_in), user_in['username'],
+                             user_in['password'], user_in['interval'],
+                             ConnectionPool(user_in['timeout'],
+                                            user_in['workers']),
+                             user_in['discovery_interval'],
+                             user_in['workers'])
+    else:
+        poller = Poller(cache, tree_url(batch_root(user_in)), user_in['username'], user_in['password'],
+                        user_in['interval'],
+                        ConnectionPool(timeout=user_in['timeout']))
+    poller.start()
+
+    if shard or user_in['listen']:
+        if user_in['listen']:
+            host, sep, port = user_in['listen'].rpartition(':')
+            address = (host, int(port))
+        else:
+            address = user_in['members'][user_in['node']]
+        peers = StatusTCPServer(address, cache)
+        thread = threading.Thread(target=peers.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    server = StatusServer(user_in['socket'], cache)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        poller.stopped.set()
+        os.unlink(user_in['socket'])
+
+
+if __name__ == '__main__':
+    main()
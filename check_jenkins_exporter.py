@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Serve the health of Jenkins jobs to Prometheus : the same status
+check_jenkins gives Nagios, the running time, the time since the last
+successful build and the last build duration of every job.
+
+Jenkins is only asked every --interval seconds, in the background, over
+keep-alive connections and with one tree= request for all the jobs (one
+per folder with --recursive). Each refresh renders the whole page once, a
+scrape of /metrics only sends those bytes from memory : scrapes cost no
+request to Jenkins and no rendering, however often they come.
+
+ $ python check_jenkins_exporter.py -H ci.example.com -w 60 -c 120 --listen :9118
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_exporter.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+import BaseHTTPServer
+import SocketServer
+import json
+import threading
+import time
+import zlib
+
+from check_jenkins_batch import tree_url, batch_root, check_jobs
+from jenkins_common import NAGIOS_CODES
+from jenkins_http import ConnectionPool
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name, type, help
+JOB_METRICS = (
+    ('jenkins_job_status', 'gauge',
+     'Status check_jenkins gives the job, 0 OK, 1 WARNING, 2 CRITICAL, 3 UNKNOWN'),
+    ('jenkins_job_building', 'gauge', 'Whether the last build is running'),
+    ('jenkins_job_running_seconds', 'gauge',
+     'Time the running build has been running, 0 when none runs'),
+    ('jenkins_job_last_success_age_seconds', 'gauge',
+     'Time since the last successful build started'),
+    ('jenkins_job_last_build_duration_seconds', 'gauge',
+     'Duration of the last finished build'),
+    ('jenkins_job_last_build_number', 'gauge', 'Number of the last build'),
+)
+
+
+def escape(value):
+    """ Label value of the exposition format
+
+    >>> escape(u'team/"app"\\n')
+    'team/\\\\"app\\\\"\\\\n'
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def epoch(moment):
+    """ Seconds since the epoch of a local datetime """
+    return time.mktime(moment.timetuple())
+
+
+def job_values(now, job):
+    """ {metric: value} of a job of the tree_url reply, the metrics it
+    has no value for are left out
+
+    >>> values = job_values(1328487161, {'name': 'test',
+    ...     'lastBuild': {'number': 7, 'building': True, 'timestamp': 1328483562000},
+    ...     'lastSuccessfulBuild': {'number': 6, 'timestamp': 1328397162000}})
+    >>> sorted(values.items())
+    [('jenkins_job_building', 1), ('jenkins_job_last_build_number', 7), ('jenkins_job_last_success_age_seconds', 89999), ('jenkins_job_running_seconds', 3599)]
+    """
+    values = {}
+    last = job.get('lastBuild')
+    if last:
+        values['jenkins_job_last_build_number'] = last['number']
+        values['jenkins_job_building'] = int(bool(last['building']))
+        if last['building']:
+            values['jenkins_job_running_seconds'] = max(0,
+                    int(now - int(last['timestamp']) / 1000))
+        else:
+            values['jenkins_job_running_seconds'] = 0
+            values['jenkins_job_last_build_duration_seconds'] = (
+                    int(last['duration']) / 1000.0)
+    success = job.get('lastSuccessfulBuild')
+    if success:
+        values['jenkins_job_last_success_age_seconds'] = max(0,
+                int(now - int(success['timestamp']) / 1000))
+    return values
+
+
+def render(params, reply):
+    """
+    Text of the job metrics, checked with the thresholds of *params* at
+    params['now']. The jobs skipped by the rules are left out.
+
+    >>> in_p = {'warning': 60, 'critical': 120, 'lsb_warning': None,
+    ...         'lsb_critical': None, 'jobs': [],
+    ...         'now': datetime.fromtimestamp(1328487161)}
+    >>> print render(in_p, {'jobs': [{'name': 'test', 'lastBuild': {'number': 6,
+    ...     'building': False, 'result': 'FAILURE', 'duration': 17852,
+    ...     'url': 'http://localhost/job/test/6/'}}]}), # doctest: +ELLIPSIS
+    # HELP jenkins_job_status Status check_jenkins gives the job, ...
+    # TYPE jenkins_job_status gauge
+    jenkins_job_status{job="test"} 2
+    # HELP jenkins_job_building Whether the last build is running
+    # TYPE jenkins_job_building gauge
+    jenkins_job_building{job="test"} 0
+    ...
+    jenkins_job_last_build_duration_seconds{job="test"} 17.852
+    ...
+    """
+    now = epoch(params['now'])
+    by_name = dict([(job['name'], job) for job in reply.get('jobs', [])])
+    rows = [('job="%s"' % escape(name), NAGIOS_CODES[status],
+             job_values(now, by_name.get(name, {})))
+            for name, status, msg in check_jobs(params, reply)]
+
+    lines = []
+    for metric, kind, text in JOB_METRICS:
+        lines.append('# HELP %s %s' % (metric, text))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for labels, code, values in rows:
+            if metric == 'jenkins_job_status':
+                value = code
+            elif metric in values:
+                value = values[metric]
+            else:
+                continue
+            lines.append('%s{%s} %s' % (metric, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsPage(object):
+    """
+    The last rendered page, plain and gzipped, swapped in one assignment
+    so a scrape never sees half of a refresh
+    """
+
+    def __init__(self):
+        self.jobs = ''
+        self.content = ('', zlib.compress(''))
+
+    def update(self, jobs, exporter):
+        """ New page, from the *jobs* metrics (None keeps the previous ones)
+        and the metrics of the exporter itself """
+        if jobs is not None:
+            self.jobs = jobs
+        body = self.jobs + exporter
+        gzipper = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.content = (body, gzipper.compress(body) + gzipper.flush())
+
+
+class Refresher(threading.Thread):
+    """
+    Fetch every job each *interval* seconds and render the page. With
+    params['recursive'], the folders are walked again every
+    params['discovery_interval'] seconds only.
+    """
+
+    def __init__(self, params, page, pool):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.params = params
+        self.page = page
+        self.pool = pool
+        self.stopped = threading.Event()
+        self.errors = 0
+        self.last_error = None
+        self._jobs = None
+        self._discovered = 0
+
+    def get(self, url):
+        return self.pool.get(url, self.params['username'],
+                             self.params['password'])
+
+    def fetch(self):
+        """ Batch reply of every job, see check_jenkins_batch.tree_url """
+        root = batch_root(self.params)
+        if not self.params['recursive']:
+            return json.loads(self.get(tree_url(root)))
+
+        from jenkins_discovery import discover, fetch_builds
+        if (self._jobs is None or time.time() - self._discovered >
+                self.params['discovery_interval']):
+            self._jobs = discover(root, self.get, self.params['workers'])
+            self._discovered = time.time()
+        return fetch_builds(self._jobs, self.get, self.params['workers'])
+
+    def refresh(self):
+        """ One refresh, a failed one keeps the previous job metrics """
+        started = time.time()
+        jobs = None
+        try:
+            params = dict(self.params,
+                          now=datetime.now().replace(microsecond=0))
+            jobs = render(params, self.fetch())
+            self.last_error = None
+        except Exception, error:
+            self.errors += 1
+            self.last_error = str(error)
+        self.page.update(jobs, '\n'.join([
+            '# HELP jenkins_exporter_up Whether the last refresh worked',
+            '# TYPE jenkins_exporter_up gauge',
+            'jenkins_exporter_up %d' % (self.last_error is None),
+            '# HELP jenkins_exporter_refresh_timestamp_seconds End of the last refresh',
+            '# TYPE jenkins_exporter_refresh_timestamp_seconds gauge',
+            'jenkins_exporter_refresh_timestamp_seconds %.3f' % time.time(),
+            '# HELP jenkins_exporter_refresh_duration_seconds Time the last refresh took',
+            '# TYPE jenkins_exporter_refresh_duration_seconds gauge',
+            'jenkins_exporter_refresh_duration_seconds %.6f' % (
+                                                    time.time() - started),
+            '# HELP jenkins_exporter_refresh_errors_total Failed refreshes',
+            '# TYPE jenkins_exporter_refresh_errors_total counter',
+            'jenkins_exporter_refresh_errors_total %d' % self.errors]) + '\n')
+
+    def run(self):
+        while not self.stopped.isSet():
+            started = time.time()
+            self.refresh()
+            self.stopped.wait(max(0, self.params['interval'] -
+                                     (time.time() - started)))
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ /metrics from memory, gzipped when the scraper accepts it """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.partition('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        plain, gzipped = self.server.page.content
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        if 'gzip' in (self.headers.getheader('Accept-Encoding') or ''):
+            body = gzipped
+            self.send_header('Content-Encoding', 'gzip')
+        else:
+            body = plain
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, page):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MetricsHandler)
+        self.page = page
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER [-j JOB,JOB | --view VIEW | --folder FOLDER] -w WARNING -c CRITICAL
+
+    Refresh the jobs every --interval seconds and serve their health to
+    Prometheus on /metrics
+    Warning and Critical are defined in minutes
+
+    Ex :
+
+    check_jenkins_exporter.py -H ci.jenkins-ci.org --view nightly -w 10 -c 42 --listen :9118
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """A Prometheus exporter of the health of Jenkins jobs."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-j', '--job', type='string', action='append',
+                        dest='jobs', default=[],
+                        help='Job to export, can be repeated or comma separated')
+
+    parser.add_option('--view', type='string',
+                        help='Export the jobs of this view')
+
+    parser.add_option('--folder', type='string',
+                        help='Export the jobs of this folder, ex: team/data')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    parser.add_option('--rules', type='string', metavar='FILE',
+                        help='Thresholds and checks per job, -w and -c are '
+                             'for the jobs no rule matches, see jenkins_rules.py')
+
+    lsb = OptionGroup(parser, "Last Successful Build Options",
+                    "Also apply check_jenkins_lsb to the status")
+    lsb.add_option('--lsb-warning', type='string',
+                        help='Warning threshold, units s, m, h, d')
+    lsb.add_option('--lsb-critical', type='string',
+                        help='Critical threshold, units s, m, h, d')
+    parser.add_option_group(lsb)
+
+    exporter = OptionGroup(parser, "Exporter Options")
+    exporter.add_option('-l', '--listen', type='string', default=':9118',
+                        help='Address and port to serve /metrics on')
+    exporter.add_option('-i', '--interval', type='int', default=60,
+                        help='Seconds between two refreshes')
+    exporter.add_option('-r', '--recursive', action='store_true',
+                        default=False,
+                        help='Export the jobs of every sub folder')
+    exporter.add_option('--workers', type='int', default=8,
+                        help='Maximum number of requests at once')
+    exporter.add_option('--discovery-interval', type='int', default=3600,
+                        help='Seconds between two walks through the folders')
+    parser.add_option_group(exporter)
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    connection.add_option('-t', '--timeout', type='int', default=10,
+                        help='Connection timeout in seconds')
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    parser.add_option_group(connection)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None or options.critical == None):
+        print "\n-w MINUTES -c MINUTES"
+        print "\nHow many minutes the jobs should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    if (bool(options.lsb_warning) != bool(options.lsb_critical)):
+        print "\n--lsb-warning / --lsb-critical"
+        print "\nBoth thresholds are needed to check the last successful build"
+        print usage()
+        raise SystemExit, 2
+
+    options.jobs = [job for jobs in options.jobs
+                    for job in jobs.split(',') if job]
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    user_in = controller()
+
+    if user_in['rules']:
+        from jenkins_rules import load_index
+        user_in['rules'] = load_index(user_in['rules'])
+
+    host, sep, port = user_in['listen'].rpartition(':')
+
+    page = MetricsPage()
+    refresher = Refresher(user_in, page,
+                          ConnectionPool(timeout=user_in['timeout'],
+                                         size=user_in['workers']))
+    # The page is complete before the first scrape
+    refresher.refresh()
+    refresher.start()
+
+    server = MetricsServer((host, int(port)), page)
+    print 'Serving the metrics of %s on http://%s:%s/metrics' % (
+            user_in['hostname'], host or '0.0.0.0', port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        refresher.stopped.set()
+
+
+if __name__ == '__main__':
+    main()
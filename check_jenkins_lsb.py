@@ -20,33 +20,40 @@ down version with nagios specific code"""
 
 from datetime import timedelta, datetime
 from optparse import OptionParser, OptionGroup
-import base64
-import urllib2
 import re
-from urllib2 import HTTPError, URLError
-from urllib import quote
-from socket import setdefaulttimeout
+import json
+from jenkins_http import BodyReader, Timings
+from jenkins_http import describe_error, get_reply
+from jenkins_common import add_deadline_options, add_fetch_options
+from jenkins_common import fetch_context, quote
+# urllib2, base64 and socket are imported when they are needed, startup time
+# matters when Nagios runs thousands of checks per minute
 
+# Only the fields check_result needs, the full build record of a pipeline
+# can be hundreds of KB of actions, changeSet and artifacts
+BUILD_TREE = 'number,building,result,timestamp,duration,url,estimatedDuration'
 
-def get_data(url, username, password, timeout):
+
+def get_data(url, username, password, timeout, cache=None, reader=None,
+             timings=None, breaker=None, deadline=None, retries=0, flight=None):
     """
     Initialize the connection to Jenkins
     Fetch data using the api
+    The reply is fetched by jenkins_http.get_reply, which describes
+    the other parameters
     """
 
-    request = urllib2.Request(url)
-    if (username and password):
-        b64string = base64.b64encode('%s:%s' % (username, password))
-        request.add_header("Authorization", "Basic %s" % b64string)
-
     try:
-        setdefaulttimeout(timeout)
-        return urllib2.urlopen(request).read()
-    except HTTPError:
-        print 'CRITICAL: %s does the job ever ran successfully ?' % url
-        raise SystemExit, 2
-    except URLError:
-        print 'CRITICAL: Error on %s Double check the server name' % url
+        return get_reply(url, username, password, timeout, cache, reader,
+                         timings, breaker, deadline, retries, flight)
+    except Exception, error:
+        # The network modules are loaded to look at the error, a reply
+        # of the cache never needs them
+        status, message = describe_error(url, error,
+                        '%s does the job ever ran successfully ?')
+        if status == 'UNKNOWN':
+            raise
+        print '%s: %s' % (status, message)
         raise SystemExit, 2
 
 
@@ -176,6 +183,24 @@ def check_result(params, server):
     return(status, msg)
 
 
+def perfdata(params, server):
+    """ Nagios performance data : seconds since the last successful build
+    started against the thresholds, and how long that build ran
+
+    >>> in_p = {'warning': '10d', 'critical': '42d', 'now': datetime(2012, 2, 6, 16, 10, 1)}
+    >>> perfdata(in_p, {'timestamp': '1328573400000', 'duration': 17852})
+    'since_success=1s;864000;3628800;0 duration=17s'
+    """
+    since = params['now'] - datetime.fromtimestamp(int(server['timestamp']) / 1000)
+    warning = convert_to_timedelta(params['warning'])
+    critical = convert_to_timedelta(params['critical'])
+    return 'since_success=%ss;%s;%s;0 duration=%ss' % (
+                since.seconds + since.days * 86400,
+                warning.seconds + warning.days * 86400,
+                critical.seconds + critical.days * 86400,
+                int(server.get('duration') or 0) / 1000)
+
+
 def usage():
     """
     Return usage text so it can be used on failed human interactions
@@ -228,8 +253,7 @@ run of a Jenkins Job was not too long ago."""
                         help='Jenkins username')
     connection.add_option('-p', '--password', type='string',
                         help='Jenkins password')
-    connection.add_option('-t', '--timeout', type='int', default=10,
-                        help='Connection timeout in seconds')
+    add_deadline_options(connection)
     connection.add_option('-P', '--port', type='int',
                         help='Jenkins port',
                         default=80)
@@ -239,8 +263,12 @@ run of a Jenkins Job was not too long ago."""
     connection.add_option('-S', '--ssl', action="store_true",
                         default=False,
                         help='If the connection requires ssl')
+    connection.add_option('--max-size', type='int',
+                        help='Stop reading replies larger than this, in bytes')
     parser.add_option_group(connection)
 
+    add_fetch_options(parser)
+
     extra = OptionGroup(parser, "Extra Options")
     extra.add_option('-v', action='store_true', dest='verbose',
                         default=False,
@@ -320,23 +348,41 @@ def main():
                         user_in['port'],
                         user_in['prefix'],
                         quote(user_in['job']),
-                        'lastSuccessfulBuild/api/python')
+                        'lastSuccessfulBuild/api/json?tree=' + BUILD_TREE)
 
     # Get the current time, no need to get the microseconds
     user_in['now'] = datetime.now().replace(microsecond=0)
 
     verboseprint("CLI Arguments : ", user_in)
 
-    jenkins_out = eval(get_data(user_in['url'],
+    context = fetch_context(user_in)
+    cache = context['cache']
+
+    timings = Timings()
+    reader = BodyReader(user_in['max_size'], timings)
+    jenkins_out = timings.timed('parse', json.loads, get_data(user_in['url'],
                         user_in['username'],
                         user_in['password'],
-                        user_in['timeout']))
+                        user_in['timeout'],
+                        reader=reader,
+                        timings=timings,
+                        **context))
+
+    if cache and cache.last_source != 'jenkins':
+        verboseprint("Cache hit (%s) for" % cache.last_source, user_in['url'])
+    if reader.transferred:
+        verboseprint("Transfer : %s bytes, %s bytes decoded" % (
+                        reader.transferred, reader.decoded))
 
     verboseprint("Reply from server :", jenkins_out)
 
-    status, message = check_result(user_in, jenkins_out)
+    status, message = timings.timed('check', check_result, user_in,
+                                    jenkins_out)
 
-    print '%s - %s' % (status, message)
+    # Job figures first, then where the time of the check itself went
+    print '%s - %s | %s %s' % (status, message,
+                               perfdata(user_in, jenkins_out),
+                               timings.perfdata())
     # Exit statuses recognized by Nagios
     if   status == 'OK':
         raise SystemExit, 0
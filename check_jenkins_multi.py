@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Run check_jenkins on jobs spread over several Jenkins masters, the masters
+are queried concurrently so a slow or dead one does not hold up the others.
+
+A target is a master and a job separated by spaces, either with -T or one
+per line in a --targets file (# starts a comment) :
+
+ ci-eu.example.com nightly build
+ ci-us.example.com release
+
+Every target shares the same -t budget (jenkins_http.Deadline) : a master
+trickling its replies cannot keep the plugin past the Nagios timeout.
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_multi.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+import json
+import threading
+import Queue
+
+from check_jenkins import CheckJenkins, BUILD_TREE
+from check_jenkins_batch import summary
+from jenkins_common import base_url, job_path, worst_status, nagios_exit
+from jenkins_common import nagios_output, add_deadline_options
+from jenkins_http import Deadline, describe_error, get_reply
+
+
+def parse_targets(lines):
+    """ (host, job) couples from the -T values or the --targets file
+
+    >>> parse_targets(['ci-eu nightly build', '# comment', '', ' ci-us  release '])
+    [('ci-eu', 'nightly build'), ('ci-us', 'release')]
+    >>> parse_targets(['ci-eu'])
+    Traceback (most recent call last):
+        ...
+    ValueError: Target without a job : ci-eu
+    """
+    targets = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split(None, 1)
+        if len(parts) != 2:
+            raise ValueError('Target without a job : %s' % line)
+        targets.append((parts[0], parts[1].strip()))
+    return targets
+
+
+def fan_out(targets, work, workers=16, per_master=2):
+    """
+    Call work(target) for every (host, ...) target, at most *per_master*
+    at a time on the same host and *workers* overall.
+    Returns the results in the order of *targets*, an exception raised by
+    work is returned in place of its result.
+
+    >>> fan_out([('a', 1), ('b', 2), ('a', 3)], lambda t: t[1] * 10)
+    [10, 20, 30]
+    >>> fan_out([('a', 0)], lambda t: 1 / t[1]) # doctest: +ELLIPSIS
+    [ZeroDivisionError(...)]
+    """
+    queues = {}
+    for index, target in enumerate(targets):
+        queues.setdefault(target[0], Queue.Queue()).put((index, target))
+
+    results = [None] * len(targets)
+    slots = threading.Semaphore(workers)
+
+    def consume(queue):
+        while True:
+            try:
+                index, target = queue.get_nowait()
+            except Queue.Empty:
+                return
+            slots.acquire()
+            try:
+                try:
+                    results[index] = work(target)
+                except Exception, error:
+                    results[index] = error
+            finally:
+                slots.release()
+
+    threads = []
+    for queue in queues.values():
+        for i in range(min(per_master, queue.qsize())):
+            thread = threading.Thread(target=consume, args=(queue,))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def target_url(params, host, job):
+    """ lastBuild url of a job on a given master
+
+    >>> target_url({'port': 80, 'prefix': '/', 'ssl': True}, 'ci', 'x') # doctest: +ELLIPSIS
+    'https://ci:443/job/x/lastBuild/api/json?tree=number,...'
+    """
+    return '%s%slastBuild/api/json?tree=%s' % (
+                base_url(dict(params, hostname=host)), job_path(job), BUILD_TREE)
+
+
+def check_target(params, target):
+    """ check_jenkins on one (host, job), errors become a status. The
+    Deadline of *params* is shared by every target. """
+    host, job = target
+    url = target_url(params, host, job)
+    try:
+        server = json.loads(get_reply(url, params['username'],
+                                      params['password'], params['timeout'],
+                                      deadline=params.get('deadline'),
+                                      retries=params.get('retries', 0)))
+    except Exception, error:
+        return describe_error(url, error)
+    job_params = dict(params, job='%s on %s' % (job, host))
+    return CheckJenkins().check_result(job_params, server)
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] (-T 'SERVER JOB' | --targets FILE) -w WARNING -c CRITICAL
+
+    Run check_jenkins on jobs of several Jenkins masters at once
+    Warning and Critical are defined in minutes
+
+    Ex :
+
+    check_jenkins_multi.py -T 'ci-eu nightly' -T 'ci-us nightly' -w 10 -c 42
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """A Nagios plugin to check Jenkins jobs on several
+masters concurrently."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-T', '--target', type='string', action='append',
+                        dest='targets', default=[],
+                        help="'SERVER JOB' to check, can be repeated")
+
+    parser.add_option('--targets', type='string', dest='targets_file',
+                        help='File with one SERVER JOB per line')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    concurrency = OptionGroup(parser, "Concurrency Options")
+    concurrency.add_option('--workers', type='int', default=16,
+                        help='Maximum number of requests at once')
+    concurrency.add_option('--per-master', type='int', default=2,
+                        help='Maximum number of requests at once on a master')
+    parser.add_option_group(concurrency)
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options, the same "
+                    "for every master")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    add_deadline_options(connection)
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    parser.add_option_group(connection)
+
+    extra = OptionGroup(parser, "Extra Options")
+    extra.add_option('-v', action='store_true', dest='verbose',
+                        default=False,
+                        help='Verbose mode')
+    parser.add_option_group(extra)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    lines = options.targets
+    if options.targets_file:
+        try:
+            lines = lines + open(options.targets_file).readlines()
+        except IOError, error:
+            print "UNKNOWN - %s" % error
+            raise SystemExit, 3
+    try:
+        options.targets = parse_targets(lines)
+    except ValueError, error:
+        print "UNKNOWN - %s" % error
+        raise SystemExit, 3
+
+    if (options.targets == []):
+        print "\n-T 'SERVER JOB' or --targets FILE"
+        print "\nWe need at least one job to check"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None):
+        print "\n-w MINUTES"
+        print "\nHow many minutes the jobs should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.critical == None):
+        print "\n-c MINUTES"
+        print "\nHow many minutes maximum the jobs should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    # Command Line Parameters
+    user_in = controller()
+
+    if user_in['verbose']:
+        def verboseprint(*args):
+            """ http://stackoverflow.com/a/5980173 print only when verbose ON"""
+            # Print each argument separately so caller doesn't need to
+            # stuff everything to be printed into a single string
+            print
+            for arg in args:
+                print arg,
+            print
+    else:
+        verboseprint = lambda *a: None      # do-nothing function
+
+    # Get the current time, no need to get the microseconds
+    user_in['now'] = datetime.now().replace(microsecond=0)
+
+    verboseprint("CLI Arguments : ", user_in)
+
+    # One budget for every master, not one per request
+    user_in['deadline'] = Deadline(user_in['timeout'],
+                                   user_in['connect_timeout'],
+                                   user_in['tls_timeout'])
+    results = fan_out(user_in['targets'],
+                      lambda target: check_target(user_in, target),
+                      user_in['workers'], user_in['per_master'])
+
+    lines = []
+    for target, result in zip(user_in['targets'], results):
+        if isinstance(result, Exception):
+            result = ('UNKNOWN', '%s on %s : %s' % (target[1], target[0],
+                                                    result))
+        lines.append((target, result[0], result[1]))
+
+    print summary(lines)
+    for target, status, message in lines:
+        print nagios_output('%s - %s' % (status, message))
+
+    nagios_exit(worst_status([status for target, status, msg in lines]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Check the executors of the Jenkins agents per label : a job running long
+is often waiting for a busy or offline agent rather than slow itself.
+
+Every agent comes from a single request
+ computer/api/json?tree=computer[displayName,offline,executors[idle],assignedLabels[name]]
+the busy ratio of each label is the share of busy executors among the
+online agents carrying it. With --cache, one service per label shares the
+same reply.
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_nodes.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+import json
+
+from check_jenkins import CheckJenkins
+from check_jenkins_batch import summary
+from jenkins_common import base_url, worst_status, nagios_exit
+from jenkins_common import add_deadline_options, add_fetch_options
+from jenkins_common import fetch_context, nagios_output
+from jenkins_http import BodyReader, Timings
+
+# The executors are counted from their list, numExecutors is not needed
+COMPUTER_TREE = ('computer[displayName,offline,executors[idle],'
+                 'assignedLabels[name]]')
+
+
+def computer_url(params):
+    """
+    >>> computer_url({'hostname': 'ci', 'port': 80, 'prefix': '/', 'ssl': False}) # doctest: +ELLIPSIS
+    'http://ci:80/computer/api/json?tree=computer[displayName,offline,...]'
+    """
+    return '%scomputer/api/json?tree=%s' % (base_url(params), COMPUTER_TREE)
+
+
+def label_usage(reply):
+    """
+    {label: {'busy': n, 'executors': n, 'online': n, 'offline': n}}, the
+    executors of offline agents are not counted. The label an agent gets
+    from its own name is left out.
+
+    >>> usage = label_usage({'computer': [
+    ...     {'displayName': 'a1', 'offline': False, 'executors': [{'idle': False}, {'idle': True}],
+    ...      'assignedLabels': [{'name': 'a1'}, {'name': 'linux'}]},
+    ...     {'displayName': 'a2', 'offline': True, 'executors': [{'idle': True}],
+    ...      'assignedLabels': [{'name': 'a2'}, {'name': 'linux'}]}]})
+    >>> usage['linux'] == {'busy': 1, 'executors': 2, 'online': 1, 'offline': 1}
+    True
+    >>> sorted(usage)
+    ['all', 'linux']
+    """
+    usage = {}
+    for computer in reply.get('computer', []):
+        labels = [label['name'].encode('utf-8')
+                  for label in computer.get('assignedLabels', [])
+                  if label['name'] != computer.get('displayName')]
+        executors = computer.get('executors') or []
+        for label in labels + ['all']:
+            counts = usage.setdefault(label, {'busy': 0, 'executors': 0,
+                                              'online': 0, 'offline': 0})
+            if computer.get('offline'):
+                counts['offline'] += 1
+                continue
+            counts['online'] += 1
+            counts['executors'] += len(executors)
+            counts['busy'] += len([executor for executor in executors
+                                   if not executor.get('idle')])
+    return usage
+
+
+def check_label(params, label, counts):
+    """ Status of a label from its counts, None when no agent has it
+
+    >>> in_p = {'warning': 80, 'critical': 95, 'offline_warning': 1, 'offline_critical': None}
+    >>> check_label(in_p, 'linux', {'busy': 17, 'executors': 20, 'online': 5, 'offline': 0})
+    ('WARNING', 'linux : 17 of 20 executors busy (85%) on 5 agents, 0 offline')
+    >>> check_label(in_p, 'docker', {'busy': 0, 'executors': 0, 'online': 0, 'offline': 2})[0]
+    'CRITICAL'
+    >>> check_label(in_p, 'gpu', None)
+    ('UNKNOWN', 'gpu : no agent has this label')
+    """
+    if counts is None:
+        return ('UNKNOWN', '%s : no agent has this label' % label)
+
+    msg = '%s : %s of %s executors busy (%s%%) on %s agents, %s offline' % (
+                label, counts['busy'], counts['executors'],
+                busy_ratio(counts), counts['online'], counts['offline'])
+    if not counts['executors']:
+        return ('CRITICAL', '%s : no executor online, %s agents offline' % (
+                                label, counts['offline']))
+
+    statuses = ['OK']
+    if busy_ratio(counts) >= params['critical']:
+        statuses.append('CRITICAL')
+    elif busy_ratio(counts) >= params['warning']:
+        statuses.append('WARNING')
+    if (params['offline_critical'] is not None and
+            counts['offline'] >= params['offline_critical']):
+        statuses.append('CRITICAL')
+    elif (params['offline_warning'] is not None and
+            counts['offline'] >= params['offline_warning']):
+        statuses.append('WARNING')
+    return (worst_status(statuses), msg)
+
+
+def busy_ratio(counts):
+    """ Percentage of busy executors, rounded down """
+    if not counts['executors']:
+        return 100
+    return counts['busy'] * 100 / counts['executors']
+
+
+def check_nodes(params, reply):
+    """ (label, status, message) of params['labels'], of every label when
+    none is given """
+    usage = label_usage(reply)
+    labels = params['labels'] or sorted(usage)
+    return [(label,) + check_label(params, label, usage.get(label))
+            for label in labels]
+
+
+def perfdata(params, reply):
+    """ Busy ratio of every label checked, offline agents overall """
+    usage = label_usage(reply)
+    labels = params['labels'] or sorted(usage)
+    fields = ["'%s_busy'=%s%%;%s;%s;0;100" % (label, busy_ratio(usage[label]),
+                                              params['warning'],
+                                              params['critical'])
+              for label in labels if label in usage]
+    fields.append('offline=%s' % usage.get('all', {}).get('offline', 0))
+    return ' '.join(fields)
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER [-l LABEL,LABEL] -w WARNING -c CRITICAL
+
+    Make sure the agents carrying a label have free executors
+    Warning and Critical are percentages of busy executors
+
+    Ex :
+
+    check_jenkins_nodes.py -H ci.jenkins-ci.org -l docker -w 80 -c 95
+    will check that less than 80 (warn) 95 percent (critical) of the
+    executors of the agents labelled docker are busy
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """A Nagios plugin to check the executors and agents of
+a Jenkins server per label."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-l', '--label', type='string', action='append',
+                        dest='labels', default=[],
+                        help='Label to check, can be repeated or comma '
+                             'separated, all for every agent, every label '
+                             'if not set')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold, percentage of busy executors')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold, percentage of busy executors')
+
+    parser.add_option('--offline-warning', type='int',
+                        help='Warning when that many agents are offline')
+
+    parser.add_option('--offline-critical', type='int',
+                        help='Critical when that many agents are offline')
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    add_deadline_options(connection)
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    connection.add_option('--max-size', type='int',
+                        help='Stop reading replies larger than this, in bytes')
+    parser.add_option_group(connection)
+
+    add_fetch_options(parser)
+
+    extra = OptionGroup(parser, "Extra Options")
+    extra.add_option('-v', action='store_true', dest='verbose',
+                        default=False,
+                        help='Verbose mode')
+    parser.add_option_group(extra)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None or options.critical == None):
+        print "\n-w PERCENT -c PERCENT"
+        print "\nHow busy may the executors be ?"
+        print usage()
+        raise SystemExit, 2
+
+    # -l a,b -l c
+    options.labels = [label for labels in options.labels
+                      for label in labels.split(',') if label]
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    # Command Line Parameters
+    user_in = controller()
+
+    if user_in['verbose']:
+        def verboseprint(*args):
+            """ http://stackoverflow.com/a/5980173 print only when verbose ON"""
+            # Print each argument separately so caller doesn't need to
+            # stuff everything to be printed into a single string
+            print
+            for arg in args:
+                print arg,
+            print
+    else:
+        verboseprint = lambda *a: None      # do-nothing function
+
+    user_in['url'] = computer_url(user_in)
+
+    verboseprint("CLI Arguments : ", user_in)
+
+    context = fetch_context(user_in)
+    cache = context['cache']
+
+    timings = Timings()
+    reader = BodyReader(user_in['max_size'], timings)
+    jenkins_out = timings.timed('parse', json.loads,
+                        CheckJenkins().get_data(user_in['url'],
+                        user_in['username'],
+                        user_in['password'],
+                        user_in['timeout'],
+                        reader=reader,
+                        timings=timings,
+                        **context))
+
+    if cache and cache.last_source != 'jenkins':
+        verboseprint("Cache hit (%s) for" % cache.last_source, user_in['url'])
+
+    verboseprint("Reply from server :", jenkins_out)
+
+    results = timings.timed('check', check_nodes, user_in, jenkins_out)
+    performance = '%s %s' % (perfdata(user_in, jenkins_out),
+                             timings.perfdata())
+
+    if len(user_in['labels']) == 1:
+        label, status, message = results[0]
+        print nagios_output('%s - %s | %s' % (status, message, performance))
+    else:
+        print '%s | %s' % (summary(results, 'labels'), performance)
+        for label, status, message in results:
+            print nagios_output('%s - %s' % (status, message))
+
+    nagios_exit(worst_status([status for label, status, msg in results]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Check every job of a Jenkins server, view or folder in one process and
+submit the results to Nagios as passive checks : one scheduled run instead
+of one active check (one process, one request) per job.
+
+The jobs are checked like check_jenkins_batch does, the results go to a
+sink :
+ - command-file : PROCESS_SERVICE_CHECK_RESULT lines in the Nagios
+   external command file
+ - nsca : the send_nsca input format, piped to send_nsca
+ - stdout : the command file lines, to see what would be submitted
+
+http://nagios.sourceforge.net/docs/3_0/passivechecks.html
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_passive.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+import json
+import os
+import select
+import sys
+import time
+
+from check_jenkins import CheckJenkins
+from check_jenkins_batch import tree_url, batch_root, check_jobs, summary
+from jenkins_common import NAGIOS_CODES, nagios_exit, add_deadline_options
+from jenkins_http import Deadline
+
+
+def passive_results(params, results):
+    """ (host, service, code, output) of the check_jobs *results*
+
+    >>> passive_results({'nagios_host': 'ci', 'service_format': 'Jenkins %s'},
+    ...                 [('nightly', 'WARNING', 'nightly is marked as unstable')])
+    [('ci', 'Jenkins nightly', 1, 'WARNING - nightly is marked as unstable')]
+    """
+    return [(params['nagios_host'], params['service_format'] % name,
+             NAGIOS_CODES[status], '%s - %s' % (status, msg))
+            for name, status, msg in results]
+
+
+def clean(text):
+    """ Fields are separated by ; or tabs and results by new lines, the
+    lines are written as utf-8 bytes
+
+    >>> clean('a\\tb\\nc')
+    'a b c'
+    >>> clean(u'caf\\xe9')
+    'caf\\xc3\\xa9'
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return text.replace('\t', ' ').replace('\n', ' ')
+
+
+def command_lines(checks, now):
+    """ External commands submitting *checks* as passive results
+
+    >>> command_lines([('ci', 'Jenkins nightly', 0, 'OK - fine')], 1328483562)
+    '[1328483562] PROCESS_SERVICE_CHECK_RESULT;ci;Jenkins nightly;0;OK - fine\\n'
+    """
+    return ''.join(['[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%s;%s\n' % (
+                        now, clean(host), clean(service), code, clean(output))
+                    for host, service, code, output in checks])
+
+
+def nsca_lines(checks):
+    """ send_nsca input, one result per line
+
+    >>> nsca_lines([('ci', 'Jenkins nightly', 2, 'CRITICAL - failed')])
+    'ci\\tJenkins nightly\\t2\\tCRITICAL - failed\\n'
+    """
+    return ''.join(['%s\t%s\t%s\t%s\n' % (clean(host), clean(service), code,
+                                          clean(output))
+                    for host, service, code, output in checks])
+
+
+class CommandFileSink(object):
+    """
+    Nagios external command file. The lines are built in one buffer and
+    written in as few writes as possible : at most PIPE_BUF bytes of whole
+    lines each, the size the fifo writes atomically, so a line is never
+    mixed with the commands of another process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def submit(self, checks, now):
+        data = command_lines(checks, now)
+        handle = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            for chunk in self.chunks(data, select.PIPE_BUF):
+                while chunk:
+                    chunk = chunk[os.write(handle, chunk):]
+        finally:
+            os.close(handle)
+
+    def chunks(self, data, size):
+        """ Whole lines of *data*, grouped up to *size* bytes
+
+        >>> list(CommandFileSink(None).chunks('aa\\nbb\\ncc\\n', 6))
+        ['aa\\nbb\\n', 'cc\\n']
+        """
+        start = 0
+        while start < len(data):
+            end = data.rfind('\n', start, start + size) + 1
+            if end <= start:
+                # A single line longer than size
+                end = data.find('\n', start) + 1 or len(data)
+            yield data[start:end]
+            start = end
+
+
+class NscaSink(object):
+    """ send_nsca, to a Nagios on another host """
+
+    def __init__(self, host, send_nsca='send_nsca', config=None):
+        self.host = host
+        self.send_nsca = send_nsca
+        self.config = config
+
+    def submit(self, checks, now):
+        import subprocess
+        command = [self.send_nsca, '-H', self.host]
+        if self.config:
+            command.extend(['-c', self.config])
+        process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate(nsca_lines(checks))[0]
+        if process.returncode:
+            raise IOError('%s failed : %s' % (self.send_nsca, output.strip()))
+
+
+class StdoutSink(object):
+    """ The command file lines on stdout, nothing is submitted """
+
+    def submit(self, checks, now):
+        sys.stdout.write(command_lines(checks, now))
+
+
+def make_sink(params):
+    """ Sink of the --sink option """
+    if params['sink'] == 'command-file':
+        return CommandFileSink(params['command_file'])
+    elif params['sink'] == 'nsca':
+        return NscaSink(params['nsca_host'], params['send_nsca'],
+                        params['nsca_config'])
+    return StdoutSink()
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER [-j JOB,JOB | --view VIEW | --folder FOLDER] -w WARNING -c CRITICAL --nagios-host HOST
+
+    Check many Jenkins jobs with a single call to the Jenkins api and
+    submit the results to Nagios as passive checks
+    Warning and Critical are defined in minutes
+
+    Ex :
+
+    check_jenkins_passive.py -H ci.jenkins-ci.org --view nightly -w 10 -c 42 --nagios-host ci.jenkins-ci.org
+    will submit the result of every job of the view nightly to the
+    service 'Jenkins JOB' of the Nagios host ci.jenkins-ci.org
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """Check many Jenkins jobs at once and submit the results
+to Nagios as passive checks."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-j', '--job', type='string', action='append',
+                        dest='jobs', default=[],
+                        help='Job to check, can be repeated or comma separated')
+
+    parser.add_option('--view', type='string',
+                        help='Check the jobs of this view')
+
+    parser.add_option('--folder', type='string',
+                        help='Check the jobs of this folder, ex: team/data')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    parser.add_option('--rules', type='string', metavar='FILE',
+                        help='Thresholds and checks per job, -w and -c are '
+                             'for the jobs no rule matches, see jenkins_rules.py')
+
+    lsb = OptionGroup(parser, "Last Successful Build Options",
+                    "Also run check_jenkins_lsb on each job")
+    lsb.add_option('--lsb-warning', type='string',
+                        help='Warning threshold, units s, m, h, d')
+    lsb.add_option('--lsb-critical', type='string',
+                        help='Critical threshold, units s, m, h, d')
+    parser.add_option_group(lsb)
+
+    passive = OptionGroup(parser, "Passive Check Options",
+                    "Where the results go")
+    passive.add_option('--nagios-host', type='string',
+                        help='Nagios host of the services, default -H')
+    passive.add_option('--service-format', type='string',
+                        default='Jenkins %s',
+                        help="Service name, %s is the job, default 'Jenkins %s'")
+    passive.add_option('--sink', type='choice', default='command-file',
+                        choices=['command-file', 'nsca', 'stdout'],
+                        help='command-file, nsca or stdout')
+    passive.add_option('--command-file', type='string',
+                        default='/usr/local/nagios/var/rw/nagios.cmd',
+                        help='Nagios external command file')
+    passive.add_option('--nsca-host', type='string',
+                        help='NSCA server, for the nsca sink')
+    passive.add_option('--send-nsca', type='string', default='send_nsca',
+                        help='send_nsca command')
+    passive.add_option('--nsca-config', type='string',
+                        help='send_nsca configuration file')
+    parser.add_option_group(passive)
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    add_deadline_options(connection)
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    parser.add_option_group(connection)
+
+    extra = OptionGroup(parser, "Extra Options")
+    extra.add_option('-v', action='store_true', dest='verbose',
+                        default=False,
+                        help='Verbose mode')
+    parser.add_option_group(extra)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None or options.critical == None):
+        print "\n-w MINUTES -c MINUTES"
+        print "\nHow many minutes the jobs should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    if (bool(options.lsb_warning) != bool(options.lsb_critical)):
+        print "\n--lsb-warning / --lsb-critical"
+        print "\nBoth thresholds are needed to check the last successful build"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.sink == 'nsca' and options.nsca_host == None):
+        print "\n--nsca-host HOST"
+        print "\nThe nsca sink needs the NSCA server"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.nagios_host == None):
+        options.nagios_host = options.hostname
+
+    # -j a,b -j c
+    options.jobs = [job for jobs in options.jobs
+                    for job in jobs.split(',') if job]
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    # Command Line Parameters
+    user_in = controller()
+
+    if user_in['verbose']:
+        def verboseprint(*args):
+            """ http://stackoverflow.com/a/5980173 print only when verbose ON"""
+            # Print each argument separately so caller doesn't need to
+            # stuff everything to be printed into a single string
+            print
+            for arg in args:
+                print arg,
+            print
+    else:
+        verboseprint = lambda *a: None      # do-nothing function
+
+    user_in['url'] = tree_url(batch_root(user_in))
+
+    # Get the current time, no need to get the microseconds
+    user_in['now'] = datetime.now().replace(microsecond=0)
+
+    verboseprint("CLI Arguments : ", user_in)
+
+    if user_in['rules']:
+        from jenkins_rules import load_index
+        user_in['rules'] = load_index(user_in['rules'])
+
+    jenkins_out = json.loads(CheckJenkins().get_data(user_in['url'],
+                        user_in['username'],
+                        user_in['password'],
+                        user_in['timeout'],
+                        deadline=Deadline(user_in['timeout'],
+                                          user_in['connect_timeout'],
+                                          user_in['tls_timeout']),
+                        retries=user_in['retries']))
+
+    results = check_jobs(user_in, jenkins_out)
+    checks = passive_results(user_in, results)
+
+    try:
+        make_sink(user_in).submit(checks, time.time())
+    except (IOError, OSError), error:
+        print 'UNKNOWN - %s results not submitted : %s' % (len(checks), error)
+        nagios_exit('UNKNOWN')
+
+    # The jobs have their own services, this run is OK once they got them
+    print 'OK - %s results submitted to %s (%s)' % (len(checks),
+                                user_in['sink'], summary(results))
+    nagios_exit('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Check how long jobs have been waiting in the Jenkins build queue : a job
+starved of executors never gets a new lastBuild, check_jenkins keeps
+showing the previous one.
+
+The queue is read once with
+ queue/api/json?tree=items[inQueueSince,why,stuck,blocked,buildable,task[name,url]]
+and indexed by job, every job asked for is then checked from that single
+reply. With --cache, one service per job shares the same reply.
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_queue.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+import json
+import re
+
+from check_jenkins import CheckJenkins
+from check_jenkins_batch import summary
+from jenkins_common import base_url, worst_status, nagios_exit, unquote
+from jenkins_common import add_deadline_options, add_fetch_options
+from jenkins_common import fetch_context, nagios_output
+from jenkins_http import BodyReader, Timings
+
+QUEUE_TREE = ('items[inQueueSince,why,stuck,blocked,buildable,'
+              'task[name,url]]')
+
+
+def queue_url(params):
+    """
+    >>> queue_url({'hostname': 'ci', 'port': 80, 'prefix': '/', 'ssl': False}) # doctest: +ELLIPSIS
+    'http://ci:80/queue/api/json?tree=items[inQueueSince,...,task[name,url]]'
+    """
+    return '%squeue/api/json?tree=%s' % (base_url(params), QUEUE_TREE)
+
+
+def task_name(task):
+    """ Whole path of the job of a queue item, folders included
+
+    >>> task_name({'name': 'master', 'url': 'http://ci/job/team/job/my%20app/job/master/'})
+    'team/my app/master'
+    >>> task_name({'name': 'nightly'})
+    'nightly'
+    """
+    names = re.findall(r'job/([^/]+)/', task.get('url') or '')
+    if names:
+        return '/'.join([unquote(name) for name in names])
+    return task['name'].encode('utf-8')
+
+
+def index_queue(reply):
+    """ {job: its item waiting the longest}
+
+    >>> index_queue({'items': [{'task': {'name': 'a'}, 'inQueueSince': 20},
+    ...                        {'task': {'name': 'a'}, 'inQueueSince': 10}]})
+    {'a': {'task': {'name': 'a'}, 'inQueueSince': 10}}
+    """
+    index = {}
+    for item in reply.get('items', []):
+        name = task_name(item.get('task') or {})
+        if name not in index or item['inQueueSince'] < index[name]['inQueueSince']:
+            index[name] = item
+    return index
+
+
+def waiting_seconds(params, item):
+    waiting = params['now'] - datetime.fromtimestamp(
+                                int(item['inQueueSince']) / 1000)
+    return max(0, waiting.seconds + waiting.days * 86400)
+
+
+def check_queued(params, name, item):
+    """ Status of *name* from its queue *item*, None when it is not queued
+
+    >>> in_p = {'warning': 10, 'critical': 45, 'now': datetime.fromtimestamp(1328487161)}
+    >>> check_queued(in_p, 'test', None)
+    ('OK', 'test is not waiting in the queue')
+    >>> check_queued(in_p, 'test', {'inQueueSince': 1328483562000,
+    ...     'why': 'Waiting for next available executor', 'stuck': True})
+    ('CRITICAL', 'test has been waiting in the queue for 00:59:59 (stuck) : Waiting for next available executor')
+    """
+    if item is None:
+        return ('OK', '%s is not waiting in the queue' % name)
+
+    seconds = waiting_seconds(params, item)
+    if seconds >= params['critical'] * 60:
+        status = 'CRITICAL'
+    elif seconds >= params['warning'] * 60:
+        status = 'WARNING'
+    else:
+        status = 'OK'
+    flags = [flag for flag in ('stuck', 'blocked') if item.get(flag)]
+    msg = '%s has been waiting in the queue for %s%s : %s' % (
+                name, CheckJenkins().seconds2human(seconds),
+                flags and ' (%s)' % ', '.join(flags) or '',
+                (item.get('why') or '').strip())
+    return (status, msg)
+
+
+def check_queue(params, reply):
+    """ (job, status, message) of params['jobs'], of every queued job when
+    none is given, in one pass over the queue """
+    index = index_queue(reply)
+    names = params['jobs'] or sorted(index)
+    return [(name,) + check_queued(params, name, index.get(name))
+            for name in names]
+
+
+def perfdata(params, reply):
+    """ Queue length and longest wait against the thresholds """
+    index = index_queue(reply)
+    if params['jobs']:
+        index = dict([(name, item) for name, item in index.items()
+                      if name in params['jobs']])
+    longest = max([0] + [waiting_seconds(params, item)
+                         for item in index.values()])
+    return 'queued=%s wait=%ss;%s;%s;0' % (len(index), longest,
+                                           params['warning'] * 60,
+                                           params['critical'] * 60)
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER [-j JOB,JOB] -w WARNING -c CRITICAL
+
+    Make sure jobs are not waiting too long in the build queue
+    Warning and Critical are defined in minutes
+
+    Ex :
+
+    check_jenkins_queue.py -H ci.jenkins-ci.org -j infa_release.rss -w 10 -c 42
+    will check that infa_release.rss is not waiting for more than
+    10 (warn) 42 minutes (critical) to start
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """A Nagios plugin to check the wait of Jenkins jobs in
+the build queue."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-j', '--job', type='string', action='append',
+                        dest='jobs', default=[],
+                        help='Job to check, can be repeated or comma '
+                             'separated, every queued job if not set')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    add_deadline_options(connection)
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    connection.add_option('--max-size', type='int',
+                        help='Stop reading replies larger than this, in bytes')
+    parser.add_option_group(connection)
+
+    add_fetch_options(parser)
+
+    extra = OptionGroup(parser, "Extra Options")
+    extra.add_option('-v', action='store_true', dest='verbose',
+                        default=False,
+                        help='Verbose mode')
+    parser.add_option_group(extra)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None or options.critical == None):
+        print "\n-w MINUTES -c MINUTES"
+        print "\nHow many minutes may a job wait in the queue ?"
+        print usage()
+        raise SystemExit, 2
+
+    # -j a,b -j c
+    options.jobs = [job for jobs in options.jobs
+                    for job in jobs.split(',') if job]
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    # Command Line Parameters
+    user_in = controller()
+
+    if user_in['verbose']:
+        def verboseprint(*args):
+            """ http://stackoverflow.com/a/5980173 print only when verbose ON"""
+            # Print each argument separately so caller doesn't need to
+            # stuff everything to be printed into a single string
+            print
+            for arg in args:
+                print arg,
+            print
+    else:
+        verboseprint = lambda *a: None      # do-nothing function
+
+    user_in['url'] = queue_url(user_in)
+
+    # Get the current time, no need to get the microseconds
+    user_in['now'] = datetime.now().replace(microsecond=0)
+
+    verboseprint("CLI Arguments : ", user_in)
+
+    context = fetch_context(user_in)
+    cache = context['cache']
+
+    timings = Timings()
+    reader = BodyReader(user_in['max_size'], timings)
+    jenkins_out = timings.timed('parse', json.loads,
+                        CheckJenkins().get_data(user_in['url'],
+                        user_in['username'],
+                        user_in['password'],
+                        user_in['timeout'],
+                        reader=reader,
+                        timings=timings,
+                        **context))
+
+    if cache and cache.last_source != 'jenkins':
+        verboseprint("Cache hit (%s) for" % cache.last_source, user_in['url'])
+
+    verboseprint("Reply from server :", jenkins_out)
+
+    results = timings.timed('check', check_queue, user_in, jenkins_out)
+    performance = '%s %s' % (perfdata(user_in, jenkins_out),
+                             timings.perfdata())
+
+    if len(user_in['jobs']) == 1:
+        name, status, message = results[0]
+        print nagios_output('%s - %s | %s' % (status, message, performance))
+    else:
+        print '%s | %s' % (summary(results), performance)
+        for name, status, message in results:
+            print nagios_output('%s - %s' % (status, message))
+
+    nagios_exit(worst_status([status for name, status, msg in results]))
+
+
+if __name__ == '__main__':
+    main()
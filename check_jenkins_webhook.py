@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Check the Jenkins jobs when they change instead of polling them : Jenkins
+posts a notification when a build starts and when it completes (the
+Notification plugin, JSON format), this listener updates that job only,
+runs its check and submits the result to Nagios as a passive check, like
+check_jenkins_passive.py does.
+
+ https://plugins.jenkins.io/notification/
+
+Notifications can be lost, so Jenkins is still polled, but rarely : every
+--reconcile seconds a single tree= request replaces the state of every job
+and all of them are checked again. In between, the builds still running
+are checked against the thresholds every --recheck seconds from memory,
+without asking Jenkins.
+
+ $ python check_jenkins_webhook.py -H ci.example.com -w 60 -c 120 --listen :9119 --token s3cret
+
+and, in the Notification plugin of each job, the url
+ http://monitoring.example.com:9119/?token=s3cret
+
+Few doctests, run with :
+ $ python -m doctest check_jenkins_webhook.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser, OptionGroup
+from datetime import datetime
+from urllib import unquote
+import BaseHTTPServer
+import SocketServer
+import cgi
+import json
+import re
+import threading
+import time
+
+from check_jenkins_batch import tree_url, batch_root, check_jobs
+from check_jenkins_passive import passive_results, make_sink
+from jenkins_http import ConnectionPool
+from jenkins_state import BuildState
+
+# A notification is a few hundred bytes, anything larger is not one
+MAX_PAYLOAD = 65536
+
+
+def job_name(url, folder=None):
+    """ Name of a job from the url of a notification, relative to *folder*,
+    None when the job is not in it
+
+    >>> job_name('job/nightly/')
+    u'nightly'
+    >>> job_name('job/team/job/data/job/my%20app/', 'team/data')
+    u'my app'
+    >>> job_name('job/other/job/app/', 'team/data')
+    """
+    names = [unquote(name.encode('utf-8')).decode('utf-8')
+             for name in re.findall(r'job/([^/]+)/', url)]
+    if folder:
+        if isinstance(folder, str):
+            folder = folder.decode('utf-8')
+        prefix = folder.strip('/').split('/')
+        if names[:len(prefix)] != prefix:
+            return None
+        names = names[len(prefix):]
+    return u'/'.join(names) or None
+
+
+def notification_build(build, now):
+    """ lastBuild record, as the api sends it, of the build of a
+    notification, None for the phases not changing it
+
+    >>> sorted(notification_build({'number': 7, 'phase': 'STARTED',
+    ...     'full_url': 'http://ci/job/test/7/', 'timestamp': 1328483562000}, 0).items())
+    [('building', True), ('duration', 0), ('number', 7), ('result', None), ('timestamp', 1328483562000), ('url', 'http://ci/job/test/7/')]
+    >>> notification_build({'number': 7, 'phase': 'COMPLETED', 'status': 'FAILURE',
+    ...     'full_url': 'http://ci/job/test/7/', 'timestamp': 1328483562000}, 1328483600)['duration']
+    38000
+    >>> notification_build({'number': 7, 'phase': 'QUEUED'}, 0)
+    """
+    phase = build.get('phase')
+    if phase not in ('STARTED', 'COMPLETED', 'FINALIZED'):
+        return None
+    timestamp = build.get('timestamp') or int(now * 1000)
+    record = {'number': build['number'],
+              'building': phase == 'STARTED',
+              'timestamp': timestamp,
+              'url': build.get('full_url') or build.get('url'),
+              'duration': 0,
+              'result': None}
+    if phase != 'STARTED':
+        record['result'] = build.get('status')
+        # Older plugins do not send the duration
+        record['duration'] = build.get('duration', max(0,
+                                    int(now * 1000) - timestamp))
+    return record
+
+
+class JobStates(object):
+    """
+    The last build and last successful build of every job, from the
+    reconciliation polls and the notifications in between, kept as
+    jenkins_state.BuildState records
+
+    >>> states = JobStates()
+    >>> states.reconcile({'jobs': [{'name': u'test', 'lastBuild': {'number': 6,
+    ...     'building': False, 'result': 'SUCCESS'}}]})
+    [u'test']
+    >>> states.notify({'url': 'job/test/', 'build': {'number': 7,
+    ...     'phase': 'STARTED', 'full_url': 'http://ci/job/test/7/'}})
+    u'test'
+    >>> states.notify({'url': 'job/test/', 'build': {'number': 6,
+    ...     'phase': 'COMPLETED', 'status': 'FAILURE'}})  # late, ignored
+    >>> states.notify({'url': 'job/test/', 'build': {'number': 7,
+    ...     'phase': 'COMPLETED', 'status': 'SUCCESS'}})
+    u'test'
+    >>> states.notify({'url': 'job/test/', 'build': {'number': 7,
+    ...     'phase': 'FINALIZED', 'status': 'SUCCESS'}})  # checked already
+    >>> states.notify({'url': 'job/unknown/', 'build': {'number': 1,
+    ...     'phase': 'STARTED'}})
+    >>> states.job(u'test')['lastBuild']['result'], states.ignored
+    ('SUCCESS', 3)
+    """
+
+    def __init__(self, jobs=None, folder=None):
+        self.jobs = jobs and set(jobs)
+        self.folder = folder
+        self.ignored = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def reconcile(self, reply):
+        """ Replace every job by the api reply (the tree_url projection),
+        returns their names """
+        jobs = {}
+        for job in reply.get('jobs', []):
+            if self.jobs and job['name'] not in self.jobs:
+                continue
+            jobs[job['name']] = (
+                    BuildState.from_build(job.get('lastBuild')),
+                    BuildState.from_build(job.get('lastSuccessfulBuild')))
+        self._lock.acquire()
+        try:
+            self._jobs = jobs
+        finally:
+            self._lock.release()
+        return sorted(jobs)
+
+    def notify(self, payload, now=None):
+        """ Apply a notification, returns the name of the job it changed,
+        None when it changed nothing. Jobs not in the last poll are left
+        to the next one. """
+        now = now or time.time()
+        name = job_name(payload.get('url') or '', self.folder)
+        build = notification_build(payload.get('build') or {}, now)
+        self._lock.acquire()
+        try:
+            job = self._jobs.get(name)
+            if job is None or build is None:
+                self.ignored += 1
+                return None
+            last, success = job
+            if last and (build['number'] < last.number or
+                         (build['number'] == last.number and
+                          not last.building)):
+                # Older than what we know, notifications may come late, or
+                # a build already finished : FINALIZED follows COMPLETED
+                self.ignored += 1
+                return None
+            last = BuildState.from_build(build)
+            if build['result'] == 'SUCCESS':
+                success = last
+            self._jobs[name] = (last, success)
+            return name
+        finally:
+            self._lock.release()
+
+    def job(self, name):
+        """ The job as in the api reply, check_jobs takes it """
+        self._lock.acquire()
+        try:
+            job = self._jobs.get(name)
+        finally:
+            self._lock.release()
+        if job is None:
+            return None
+        return {'name': name, 'lastBuild': job[0],
+                'lastSuccessfulBuild': job[1]}
+
+    def running(self):
+        """ Names of the jobs with a build running """
+        self._lock.acquire()
+        try:
+            return sorted([name for name, (last, success) in self._jobs.items()
+                           if last and last.building])
+        finally:
+            self._lock.release()
+
+
+class JobMonitor(object):
+    """
+    Check the jobs named and submit their results to the sink of
+    check_jenkins_passive. *params* are the options of this script.
+    """
+
+    def __init__(self, params, states, sink):
+        self.params = params
+        self.states = states
+        self.sink = sink
+        self.submitted = 0
+        self.last_error = None
+
+    def check(self, names):
+        """ check_jenkins_batch.check_jobs on *names* only """
+        jobs = [job for job in [self.states.job(name) for name in names]
+                if job is not None]
+        if not jobs:
+            return []
+        params = dict(self.params, jobs=[job['name'] for job in jobs],
+                      now=datetime.now().replace(microsecond=0))
+        results = check_jobs(params, {'jobs': jobs})
+        checks = passive_results(self.params, results)
+        try:
+            self.sink.submit(checks, time.time())
+            self.submitted += len(checks)
+        except (IOError, OSError), error:
+            self.last_error = '%s results not submitted : %s' % (
+                                len(checks), error)
+        return results
+
+    def notify(self, payload):
+        """ A notification, the job it changed is checked """
+        name = self.states.notify(payload)
+        if name is None:
+            return []
+        return self.check([name])
+
+
+class Reconciler(threading.Thread):
+    """
+    Every *recheck* seconds, check the builds still running from memory.
+    Every *reconcile* seconds, poll every job with one tree= request and
+    check them all.
+    """
+
+    def __init__(self, monitor, url, pool, recheck=60, reconcile=900):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.monitor = monitor
+        self.url = url
+        self.pool = pool
+        self.recheck = recheck
+        self.reconcile = reconcile
+        self.polled = None
+        self.stopped = threading.Event()
+
+    def poll(self):
+        """ One round trip to Jenkins, every job is checked again """
+        params = self.monitor.params
+        try:
+            body = self.pool.get(self.url, params['username'],
+                                 params['password'])
+            names = self.monitor.states.reconcile(json.loads(body))
+            self.monitor.last_error = None
+        except Exception, error:
+            self.monitor.last_error = 'Error on %s : %s' % (self.url, error)
+            return []
+        finally:
+            self.polled = time.time()
+        return self.monitor.check(names)
+
+    def tick(self):
+        if self.polled is None or time.time() - self.polled >= self.reconcile:
+            self.poll()
+        else:
+            self.monitor.check(self.monitor.states.running())
+
+    def run(self):
+        while not self.stopped.isSet():
+            started = time.time()
+            self.tick()
+            self.stopped.wait(max(0, self.recheck - (time.time() - started)))
+
+
+class WebhookHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ POST of a notification, answered once its job is checked """
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, code, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def do_POST(self):
+        path, _, query = self.path.partition('?')
+        token = self.server.token
+        if token and cgi.parse_qs(query).get('token') != [token]:
+            self.reply(403, 'Forbidden\n')
+            return
+        try:
+            length = int(self.headers.getheader('Content-Length'))
+        except (TypeError, ValueError):
+            length = -1
+        if length < 0:
+            # Where the body ends is unknown, the connection cannot be reused
+            self.reply(400, 'Content-Length needed\n')
+            self.close_connection = 1
+            return
+        if length > MAX_PAYLOAD:
+            self.reply(413, 'Too large\n')
+            self.close_connection = 1
+            return
+        try:
+            payload = json.loads(self.rfile.read(length))
+            if not isinstance(payload, dict):
+                raise ValueError('not an object')
+        except ValueError:
+            self.reply(400, 'Invalid notification\n')
+            return
+        results = self.server.monitor.notify(payload)
+        self.reply(200, ''.join(['%s - %s\n' % (status, msg)
+                                 for name, status, msg in results]))
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhookServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, monitor, token=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, WebhookHandler)
+        self.monitor = monitor
+        self.token = token
+
+
+def usage():
+    """
+    Return usage text so it can be used on failed human interactions
+    """
+
+    usage_string = """
+    usage: %prog [options] -H SERVER [-j JOB,JOB | --view VIEW | --folder FOLDER] -w WARNING -c CRITICAL --nagios-host HOST
+
+    Check the Jenkins jobs when Jenkins notifies a build started or
+    completed and submit the results to Nagios as passive checks
+    Warning and Critical are defined in minutes
+
+    Ex :
+
+    check_jenkins_webhook.py -H ci.jenkins-ci.org --view nightly -w 10 -c 42 --listen :9119
+    with http://THIS_HOST:9119/ in the Notification plugin of the jobs
+
+    """
+    return usage_string
+
+
+def controller():
+    """
+    Parse user input, fail quick if not enough parameters
+    """
+
+    description = """Check Jenkins jobs on their build notifications and
+submit the results to Nagios as passive checks."""
+
+    version = "%prog " + __version__
+    parser = OptionParser(description=description, usage=usage(),
+                            version=version)
+    parser.set_defaults(verbose=False)
+
+    parser.add_option('-H', '--hostname', type='string',
+                        help='Jenkins hostname')
+
+    parser.add_option('-j', '--job', type='string', action='append',
+                        dest='jobs', default=[],
+                        help='Job to check, can be repeated or comma separated')
+
+    parser.add_option('--view', type='string',
+                        help='Check the jobs of this view')
+
+    parser.add_option('--folder', type='string',
+                        help='Check the jobs of this folder, ex: team/data')
+
+    parser.add_option('-w', '--warning', type='int',
+                        help='Warning threshold in minutes')
+
+    parser.add_option('-c', '--critical', type='int',
+                        help='Critical threshold in minutes')
+
+    parser.add_option('--rules', type='string', metavar='FILE',
+                        help='Thresholds and checks per job, -w and -c are '
+                             'for the jobs no rule matches, see jenkins_rules.py')
+
+    lsb = OptionGroup(parser, "Last Successful Build Options",
+                    "Also run check_jenkins_lsb on each job")
+    lsb.add_option('--lsb-warning', type='string',
+                        help='Warning threshold, units s, m, h, d')
+    lsb.add_option('--lsb-critical', type='string',
+                        help='Critical threshold, units s, m, h, d')
+    parser.add_option_group(lsb)
+
+    webhook = OptionGroup(parser, "Webhook Options")
+    webhook.add_option('-l', '--listen', type='string', default=':9119',
+                        help='Address and port of the notifications')
+    webhook.add_option('--token', type='string',
+                        help='Refuse the notifications without ?token=TOKEN')
+    webhook.add_option('--recheck', type='int', default=60,
+                        help='Seconds between two checks of the running '
+                             'builds, from memory')
+    webhook.add_option('--reconcile', type='int', default=900,
+                        help='Seconds between two polls of every job')
+    parser.add_option_group(webhook)
+
+    passive = OptionGroup(parser, "Passive Check Options",
+                    "Where the results go")
+    passive.add_option('--nagios-host', type='string',
+                        help='Nagios host of the services, default -H')
+    passive.add_option('--service-format', type='string',
+                        default='Jenkins %s',
+                        help="Service name, %s is the job, default 'Jenkins %s'")
+    passive.add_option('--sink', type='choice', default='command-file',
+                        choices=['command-file', 'nsca', 'stdout'],
+                        help='command-file, nsca or stdout')
+    passive.add_option('--command-file', type='string',
+                        default='/usr/local/nagios/var/rw/nagios.cmd',
+                        help='Nagios external command file')
+    passive.add_option('--nsca-host', type='string',
+                        help='NSCA server, for the nsca sink')
+    passive.add_option('--send-nsca', type='string', default='send_nsca',
+                        help='send_nsca command')
+    passive.add_option('--nsca-config', type='string',
+                        help='send_nsca configuration file')
+    parser.add_option_group(passive)
+
+    connection = OptionGroup(parser, "Connection Options",
+                    "Network / Authentication related options")
+    connection.add_option('-u', '--username', type='string',
+                        help='Jenkins username')
+    connection.add_option('-p', '--password', type='string',
+                        help='Jenkins password')
+    connection.add_option('-t', '--timeout', type='int', default=10,
+                        help='Connection timeout in seconds')
+    connection.add_option('-P', '--port', type='int',
+                        help='Jenkins port',
+                        default=80)
+    connection.add_option('--prefix', type='string',
+                        help='Jenkins prefix, if not installed on /',
+                        default='/')
+    connection.add_option('-S', '--ssl', action="store_true",
+                        default=False,
+                        help='If the connection requires ssl')
+    parser.add_option_group(connection)
+
+    options, arguments = parser.parse_args()
+
+    if (arguments != []):
+        print """Non recognized option %s
+        Please use --help for usage""" % arguments
+        print usage()
+        raise SystemExit, 2
+
+    if (options.hostname == None):
+        print "-H HOSTNAME"
+        print "We need the jenkins server hostname to connect to"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.warning == None or options.critical == None):
+        print "\n-w MINUTES -c MINUTES"
+        print "\nHow many minutes the jobs should run ?"
+        print usage()
+        raise SystemExit, 2
+
+    if (bool(options.lsb_warning) != bool(options.lsb_critical)):
+        print "\n--lsb-warning / --lsb-critical"
+        print "\nBoth thresholds are needed to check the last successful build"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.sink == 'nsca' and options.nsca_host == None):
+        print "\n--nsca-host HOST"
+        print "\nThe nsca sink needs the NSCA server"
+        print usage()
+        raise SystemExit, 2
+
+    if (options.nagios_host == None):
+        options.nagios_host = options.hostname
+
+    options.jobs = [job for jobs in options.jobs
+                    for job in jobs.split(',') if job]
+
+    return vars(options)
+
+
+def main():
+    """Runs all the functions"""
+
+    user_in = controller()
+
+    if user_in['rules']:
+        from jenkins_rules import load_index
+        user_in['rules'] = load_index(user_in['rules'])
+
+    states = JobStates(user_in['jobs'], user_in['folder'])
+    monitor = JobMonitor(user_in, states, make_sink(user_in))
+    reconciler = Reconciler(monitor, tree_url(batch_root(user_in)),
+                            ConnectionPool(timeout=user_in['timeout']),
+                            user_in['recheck'], user_in['reconcile'])
+    # Notifications of jobs not polled yet would be ignored
+    reconciler.tick()
+    reconciler.start()
+
+    host, sep, port = user_in['listen'].rpartition(':')
+    server = WebhookServer((host, int(port)), monitor, user_in['token'])
+    print 'Listening to the notifications of %s on http://%s:%s/' % (
+            user_in['hostname'], host or '0.0.0.0', port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        reconciler.stopped.set()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+A fake Jenkins for tests and load tests : thousands of synthetic jobs with
+their lastBuild, lastSuccessfulBuild, lastCompletedBuild and build history,
+served through api/json (tree= projections included) and api/python.
+
+Every job is derived from its name, so two runs serve the same jobs. The
+latency, error rate and size of the full build records can be tuned, and
+replies can trickle in a few bytes at a time (--drip) :
+
+ $ python fake_jenkins.py --port 8080 --jobs 5000 --latency 20 --error-rate 0.01
+
+Builds can also start and complete, as a stream of the payloads the
+Notification plugin posts, replayed to a webhook listener (--replay) :
+
+ $ python fake_jenkins.py --port 8080 --replay http://localhost:9119/ --notifications 500
+
+Few doctests, run with :
+ $ python -m doctest fake_jenkins.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionParser
+import BaseHTTPServer
+import SocketServer
+import json
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import urllib
+import zlib
+
+from jenkins_common import job_path
+
+RESULTS = (('SUCCESS', 80), ('FAILURE', 8), ('UNSTABLE', 7), ('ABORTED', 5))
+
+DRIP_SIZE = 16
+
+
+def parse_tree(spec):
+    """ tree= parameter as {field: (subtree, range)}, range is (start, end)
+
+    >>> parse_tree('name,lastBuild[number,result]')
+    {'lastBuild': ({'number': ({}, None), 'result': ({}, None)}, None), 'name': ({}, None)}
+    >>> parse_tree('builds[number]{0,10}')
+    {'builds': ({'number': ({}, None)}, (0, 10))}
+    """
+    tokens = re.findall(r'\{[^}]*\}|[^,\[\]{}]+|[,\[\]]', spec)
+    position = [0]
+
+    def peek():
+        if position[0] < len(tokens):
+            return tokens[position[0]]
+        return None
+
+    def take():
+        position[0] += 1
+        return tokens[position[0] - 1]
+
+    def fields():
+        tree = {}
+        while peek() not in (None, ']'):
+            name = take().strip()
+            subtree, limits = {}, None
+            if peek() == '[':
+                take()
+                subtree = fields()
+                take()
+            if peek() and peek().startswith('{'):
+                start, _, end = take().strip('{}').partition(',')
+                limits = (int(start or 0), end and int(end) or None)
+            tree[name] = (subtree, limits)
+            if peek() == ',':
+                take()
+        return tree
+
+    return fields()
+
+
+def project(data, tree):
+    """ Keep only the fields of *tree* in *data*, like Jenkins does
+
+    >>> project({'a': 1, 'b': [{'c': 2, 'd': 3}, {'c': 4}]}, parse_tree('b[c]{1,}'))
+    {'b': [{'c': 4}]}
+    """
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    projected = {}
+    for name, (subtree, limits) in tree.items():
+        if name not in data:
+            continue
+        value = data[name]
+        if limits and isinstance(value, list):
+            value = value[limits[0]:limits[1]]
+        projected[name] = project(value, subtree)
+    return projected
+
+
+class FakeJenkins(object):
+    """
+    The jobs served, built on demand from their names
+
+    >>> jenkins = FakeJenkins(jobs=3, now=1328483562)
+    >>> sorted(jenkins.job_names)
+    ['job-00000', 'job-00001', 'job-00002']
+    >>> jenkins.last_build('job-00001') == jenkins.last_build('job-00001')
+    True
+    >>> FakeJenkins(jobs=3, folders=2).job_names
+    ['folder-00/job-00000', 'folder-01/job-00001', 'folder-00/job-00002']
+    """
+
+    def __init__(self, jobs=1000, latency=0, error_rate=0, payload_size=0,
+                 history=20, now=None, prefix='job-', folders=0, nodes=10,
+                 drip=0):
+        if folders:
+            self.job_names = ['folder-%02d/%s%05d' % (i % folders, prefix, i)
+                              for i in range(jobs)]
+        else:
+            self.job_names = ['%s%05d' % (prefix, i) for i in range(jobs)]
+        self.known = set(self.job_names)
+        self.folder_names = set(['folder-%02d' % i for i in range(folders)])
+        self.nodes = nodes
+        self.latency = latency
+        # Milliseconds between two DRIP_SIZE bytes pieces of a reply
+        self.drip = drip
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self.history = history
+        self.now = now or int(time.time())
+        self.requests = 0
+        self._builds = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, name, number=0):
+        return random.Random('%s#%s' % (name, number))
+
+    def build(self, name, number, building=False):
+        """ Build record (projection of what Jenkins sends) """
+        rng = self._rng(name, number)
+        duration = rng.randint(30, 7200) * 1000
+        # Builds are one duration and a random pause apart
+        age = (self.current_number(name) - number) * 7200 + rng.randint(0, 3600)
+        record = {'number': number,
+                  'building': building,
+                  'duration': building and 0 or duration,
+                  'estimatedDuration': duration,
+                  'timestamp': (self.now - age) * 1000 - duration,
+                  'url': 'http://jenkins/%s%s/' % (job_path(name), number),
+                  'result': None}
+        if not building:
+            total = sum([weight for result, weight in RESULTS])
+            pick = rng.randint(1, total)
+            for result, weight in RESULTS:
+                pick -= weight
+                if pick <= 0:
+                    record['result'] = result
+                    break
+        return record
+
+    def current_number(self, name):
+        return self._rng(name).randint(20, 5000)
+
+    def builds(self, name):
+        """ Most recent first, like the builds field of a job """
+        if name in self._builds:
+            return self._builds[name]
+        number = self.current_number(name)
+        building = self._rng(name).random() < 0.1
+        records = [self.build(name, number, building)]
+        for older in range(number - 1, max(0, number - self.history), -1):
+            records.append(self.build(name, older))
+        self._builds[name] = records
+        return records
+
+    def last_build(self, name):
+        return self.builds(name)[0]
+
+    def last_completed_build(self, name):
+        for record in self.builds(name):
+            if not record['building']:
+                return record
+        return None
+
+    def last_successful_build(self, name):
+        for record in self.builds(name):
+            if record['result'] == 'SUCCESS':
+                return record
+        return None
+
+    def job(self, name):
+        """ Job record, the fields of a job/NAME/api/json """
+        builds = self.builds(name)
+        return {'name': name.rpartition('/')[2],
+                'url': 'http://jenkins/' + job_path(name),
+                '_class': 'hudson.model.FreeStyleProject',
+                'builds': builds,
+                'lastBuild': builds[0],
+                'lastCompletedBuild': self.last_completed_build(name),
+                'lastSuccessfulBuild': self.last_successful_build(name)}
+
+    def queue(self):
+        """ Queue items, about one job in twenty waits for an executor """
+        items = []
+        for name in self.job_names:
+            rng = self._rng(name, 'queue')
+            if rng.random() < 0.05:
+                items.append({'_class': 'hudson.model.Queue$BuildableItem',
+                              'id': len(items) + 1,
+                              'inQueueSince': (self.now - rng.randint(0, 7200)) * 1000,
+                              'why': 'Waiting for next available executor',
+                              'stuck': rng.random() < 0.2,
+                              'blocked': False,
+                              'buildable': True,
+                              'task': {'name': name.rpartition('/')[2],
+                                       'url': 'http://jenkins/' +
+                                              job_path(name)}})
+        return items
+
+    def computers(self):
+        """ Agents of /computer, labelled linux, docker or windows """
+        computers = []
+        for i in range(self.nodes):
+            rng = self._rng('agent-%02d' % i, 'computer')
+            offline = rng.random() < 0.1
+            executors = [{'idle': offline or rng.random() < 0.4}
+                         for executor in range(rng.choice((2, 4, 8)))]
+            labels = ['agent-%02d' % i, ('linux', 'windows')[i % 5 == 4]]
+            if i % 2 == 0 and i % 5 != 4:
+                labels.append('docker')
+            computers.append({'_class': 'hudson.slaves.SlaveComputer',
+                              'displayName': 'agent-%02d' % i,
+                              'offline': offline,
+                              'temporarilyOffline': False,
+                              'idle': all([e['idle'] for e in executors]),
+                              'numExecutors': len(executors),
+                              'executors': executors,
+                              'assignedLabels': [{'name': label}
+                                                 for label in labels]})
+        return computers
+
+    def notify(self, name, now=None):
+        """ Next event of the job *name* : its build completes if one is
+        running, a new one starts otherwise. The api serves the change,
+        returns the Notification plugin payload
+
+        >>> jenkins = FakeJenkins(jobs=1, now=1328483562)
+        >>> number = jenkins.last_build('job-00000')['number']
+        >>> payloads = [jenkins.notify('job-00000', 1328483600) for i in range(2)]
+        >>> [(p['build']['number'] - number, p['build']['phase']) for p in payloads]
+        [(1, 'STARTED'), (1, 'COMPLETED')]
+        >>> payloads[1]['build']['duration'], payloads[1]['url']
+        (0, 'job/job-00000/')
+        """
+        now = int(now or time.time())
+        self._lock.acquire()
+        try:
+            builds = self.builds(name)
+            last = builds[0]
+            if last['building']:
+                record = dict(last, building=False,
+                              duration=now * 1000 - last['timestamp'],
+                              result=self.build(name, last['number'])['result'])
+                builds[0] = record
+                phase = 'COMPLETED'
+            else:
+                number = last['number'] + 1
+                record = dict(self.build(name, number, True), duration=0,
+                              timestamp=now * 1000)
+                builds.insert(0, record)
+                del builds[self.history:]
+                phase = 'STARTED'
+        finally:
+            self._lock.release()
+
+        url = job_path(name)
+        build = {'full_url': record['url'],
+                 'number': record['number'],
+                 'phase': phase,
+                 'timestamp': record['timestamp'],
+                 'duration': record['duration'],
+                 'url': '%s%s/' % (url, record['number'])}
+        if phase == 'COMPLETED':
+            build['status'] = record['result']
+        return {'name': name.rpartition('/')[2],
+                'display_name': name.rpartition('/')[2],
+                'url': url,
+                'build': build}
+
+    def notifications(self, count, seed=0):
+        """ *count* notify() of jobs picked at random, the same ones for
+        a *seed* """
+        rng = random.Random(seed)
+        for i in range(count):
+            yield self.notify(rng.choice(self.job_names))
+
+    def children(self, folder):
+        """ Jobs and folders right below *folder*, '' being the root """
+        items = [{'name': name, 'url': 'http://jenkins/' + job_path(name),
+                  '_class': 'com.cloudbees.hudson.plugins.folder.Folder'}
+                 for name in sorted(self.folder_names) if not folder]
+        items.extend([self.job(name) for name in self.job_names
+                      if name.rpartition('/')[0] == folder])
+        return items
+
+    def padded(self, record):
+        """ Full build record, grown to payload_size with actions """
+        record = dict(record, actions=[], changeSets=[], artifacts=[])
+        action = {'_class': 'hudson.model.CauseAction',
+                  'causes': [{'shortDescription': 'Started by timer'}]}
+        size = len(json.dumps(action))
+        record['actions'] = [action] * (self.payload_size / size)
+        return record
+
+    def route(self, path):
+        """ (code, reply) for a request path, reply is None on errors """
+        path, _, query = path.partition('?')
+        params = dict([(key, urllib.unquote(value)) for key, _, value in
+                       [pair.partition('=') for pair in query.split('&')]])
+        if path == '/queue/api/json':
+            return 200, project({'items': self.queue()},
+                                parse_tree(params.get('tree', '')))
+        if path == '/computer/api/json':
+            return 200, project({'computer': self.computers()},
+                                parse_tree(params.get('tree', '')))
+        match = re.match(r'^/((?:job/[^/]+/)*)(view/[^/]+/)?'
+                         r'(?:(lastBuild|lastSuccessfulBuild|lastCompletedBuild)/)?'
+                         r'api/(json|python)$', path)
+        if not match:
+            return 404, None
+        jobs_path, view, build, flavor = match.groups()
+        names = [urllib.unquote(name) for name in
+                 re.findall(r'job/([^/]+)/', jobs_path)]
+
+        if not names:
+            reply = {'_class': 'hudson.model.Hudson',
+                     'jobs': self.children('')}
+        elif '/'.join(names) in self.folder_names and not build:
+            reply = {'_class': 'com.cloudbees.hudson.plugins.folder.Folder',
+                     'name': names[-1], 'jobs': self.children(names[0])}
+        elif '/'.join(names) in self.known:
+            reply = self.job('/'.join(names))
+            if build:
+                reply = reply[build]
+                if reply is None:
+                    return 404, None
+                if not params.get('tree'):
+                    reply = self.padded(reply)
+        else:
+            return 404, None
+
+        if params.get('tree'):
+            reply = project(reply, parse_tree(params['tree']))
+        return 200, reply
+
+    def handle(self, path):
+        """ (code, body, content type) with latency and errors applied """
+        self._lock.acquire()
+        self.requests += 1
+        self._lock.release()
+        if self.latency:
+            time.sleep(random.expovariate(1000.0 / self.latency))
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, 'Internal Server Error', 'text/plain'
+        code, reply = self.route(path)
+        if reply is None:
+            return code, 'Not Found', 'text/plain'
+        if path.partition('?')[0].endswith('/python'):
+            return code, repr(reply), 'text/x-python'
+        return code, json.dumps(reply), 'application/json'
+
+
+class FakeJenkinsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body in one send, small writes on a keep-alive connection
+    # wait for the delayed ack of the client
+    wbufsize = -1
+
+    def do_GET(self):
+        code, body, content_type = self.server.jenkins.handle(self.path)
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if 'gzip' in (self.headers.getheader('Accept-Encoding') or ''):
+            gzipper = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = gzipper.compress(body) + gzipper.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        drip = self.server.jenkins.drip
+        if not drip:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), DRIP_SIZE):
+            self.wfile.write(body[start:start + DRIP_SIZE])
+            self.wfile.flush()
+            time.sleep(drip / 1000.0)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeJenkinsServer(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, jenkins):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeJenkinsHandler)
+        self.jenkins = jenkins
+
+    def handle_error(self, request, client_address):
+        # A client giving up on a trickling reply is what the test expects
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+
+def serve_in_thread(jenkins, host='127.0.0.1', port=0):
+    """ Start a server in the background, returns it, url is its root """
+    server = FakeJenkinsServer((host, port), jenkins)
+    server.url = 'http://%s:%s/' % server.server_address
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+def replay(url, payloads, interval=0):
+    """ POST the notification *payloads* to the listener at *url*, one
+    every *interval* milliseconds, returns the status codes """
+    import urllib2
+    codes = []
+    for payload in payloads:
+        request = urllib2.Request(url, json.dumps(payload),
+                                  {'Content-Type': 'application/json'})
+        try:
+            response = urllib2.urlopen(request, timeout=10)
+            codes.append(response.getcode())
+            response.read()
+        except urllib2.HTTPError, error:
+            codes.append(error.code)
+        if interval:
+            time.sleep(interval / 1000.0)
+    return codes
+
+
+def main():
+    parser = OptionParser(description="A fake Jenkins with synthetic jobs")
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--jobs', type='int', default=1000,
+                      help='Number of jobs, named job-00000 and so on')
+    parser.add_option('--latency', type='float', default=0,
+                      help='Mean latency of a reply in milliseconds')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='Fraction of requests answered with a 500')
+    parser.add_option('--payload-size', type='int', default=0,
+                      help='Size of a full build record, without tree=')
+    parser.add_option('--history', type='int', default=20,
+                      help='Number of builds per job')
+    parser.add_option('--folders', type='int', default=0,
+                      help='Spread the jobs over that many folders')
+    parser.add_option('--nodes', type='int', default=10,
+                      help='Number of agents')
+    parser.add_option('--drip', type='float', default=0,
+                      help='Milliseconds between two pieces of %s bytes of '
+                           'a reply' % DRIP_SIZE)
+    parser.add_option('--replay', type='string', metavar='URL',
+                      help='Post build notifications to this webhook listener')
+    parser.add_option('--notifications', type='int', default=100,
+                      help='Number of notifications to replay')
+    parser.add_option('--notify-interval', type='float', default=100,
+                      help='Milliseconds between two notifications')
+    options, arguments = parser.parse_args()
+
+    jenkins = FakeJenkins(options.jobs, options.latency, options.error_rate,
+                          options.payload_size, options.history,
+                          folders=options.folders, nodes=options.nodes,
+                          drip=options.drip)
+    server = FakeJenkinsServer((options.host, options.port), jenkins)
+    print 'Fake Jenkins with %s jobs on http://%s:%s/' % (
+            options.jobs, options.host, options.port)
+    try:
+        if not options.replay:
+            server.serve_forever()
+            return
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        codes = replay(options.replay,
+                       jenkins.notifications(options.notifications),
+                       options.notify_interval)
+        print '%s notifications posted to %s, %s accepted' % (
+                len(codes), options.replay,
+                len([code for code in codes if code < 300]))
+        # Still serving, for the reconciliation polls
+        while thread.isAlive():
+            thread.join(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
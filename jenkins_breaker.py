@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Circuit breaker per Jenkins host, shared by every plugin invocation : when
+a master is down, hundreds of services would each wait the whole --timeout
+before going CRITICAL, and starve the Nagios workers.
+
+After *failures* connection failures in a row the circuit opens : checks of
+that host fail at once for *cooldown* seconds. Then a single check is let
+through to probe the host, the others keep failing fast until it is done.
+A probe that gets a reply closes the circuit, a failed one opens it for
+another cooldown.
+
+The state of a host is a small JSON file, read and written under flock so
+concurrent checks see the same count.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_breaker.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import errno
+import fcntl
+import json
+import os
+import re
+import time
+from urlparse import urlsplit
+# socket, httplib and urllib2 are imported when an error is looked at, a
+# closed circuit must not slow the start of every check
+
+# Replies of a proxy in front of a master that is down
+UNAVAILABLE_CODES = (502, 503, 504)
+
+
+def host_key(url):
+    """ Hosts are told apart by name and port, a readable file name
+
+    >>> host_key('https://ci.example.com:8443/jenkins/job/x/api/json')
+    'ci.example.com_8443'
+    >>> host_key('http://ci/job/x/api/json')
+    'ci_80'
+    """
+    parts = urlsplit(url)
+    port = parts.port or {'https': 443}.get(parts.scheme, 80)
+    return re.sub(r'[^\w.-]', '_', '%s_%s' % (parts.hostname, port))
+
+
+def is_unreachable(error):
+    """ Whether *error* means the host did not answer, a 404 is an answer
+
+    >>> from urllib2 import HTTPError, URLError
+    >>> is_unreachable(URLError('Connection refused'))
+    True
+    >>> is_unreachable(HTTPError('http://ci/', 404, 'Not Found', {}, None))
+    False
+    >>> is_unreachable(HTTPError('http://ci/', 503, 'Unavailable', {}, None))
+    True
+    """
+    import socket
+    from httplib import HTTPException
+    from urllib2 import HTTPError, URLError
+    if isinstance(error, HTTPError):
+        return error.code in UNAVAILABLE_CODES
+    return isinstance(error, (URLError, socket.error, HTTPException))
+
+
+class CircuitOpen(Exception):
+    """ The host failed too often, it is not tried """
+
+    def __init__(self, host, failures, retry):
+        Exception.__init__(self, host, failures, retry)
+        self.host = host
+        self.failures = failures
+        self.retry = retry
+
+    def __str__(self):
+        return '%s failed %s times in a row, not tried again for %ss' % (
+                    self.host, self.failures, self.retry)
+
+
+class CircuitBreaker(object):
+    """
+    File-backed breaker of one host, the state is kept in *directory*.
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> breaker = CircuitBreaker(tmp, 'http://ci/', failures=2, cooldown=60)
+    >>> breaker.failure(now=1000); breaker.failure(now=1001)
+    >>> breaker.allow(now=1030)
+    Traceback (most recent call last):
+    CircuitOpen: ci_80 failed 2 times in a row, not tried again for 31s
+    >>> breaker.allow(now=1062)             # the probe
+    >>> breaker.allow(now=1063)             # while it runs
+    Traceback (most recent call last):
+    CircuitOpen: ci_80 failed 2 times in a row, not tried again for 59s
+    >>> breaker.success()
+    >>> breaker.allow(now=1064)
+    >>> shutil.rmtree(tmp)
+    """
+
+    def __init__(self, directory, url, failures=3, cooldown=60):
+        self.directory = directory
+        self.host = host_key(url)
+        self.failures = failures
+        self.cooldown = cooldown
+
+    def path(self):
+        return os.path.join(self.directory, self.host + '.breaker')
+
+    def _update(self, change):
+        """ Apply *change* to the state under the lock, written back only
+        when it returns True """
+        try:
+            os.makedirs(self.directory)
+        except OSError, error:
+            if error.errno != errno.EEXIST:
+                raise
+        handle = os.open(self.path(), os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            data = os.read(handle, 4096)
+            try:
+                state = json.loads(data)
+            except ValueError:
+                state = {}
+            state.setdefault('failures', 0)
+            state.setdefault('opened', None)
+            state.setdefault('probe', None)
+            if change(state):
+                os.lseek(handle, 0, os.SEEK_SET)
+                os.ftruncate(handle, 0)
+                os.write(handle, json.dumps(state))
+        finally:
+            os.close(handle)
+
+    def allow(self, now=None):
+        """ Raise CircuitOpen unless the host may be tried now """
+        now = now or time.time()
+
+        def change(state):
+            if state['failures'] < self.failures:
+                return False
+            retry = state['opened'] + self.cooldown - now
+            if retry <= 0 and state['probe'] is not None:
+                # Another check is probing, it gets a cooldown to finish
+                retry = state['probe'] + self.cooldown - now
+            if retry > 0:
+                raise CircuitOpen(self.host, state['failures'], int(retry))
+            state['probe'] = now
+            return True
+
+        self._update(change)
+
+    def success(self):
+        """ The host answered, the circuit closes """
+        def change(state):
+            closed = not (state['failures'] or state['probe'])
+            state.update(failures=0, opened=None, probe=None)
+            return not closed
+
+        self._update(change)
+
+    def failure(self, now=None):
+        """ The host did not answer, opens the circuit after enough of them """
+        now = now or time.time()
+
+        def change(state):
+            state['failures'] += 1
+            if state['failures'] >= self.failures:
+                state.update(opened=now, probe=None)
+            return True
+
+        self._update(change)
+
+    def record(self, error=None):
+        """ Count the outcome of a request : a failure when *error* means the
+        host did not answer, a success otherwise """
+        if error is not None and is_unreachable(error):
+            self.failure()
+        else:
+            self.success()
+
+    def call(self, function, *args):
+        """ function(*args) when the host may be tried, its outcome counted """
+        self.allow()
+        try:
+            result = function(*args)
+        except Exception, error:
+            self.record(error)
+            raise
+        self.record()
+        return result
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Responses from Jenkins shared between plugin invocations : several Nagios
+services looking at the same job within --cache-ttl seconds download it
+only once.
+
+The cache is a SQLite file, every write is a transaction so a reader never
+sees half a response, and the least recently used entries are dropped when
+there are more than --cache-size of them. A hit only reads : the time an
+entry was last used is written again once it is ttl/2 old, so checks
+answered by the cache do not queue for the write lock of the file.
+
+Once expired, an entry is not thrown away : its ETag / Last-Modified are
+sent back to Jenkins, which answers 304 Not Modified when the reply did not
+change. When Jenkins gave no validator, the number of a finished build is
+compared with a tree=number probe before downloading the whole record again.
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from jenkins_http import open_url, is_timeout, BodyReader
+
+# Bumped when the table changes, an older cache file is simply emptied
+SCHEMA_VERSION = 1
+
+
+def cache_key(url, username, password):
+    """ Entries are per url and per credentials, without storing them
+
+    >>> cache_key('http://ci/api/json', 'user', 'pass') == cache_key('http://ci/api/json', 'user', 'pass')
+    True
+    >>> cache_key('http://ci/api/json', 'user', 'pass') == cache_key('http://ci/api/json', 'other', 'pass')
+    False
+    """
+    credentials = hashlib.sha1('%s:%s' % (username, password)).hexdigest()
+    return hashlib.sha1('%s\0%s' % (url, credentials)).hexdigest()
+
+
+def probe_url(url):
+    """ Same api url, only asking for the build number
+
+    >>> probe_url('http://ci/job/x/lastBuild/api/json?tree=number,result,url')
+    'http://ci/job/x/lastBuild/api/json?tree=number'
+    >>> probe_url('http://ci/job/x/lastBuild/api/json')
+    'http://ci/job/x/lastBuild/api/json?tree=number'
+    """
+    if 'tree=' in url:
+        return re.sub(r'tree=[^&]*', 'tree=number', url)
+    return url + '?tree=number'
+
+
+def build_number(body):
+    """ Build number of an api/json reply, None when there is none or when
+    the build is still running : its number will not change, its record will
+
+    >>> build_number('{"number": 42, "result": "SUCCESS"}')
+    42
+    >>> build_number('{"number": 43, "building": true}')
+    >>> build_number('{"jobs": []}')
+    >>> build_number('mock file')
+    """
+    try:
+        reply = json.loads(body)
+    except ValueError:
+        return None
+    if isinstance(reply, dict) and not reply.get('building'):
+        return reply.get('number')
+    return None
+
+
+def open_cache(path, ttl=60, size=1000):
+    """ ResponseCache of the file *path*, None when it cannot be opened
+    (corrupt, locked for too long, not writable) : the check goes on
+    without a cache
+
+    >>> open_cache('/nonexistent/cache.db')
+    """
+    try:
+        return ResponseCache(path, ttl, size)
+    except (sqlite3.Error, OSError):
+        return None
+
+
+class ResponseCache(object):
+    """
+    Url -> body, fresh for *ttl* seconds, at most *size* entries.
+    last_source tells where the last fetch() reply came from.
+    """
+
+    def __init__(self, path, ttl=60, size=1000):
+        self.path = path
+        self.ttl = ttl
+        self.size = size
+        self.last_source = None
+        if not os.path.exists(path):
+            # Replies may hold private data, keep them for the nagios user
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0600))
+        self.db = sqlite3.connect(path, timeout=10)
+        self.db.text_factory = str
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS responses")
+            self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY,
+                            body BLOB,
+                            fetched REAL,
+                            used REAL,
+                            etag TEXT,
+                            modified TEXT,
+                            number INTEGER)""")
+        self.db.commit()
+
+    def _touch(self, key, now):
+        self.db.execute("UPDATE responses SET used = ? WHERE key = ?",
+                        (now, key))
+        self.db.commit()
+
+    def get(self, url, username, password, now=None):
+        """ Cached body of *url*, None when missing or expired """
+        now = now or time.time()
+        key = cache_key(url, username, password)
+        row = self.db.execute(
+            "SELECT body, used FROM responses WHERE key = ? AND fetched >= ?",
+            (key, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+        # Precise enough for the eviction, without a write on every hit
+        if row[1] < now - self.ttl / 2.0:
+            self._touch(key, now)
+        return str(row[0])
+
+    def fresh(self, url, username, password):
+        """ get(), None as well when the cache file is broken """
+        try:
+            return self.get(url, username, password)
+        except sqlite3.Error:
+            return None
+
+    def stale(self, url, username, password):
+        """ Cached entry of *url* even expired, as a dict, or None """
+        row = self.db.execute(
+            "SELECT body, etag, modified, number FROM responses WHERE key = ?",
+            (cache_key(url, username, password),)).fetchone()
+        if row is None:
+            return None
+        return {'body': str(row[0]), 'etag': row[1], 'modified': row[2],
+                'number': row[3]}
+
+    def put(self, url, username, password, body, etag=None, modified=None,
+            number=None, now=None):
+        """ Store *body* and evict the least recently used entries """
+        now = now or time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (cache_key(url, username, password), sqlite3.Binary(body),
+             now, now, etag, modified, number))
+        self.db.execute("""DELETE FROM responses WHERE key NOT IN (
+                            SELECT key FROM responses
+                            ORDER BY used DESC LIMIT ?)""", (self.size,))
+        self.db.commit()
+
+    def revalidated(self, url, username, password, now=None):
+        """ The expired entry is still good for another ttl """
+        now = now or time.time()
+        self.db.execute(
+            "UPDATE responses SET fetched = ?, used = ? WHERE key = ?",
+            (now, now, cache_key(url, username, password)))
+        self.db.commit()
+
+    def _revalidate(self, url, username, password, timeout, entry, reader,
+                    opener=None):
+        """ Body of the expired *entry* if Jenkins says it did not change """
+        from urllib2 import HTTPError
+        if entry['etag'] or entry['modified']:
+            headers = {}
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['modified']:
+                headers['If-Modified-Since'] = entry['modified']
+            try:
+                response = open_url(url, username, password, timeout, headers,
+                                    opener)
+            except HTTPError, error:
+                if error.code == 304:
+                    return entry['body'], 'not modified', None
+                raise
+            return None, None, response
+
+        if entry['number'] is not None:
+            reply = reader.read(open_url(probe_url(url), username, password,
+                                         timeout, opener=opener))
+            if build_number(reply) == entry['number']:
+                return entry['body'], 'same build', None
+        return None, None, None
+
+    def fetch(self, url, username, password, timeout, reader=None,
+              deadline=None, connect=None):
+        """
+        Body of *url* from the cache, a conditional request or a full
+        download, in that order. Network errors are raised like
+        urllib2.urlopen does, a broken cache file is never a reason to
+        fail the check. Replies are read with the jenkins_http.BodyReader
+        *reader*.
+        When the jenkins_http.Deadline *deadline* has a soft limit and an
+        expired entry is there, Jenkins only gets until that limit : past
+        it the expired entry is returned, last_source is then 'stale'.
+        *connect* is called before Jenkins is asked anything, never when
+        the cache answers on its own, it returns the urllib2 opener to use
+        or None.
+        """
+        reader = reader or BodyReader()
+        try:
+            body = self.get(url, username, password)
+            entry = body is None and self.stale(url, username, password)
+        except sqlite3.Error:
+            body, entry = None, None
+        if body is not None:
+            self.last_source = 'cache'
+            return body
+
+        opener = connect and connect()
+        if not (entry and deadline and deadline.soft):
+            return self._download(url, username, password, timeout, entry,
+                                  reader, opener)
+        deadline.limit = deadline.start + deadline.soft
+        try:
+            return self._download(url, username, password, timeout, entry,
+                                  reader, opener)
+        except Exception, error:
+            if not is_timeout(error):
+                raise
+            self.last_source = 'stale'
+            return entry['body']
+        finally:
+            deadline.limit = None
+
+    def _download(self, url, username, password, timeout, entry, reader,
+                  opener=None):
+        """ fetch() once the cache could not answer on its own """
+        response = None
+        if entry:
+            body, source, response = self._revalidate(url, username,
+                                                      password, timeout, entry,
+                                                      reader, opener)
+            if body is not None:
+                self.last_source = source
+                try:
+                    self.revalidated(url, username, password)
+                except sqlite3.Error:
+                    pass
+                return body
+
+        if response is None:
+            response = open_url(url, username, password, timeout,
+                                opener=opener)
+        body = reader.read(response)
+        self.last_source = 'jenkins'
+        try:
+            self.put(url, username, password, body,
+                     etag=response.info().getheader('ETag'),
+                     modified=response.info().getheader('Last-Modified'),
+                     number=build_number(body))
+        except sqlite3.Error:
+            pass
+        return body
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Helpers shared by the check_jenkins_* plugins : url construction, the
+options deciding how replies are fetched, build results as small integers
+and Nagios status handling.
+
+Urls are quoted here rather than with urllib : importing it loads socket
+and ssl, which a check answered by the cache never needs.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_common.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from optparse import OptionGroup
+import re
+import threading
+
+from jenkins_http import Deadline
+
+# Exit statuses recognized by Nagios
+NAGIOS_CODES = {'OK': 0, 'WARNING': 1, 'CRITICAL': 2, 'UNKNOWN': 3}
+
+# What urllib.quote leaves as is
+SAFE = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                 '0123456789_.-/')
+
+# From the least to the most important when several results are aggregated
+SEVERITY = ('OK', 'UNKNOWN', 'WARNING', 'CRITICAL')
+
+# http://javadoc.jenkins-ci.org/hudson/model/Result.html, None while
+# building. jenkins_history stores the index on disk : never reorder, new
+# results go at the end
+RESULTS = [None, 'SUCCESS', 'UNSTABLE', 'FAILURE', 'ABORTED', 'NOT_BUILT']
+# The codes meaning the same in every process, the ones written to disk
+KNOWN_RESULTS = len(RESULTS)
+_CODES = dict([(result, code) for code, result in enumerate(RESULTS)])
+_results_lock = threading.Lock()
+
+
+def quote(text):
+    """ Same as urllib.quote, unicode is quoted as its utf-8 bytes like
+    Jenkins expects
+
+    >>> quote('team/my project/caf\xc3\xa9')
+    'team/my%20project/caf%C3%A9'
+    >>> quote(u'caf\\xe9/\\u65e5')
+    'caf%C3%A9/%E6%97%A5'
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return ''.join([char in SAFE and char or '%%%02X' % ord(char)
+                    for char in text])
+
+
+def unquote(text):
+    """ Same as urllib.unquote
+
+    >>> unquote('my%20app'), unquote(u'my%20app')
+    ('my app', u'my app')
+    """
+    if isinstance(text, unicode):
+        char = unichr
+    else:
+        char = chr
+    return re.sub('%([0-9A-Fa-f]{2})',
+                  lambda match: char(int(match.group(1), 16)), text)
+
+
+def result_code(result):
+    """ Small integer of a build result, a result Jenkins adds one day
+    gets the next one, in this process only
+
+    >>> result_code('FAILURE'), result_code(None)
+    (3, 0)
+    >>> RESULTS[result_code('SKIPPED')]
+    'SKIPPED'
+    >>> result_code('SKIPPED') >= KNOWN_RESULTS
+    True
+    """
+    code = _CODES.get(result)
+    if code is not None:
+        return code
+    _results_lock.acquire()
+    try:
+        if result not in _CODES:
+            _CODES[result] = len(RESULTS)
+            RESULTS.append(result)
+        return _CODES[result]
+    finally:
+        _results_lock.release()
+
+
+def base_url(params):
+    """ Build the root url of a Jenkins server from the user input
+
+    >>> base_url({'hostname': 'ci', 'port': 80, 'prefix': '/', 'ssl': False})
+    'http://ci:80/'
+    >>> base_url({'hostname': 'ci', 'port': 80, 'prefix': 'jenkins', 'ssl': True})
+    'https://ci:443/jenkins/'
+    >>> base_url({'hostname': 'ci', 'port': 8443, 'prefix': '/jenkins/', 'ssl': True})
+    'https://ci:8443/jenkins/'
+    """
+    if params['ssl']:
+        protocol = "https"
+        # Unspecified port will be 80 by default, not correct if ssl is ON
+        port = params['port']
+        if (port == 80):
+            port = 443
+    else:
+        protocol = "http"
+        port = params['port']
+
+    # Let's avoid the double / if we specified a prefix
+    prefix = params['prefix'].strip('/')
+    if prefix:
+        prefix = '/%s/' % prefix
+    else:
+        prefix = '/'
+
+    return "%s://%s:%s%s" % (protocol, params['hostname'], port, prefix)
+
+
+def job_path(job):
+    """ Url path of a job, folders are separated by a /
+
+    >>> job_path('test')
+    'job/test/'
+    >>> job_path('team/my project/master')
+    'job/team/job/my%20project/job/master/'
+    """
+    return ''.join(['job/%s/' % quote(name)
+                    for name in job.strip('/').split('/')])
+
+
+def worst_status(statuses):
+    """ Most important status of a list, OK when the list is empty
+
+    >>> worst_status(['OK', 'WARNING', 'UNKNOWN'])
+    'WARNING'
+    >>> worst_status([])
+    'OK'
+    """
+    worst = 'OK'
+    for status in statuses:
+        if SEVERITY.index(status) > SEVERITY.index(worst):
+            worst = status
+    return worst
+
+
+def nagios_output(text):
+    """ A line of the plugin output as utf-8 bytes : job names come from
+    json as unicode, and printing them to the pipe of Nagios would raise
+    UnicodeEncodeError
+
+    >>> nagios_output(u'OK - caf\\xe9 exited normally')
+    'OK - caf\\xc3\\xa9 exited normally'
+    """
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def nagios_exit(status):
+    """ Leave with the exit code matching the given status """
+    raise SystemExit, NAGIOS_CODES.get(status, 3)
+
+
+def add_deadline_options(connection):
+    """ -t and the options bounding what a check asks Jenkins, added to the
+    *connection* option group """
+    connection.add_option('-t', '--timeout', type='int', default=10,
+                        help='Seconds allowed to get everything from Jenkins, '
+                             'connections and replies')
+    connection.add_option('--connect-timeout', type='float',
+                        help='Seconds allowed to connect, within --timeout')
+    connection.add_option('--tls-timeout', type='float',
+                        help='Seconds allowed for the TLS handshake, within '
+                             '--timeout')
+    connection.add_option('--retries', type='int', default=2,
+                        help='Times a transient error (no connection, 429, 5xx) is '
+                             'tried again, within --timeout')
+
+
+def add_fetch_options(parser):
+    """ Cache, circuit breaker and coalescing option groups of the plugins
+    checking one url, see fetch_context """
+    cache = OptionGroup(parser, "Cache Options",
+                    "Share the Jenkins replies between checks")
+    cache.add_option('--cache', type='string', metavar='FILE',
+                        help='Cache file, no cache if not set')
+    cache.add_option('--cache-ttl', type='int', default=60,
+                        help='Seconds a reply is reused')
+    cache.add_option('--cache-size', type='int', default=1000,
+                        help='Maximum number of replies in the cache')
+    cache.add_option('--soft-deadline', type='float', metavar='SECONDS',
+                        help='Past that many seconds, use the expired cached '
+                             'reply rather than waiting longer for Jenkins')
+    parser.add_option_group(cache)
+
+    breaker = OptionGroup(parser, "Circuit Breaker Options",
+                    "Fail fast while the Jenkins server is unreachable")
+    breaker.add_option('--breaker', type='string', metavar='DIR',
+                        help='Directory of the state shared by the checks, '
+                             'no breaker if not set')
+    breaker.add_option('--breaker-failures', type='int', default=3,
+                        help='Connection failures in a row opening the circuit')
+    breaker.add_option('--breaker-cooldown', type='int', default=60,
+                        help='Seconds the host is not tried once the circuit '
+                             'is open')
+    parser.add_option_group(breaker)
+
+    flight = OptionGroup(parser, "Coalescing Options",
+                    "Concurrent checks of the same url share one request")
+    flight.add_option('--coalesce', type='string', metavar='DIR',
+                        help='Directory of the lock files shared by the checks, '
+                             'no coalescing if not set')
+    parser.add_option_group(flight)
+
+
+def fetch_context(params):
+    """ Keyword arguments of get_data for params['url'], from the options
+    of add_deadline_options and add_fetch_options, None for the options
+    the plugin has not
+
+    >>> context = fetch_context({'url': 'http://ci/', 'timeout': 10,
+    ...                          'connect_timeout': 3, 'retries': 1})
+    >>> sorted(context.items()) # doctest: +ELLIPSIS
+    [('breaker', None), ('cache', None), ('deadline', <jenkins_http.Deadline object at ...>), ('flight', None), ('retries', 1)]
+    >>> context['deadline'].budget, context['deadline'].connect
+    (10, 3)
+    """
+    context = {'cache': None, 'breaker': None, 'flight': None,
+               'retries': params.get('retries', 0)}
+    if params.get('cache'):
+        from jenkins_cache import open_cache
+        context['cache'] = open_cache(params['cache'], params['cache_ttl'],
+                                      params['cache_size'])
+    if params.get('breaker'):
+        from jenkins_breaker import CircuitBreaker
+        context['breaker'] = CircuitBreaker(params['breaker'], params['url'],
+                                            params['breaker_failures'],
+                                            params['breaker_cooldown'])
+    if params.get('coalesce'):
+        from jenkins_flight import SingleFlight
+        context['flight'] = SingleFlight(params['coalesce'])
+    context['deadline'] = Deadline(params['timeout'],
+                                   params.get('connect_timeout'),
+                                   params.get('tls_timeout'),
+                                   params.get('soft_deadline'))
+    return context
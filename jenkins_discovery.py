@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Find every job below a Jenkins root, through nested Folders, Multibranch
+projects and Organization folders, so each branch does not have to be
+listed by hand.
+
+The folders of one level are listed concurrently, at most *workers* at a
+time, with only tree=jobs[name,_class] : the names and the kind of each
+child. The jobs found are then checked with one batch request per folder
+holding jobs (check_jenkins_batch.tree_url), also concurrently.
+
+The jobs found are kept in the jenkins_cache.ResponseCache for a while,
+folders and branches change much less often than builds.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_discovery.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import json
+import sqlite3
+from urllib import quote
+
+from check_jenkins_batch import tree_url
+from check_jenkins_multi import fan_out
+
+DISCOVERY_TREE = 'jobs[name,_class]'
+
+# Items holding jobs rather than builds
+FOLDER_CLASSES = ('com.cloudbees.hudson.plugins.folder.Folder',
+                  'jenkins.branch.OrganizationFolder',
+                  'org.jenkinsci.plugins.workflow.multibranch.WorkflowMultiBranchProject')
+
+
+def is_folder(job_class):
+    """ Whether an item of that _class holds jobs
+
+    >>> is_folder('com.cloudbees.hudson.plugins.folder.Folder')
+    True
+    >>> is_folder('hudson.model.FreeStyleProject')
+    False
+    >>> is_folder('com.example.CustomMultiBranchProject')
+    True
+    """
+    return (job_class in FOLDER_CLASSES or
+            (job_class or '').endswith(('Folder', 'MultiBranchProject')))
+
+
+def discover(root, fetch, workers=8):
+    """
+    (name, folder url) of every job below *root*, names are paths like
+    team/project/master. *fetch* returns the body of an url, it is called
+    from several threads. A failed request fails the whole discovery.
+
+    >>> replies = {'http://ci/api/json?tree=jobs[name,_class]': {'jobs': [
+    ...     {'name': 'team', '_class': 'com.cloudbees.hudson.plugins.folder.Folder'},
+    ...     {'name': 'top', '_class': 'hudson.model.FreeStyleProject'}]},
+    ...            'http://ci/job/team/api/json?tree=jobs[name,_class]': {'jobs': [
+    ...     {'name': 'app', '_class': 'hudson.model.FreeStyleProject'}]}}
+    >>> discover('http://ci/', lambda url: json.dumps(replies[url]))
+    [('top', 'http://ci/'), ('team/app', 'http://ci/job/team/')]
+    """
+    jobs = []
+    level = [('', root)]
+    while level:
+        replies = fan_out([('jenkins', prefix, url) for prefix, url in level],
+                          lambda target: json.loads(fetch(
+                                target[2] + 'api/json?tree=' + DISCOVERY_TREE)),
+                          workers, workers)
+        next_level = []
+        for (prefix, url), reply in zip(level, replies):
+            if isinstance(reply, Exception):
+                raise reply
+            for job in reply.get('jobs', []):
+                short = job['name'].encode('utf-8')
+                name = prefix + short
+                if is_folder(job.get('_class')):
+                    # Jenkins gives urls with its own root url, which may not
+                    # be the one we reach it with
+                    next_level.append((name + '/',
+                                       '%sjob/%s/' % (url, quote(short))))
+                else:
+                    jobs.append((name, url))
+        level = next_level
+    return jobs
+
+
+def fetch_builds(jobs, fetch, workers=8):
+    """
+    Batch reply ({'jobs': [...]}) holding the builds of every discovered
+    job, one request per folder, named with their whole path
+    """
+    folders = {}
+    for name, url in jobs:
+        folders.setdefault(url, {})[name.rpartition('/')[2]] = name
+    urls = sorted(folders)
+    replies = fan_out([('jenkins', url) for url in urls],
+                      lambda target: json.loads(fetch(tree_url(target[1]))),
+                      workers, workers)
+    found = []
+    for url, reply in zip(urls, replies):
+        if isinstance(reply, Exception):
+            raise reply
+        for job in reply.get('jobs', []):
+            short = job['name'].encode('utf-8')
+            if short in folders[url]:
+                found.append(dict(job, name=folders[url][short]))
+    return {'jobs': found}
+
+
+def discover_cached(root, fetch, workers, cache, username, password):
+    """ discover(), through the jenkins_cache.ResponseCache *cache* """
+    key = '%sapi/json?tree=%s&recursive' % (root, DISCOVERY_TREE)
+    try:
+        body = cache.get(key, username, password)
+    except sqlite3.Error:
+        body = None
+    if body is not None:
+        # json gives unicode back, discover() gives utf-8 names and urls
+        return [(name.encode('utf-8'), url.encode('utf-8'))
+                for name, url in json.loads(body)]
+    jobs = discover(root, fetch, workers)
+    try:
+        cache.put(key, username, password, json.dumps(jobs))
+    except sqlite3.Error:
+        pass
+    return jobs
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Single flight for the replies of Jenkins : when Nagios schedules many
+checks of the same url at once (after a reload for instance), only one of
+them asks Jenkins, the others wait for its reply and share it.
+
+In a process, the threads asking for the same url wait for the first one.
+Between processes, the first check takes an flock on a lock file per url
+and writes the reply next to it; the checks finding the lock taken wait
+for it to be released and read that reply. When the first check failed
+there is no reply to share, the next waiting check asks Jenkins itself.
+
+A reply is only good for the checks that were waiting for it : now and
+then (PRUNE_CHANCE of the fetches) the lock and reply files not used for
+REPLY_MAX_AGE seconds are removed, so the directory does not keep a copy
+of every reply.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_flight.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import errno
+import fcntl
+import hashlib
+import os
+import random
+import threading
+import time
+
+# Seconds between two attempts at a lock file held by another check
+LOCK_POLL = 0.02
+
+# Longer than any check waits for a flight, older files are of no use
+REPLY_MAX_AGE = 600
+# Share of the fetches cleaning the directory, about one in a hundred
+PRUNE_CHANCE = 0.01
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def flight_key(url, username, password):
+    """ One flight per url and per credentials, a readable file name
+
+    >>> flight_key('http://ci/api/json', 'user', 'pass') == flight_key('http://ci/api/json', 'user', 'pass')
+    True
+    >>> flight_key('http://ci/api/json', 'user', 'pass') == flight_key('http://ci/api/json', None, None)
+    False
+    """
+    return hashlib.sha1('%s\0%s\0%s' % (url, username, password)).hexdigest()
+
+
+class Flight(object):
+    """ A fetch in progress in this process, and how it ended """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Share the fetches of the same key, the lock and reply files are kept
+    in *directory*. last_source is 'coalesced' when the last call got the
+    reply of another fetch, 'jenkins' when it fetched.
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> flight = SingleFlight(tmp)
+    >>> flight.call('key', lambda: 'reply'), flight.last_source
+    ('reply', 'jenkins')
+    >>> shutil.rmtree(tmp)
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.last_source = None
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, '%s.%s' % (key, extension))
+
+    def call(self, key, function, deadline=None):
+        """ function() unless a fetch of *key* is in flight, its reply
+        then. Waiting keeps within the jenkins_http.Deadline *deadline*. """
+        _flights_lock.acquire()
+        try:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = Flight()
+        finally:
+            _flights_lock.release()
+
+        if not leader:
+            while not flight.done.isSet():
+                # socket.timeout once the budget is spent
+                flight.done.wait(deadline and deadline.timeout() or None)
+            self.last_source = 'coalesced'
+            if flight.error is not None:
+                raise flight.error
+            return flight.body
+
+        try:
+            flight.body = self._across(key, function, deadline)
+            return flight.body
+        except Exception, error:
+            flight.error = error
+            raise
+        finally:
+            _flights_lock.acquire()
+            try:
+                del _flights[key]
+            finally:
+                _flights_lock.release()
+            flight.done.set()
+
+    def _lock(self, handle, deadline):
+        """ flock *handle*, True when another check held it """
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except IOError, error:
+            if error.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+        if deadline is None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            return True
+        while True:
+            time.sleep(min(LOCK_POLL, max(0, deadline.remaining())))
+            # socket.timeout once the budget is spent, like a slow Jenkins
+            deadline.timeout()
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except IOError, error:
+                if error.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+
+    def _across(self, key, function, deadline):
+        """ The flight between processes, through the lock file """
+        try:
+            os.makedirs(self.directory)
+        except OSError, error:
+            if error.errno != errno.EEXIST:
+                raise
+        waiting = time.time()
+        handle = os.open(self.path(key, 'lock'), os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            # In use, prune() leaves it alone
+            os.utime(self.path(key, 'lock'), None)
+            if self._lock(handle, deadline):
+                body = self._shared(key, waiting)
+                if body is not None:
+                    self.last_source = 'coalesced'
+                    return body
+            else:
+                # A reply of an earlier flight must not be taken for ours
+                self._remove(key)
+            body = function()
+            self.last_source = 'jenkins'
+            self._share(key, body)
+            self.maybe_prune()
+            return body
+        finally:
+            os.close(handle)
+
+    def _shared(self, key, since):
+        """ Reply written by a flight that ended after *since*, or None """
+        try:
+            data = open(self.path(key, 'reply'), 'rb').read()
+        except IOError:
+            return None
+        written, sep, body = data.partition('\n')
+        try:
+            if sep and float(written) >= since:
+                return body
+        except ValueError:
+            pass
+        return None
+
+    def _share(self, key, body):
+        """ Write the reply for the checks waiting, replies may hold private
+        data : only for the nagios user """
+        path = self.path(key, 'reply')
+        temporary = '%s.%s' % (path, os.getpid())
+        handle = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0600)
+        try:
+            os.write(handle, '%.6f\n' % time.time())
+            while body:
+                body = body[os.write(handle, body):]
+        finally:
+            os.close(handle)
+        os.rename(temporary, path)
+
+    def prune(self, max_age=REPLY_MAX_AGE, now=None):
+        """ Remove the lock and reply files not used for *max_age* seconds,
+        urls no check asks for any more. Returns how many were removed. """
+        now = now or time.time()
+        removed = 0
+        for name in os.listdir(self.directory):
+            # .reply.PID are the leftovers of a check killed while writing
+            if not (name.endswith(('.lock', '.reply')) or '.reply.' in name):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < now - max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError, error:
+                # Another check pruning at the same time
+                if error.errno != errno.ENOENT:
+                    raise
+        return removed
+
+    def maybe_prune(self, max_age=REPLY_MAX_AGE, chance=PRUNE_CHANCE,
+                    rng=random):
+        """ prune() on a *chance* share of the calls. Returns how many
+        were removed, None when not pruned this time. """
+        if rng.random() < chance:
+            return self.prune(max_age)
+        return None
+
+    def _remove(self, key):
+        try:
+            os.unlink(self.path(key, 'reply'))
+        except OSError, error:
+            if error.errno != errno.ENOENT:
+                raise
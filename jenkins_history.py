@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Local history of the builds of each job : number, result, timestamp and
+duration, kept between plugin runs so trends can be checked without
+downloading hundreds of builds every time.
+
+Each job has its own append-only file made of segments, a segment holds a
+few builds column by column (all the numbers, then all the results...) :
+13 bytes per build. A run only asks Jenkins for the builds newer than the
+last stored one, with
+ job/NAME/api/json?tree=builds[number,result,timestamp,duration,building]{0,k}
+
+Files are compacted into a single segment of the *retention* most recent
+builds once they have too many segments, and prune() removes the files of
+jobs not seen for a while, so the disk use stays bounded.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_history.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import errno
+import fcntl
+import hashlib
+import os
+import random
+import struct
+import time
+from array import array
+
+from jenkins_common import KNOWN_RESULTS, RESULTS, result_code
+
+HISTORY_TREE = 'builds[number,result,timestamp,duration,building]{%d,%d}'
+
+SEGMENT_MAGIC = 'JHS1'
+SEGMENT_HEADER = struct.Struct('<4sI')
+MAX_UINT = 2 ** 32 - 1
+
+# Share of the runs walking the directory for prune(), about one in a hundred
+PRUNE_CHANCE = 0.01
+
+
+def history_url(job_url, start, end):
+    """ Builds start to end (excluded) of a job, the most recent first
+
+    >>> history_url('http://ci/job/x/', 0, 20)
+    'http://ci/job/x/api/json?tree=builds[number,result,timestamp,duration,building]{0,20}'
+    """
+    return job_url + 'api/json?tree=' + HISTORY_TREE % (start, end)
+
+
+def stored_code(result):
+    """ Code of a result in the files, 0 for a result unknown when the
+    format was written : its code in this process means nothing to the next
+
+    >>> stored_code('FAILURE'), stored_code(None), stored_code('WEIRD')
+    (3, 0, 0)
+    """
+    code = result_code(result)
+    if code < KNOWN_RESULTS:
+        return code
+    return 0
+
+
+def encode_segment(builds):
+    """ Column by column bytes of *builds*, api/json build records
+
+    >>> data = encode_segment([{'number': 7, 'result': 'SUCCESS', 'timestamp': 1328483562000, 'duration': 17852}])
+    >>> len(data)
+    21
+    >>> decode_segments(data)
+    (([7], [1], [1328483562], [17852]), 1)
+    """
+    numbers = [int(build['number']) for build in builds]
+    results = [stored_code(build.get('result')) for build in builds]
+    timestamps = [int(build['timestamp']) / 1000 for build in builds]
+    durations = [min(int(build.get('duration') or 0), MAX_UINT)
+                 for build in builds]
+    count = len(builds)
+    return (SEGMENT_HEADER.pack(SEGMENT_MAGIC, count) +
+            struct.pack('<%dI' % count, *numbers) +
+            struct.pack('<%dB' % count, *results) +
+            struct.pack('<%dI' % count, *timestamps) +
+            struct.pack('<%dI' % count, *durations))
+
+
+def decode_segments(data):
+    """
+    ((numbers, results, timestamps, durations), segments) : the columns of
+    every segment of *data* put together and the number of segments. A
+    truncated last segment (interrupted write) is ignored
+    """
+    columns = ([], [], [], [])
+    segments = 0
+    offset = 0
+    while offset + SEGMENT_HEADER.size <= len(data):
+        magic, count = SEGMENT_HEADER.unpack_from(data, offset)
+        end = offset + SEGMENT_HEADER.size + 13 * count
+        if magic != SEGMENT_MAGIC or end > len(data):
+            break
+        offset += SEGMENT_HEADER.size
+        for column, size, code in zip(columns, (4, 1, 4, 4), 'IBII'):
+            column.extend(struct.unpack_from('<%d%s' % (count, code), data,
+                                             offset))
+            offset += size * count
+        segments += 1
+    return tuple([list(column) for column in columns]), segments
+
+
+class History(object):
+    """
+    Stored builds of a job, oldest first, as parallel arrays
+
+    >>> history = History([1, 2, 3], [1, 3, 1], [100, 200, 300], [10000, 2000, 12000])
+    >>> len(history), history.watermark
+    (3, 3)
+    >>> history.durations()
+    [10, 12]
+    """
+
+    def __init__(self, numbers=(), results=(), timestamps=(), durations=(),
+                 segments=0):
+        self.numbers = array('I', numbers)
+        self.results = array('B', results)
+        self.timestamps = array('I', timestamps)
+        self.durations_ms = array('I', durations)
+        self.segments = segments
+
+    def __len__(self):
+        return len(self.numbers)
+
+    @property
+    def watermark(self):
+        """ Number of the most recent stored build, 0 when there is none """
+        return self.numbers and int(self.numbers[-1]) or 0
+
+    def durations(self, result='SUCCESS'):
+        """ Durations in seconds of the builds with that *result* """
+        code = stored_code(result)
+        return [int(duration / 1000) for duration, build_result in
+                zip(self.durations_ms, self.results) if build_result == code]
+
+
+class HistoryStore(object):
+    """
+    One history file per job under *directory*, jobs are keyed by their
+    url. Files are compacted to the *retention* latest builds once they
+    hold more than *segments* segments or twice *retention* builds.
+    """
+
+    def __init__(self, directory, retention=500, segments=16):
+        self.directory = directory
+        self.retention = retention
+        self.segments = segments
+
+    def path(self, key):
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.hist')
+
+    def sketch_path(self, key):
+        """ jenkins_quantiles sketch of *key*, next to its history, prune()
+        removes both
+
+        >>> store = HistoryStore('/var/tmp/h')
+        >>> store.sketch_path('http://ci/job/x/')[:-7] == store.path('http://ci/job/x/')[:-5]
+        True
+        """
+        return os.path.splitext(self.path(key))[0] + '.sketch'
+
+    def load(self, key):
+        """ History of *key*, empty when never stored """
+        try:
+            data = open(self.path(key), 'rb').read()
+        except IOError, error:
+            if error.errno != errno.ENOENT:
+                raise
+            data = ''
+        columns, segments = decode_segments(data)
+        return History(*columns, **{'segments': segments})
+
+    def _open(self, key):
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError, error:
+            if error.errno != errno.EEXIST:
+                raise
+        handle = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0600)
+        # Two checks of the same job must not append the same builds twice
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def append(self, key, builds):
+        """
+        Store the finished *builds* newer than the watermark, api/json
+        records in any order. Returns the number of builds added.
+        """
+        handle = self._open(key)
+        try:
+            history = self.load(key)
+            # Nothing from a running build on is stored yet, the watermark
+            # must not move past it before it finishes
+            running = [int(build['number']) for build in builds
+                       if build.get('building')]
+            limit = running and min(running) or None
+            new = sorted([build for build in builds
+                          if not build.get('building')
+                          and int(build['number']) > history.watermark
+                          and (limit is None or int(build['number']) < limit)],
+                         key=lambda build: int(build['number']))
+            if new:
+                os.write(handle, encode_segment(new))
+                if (history.segments + 1 > self.segments or
+                        len(history) + len(new) > 2 * self.retention):
+                    self._compact(key)
+            else:
+                # Still alive for prune(), even without new builds
+                os.utime(self.path(key), None)
+            return len(new)
+        finally:
+            os.close(handle)
+
+    def _compact(self, key):
+        """ Rewrite the file of *key* as one segment, caller holds the lock """
+        history = self.load(key)
+        keep = slice(max(0, len(history) - self.retention), len(history))
+        builds = [{'number': number, 'result': RESULTS[result],
+                   'timestamp': timestamp * 1000, 'duration': duration}
+                  for number, result, timestamp, duration in zip(
+                        history.numbers[keep], history.results[keep],
+                        history.timestamps[keep], history.durations_ms[keep])]
+        path = self.path(key)
+        temporary = '%s.%s' % (path, os.getpid())
+        handle = open(temporary, 'wb')
+        handle.write(encode_segment(builds))
+        handle.close()
+        os.chmod(temporary, 0600)
+        os.rename(temporary, path)
+
+    def update(self, key, fetch, page=20, latest=None):
+        """
+        Append the builds Jenkins has beyond the watermark : *fetch* is
+        called with (start, end) and returns api/json build records, the
+        most recent first. Pages are read until the watermark is reached,
+        at most *retention* builds. A job never stored gets its *retention*
+        latest builds in a single request. Nothing is fetched when the
+        number of the *latest* finished build is already stored.
+        Returns the updated History.
+        """
+        history = self.load(key)
+        watermark = history.watermark
+        if latest is not None and latest <= watermark:
+            return history
+        if not watermark:
+            page = self.retention
+        builds = []
+        start = 0
+        while start < self.retention:
+            batch = fetch(start, start + page)
+            builds.extend(batch)
+            if (len(batch) < page or
+                    min([int(build['number']) for build in batch]) <= watermark + 1):
+                break
+            start += page
+        if builds:
+            self.append(key, builds)
+        return self.load(key)
+
+    def prune(self, max_age=30 * 86400, now=None):
+        """ Remove the histories not updated for *max_age* seconds, jobs
+        deleted or renamed on Jenkins. Returns how many were removed. """
+        now = now or time.time()
+        removed = 0
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                # .sketch files of jenkins_quantiles go with their history
+                if (name.endswith(('.hist', '.sketch')) and
+                        os.path.getmtime(path) < now - max_age):
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def maybe_prune(self, max_age=30 * 86400, chance=PRUNE_CHANCE, rng=random):
+        """ prune() on a *chance* share of the calls, every check calls it
+        and the walk of the directory is paid now and then only. Returns how
+        many were removed, None when not pruned this time.
+
+        >>> HistoryStore('/nonexistent').maybe_prune(chance=0)
+        """
+        if rng.random() < chance:
+            return self.prune(max_age)
+        return None
@@ -0,0 +1,723 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+HTTP plumbing shared by the check_jenkins_* plugins.
+
+The long running processes keep their connections to Jenkins alive and
+reuse them between polls instead of paying a TCP and TLS handshake per
+request.
+
+The network modules (urllib2, httplib and ssl through them) are the
+largest part of a plugin startup, they are only imported once a request
+is actually made, or an error looked at : a check answered from the
+cache never loads them. benchmarks/bench_startup.py lists what a check
+from the cache imports.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_http.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import random
+import sys
+import time
+import zlib
+
+USER_AGENT = 'check_jenkins/%s https://github.com/jrottenberg/check_jenkins' % (
+                __version__)
+
+ACCEPT_ENCODING = 'gzip, deflate'
+CHUNK_SIZE = 16384
+
+# Seconds of the first backoff, doubled after each retry, and the most
+# a single wait can be
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 5
+
+
+def basic_auth(username, password):
+    """ Authorization header value, None without credentials
+
+    >>> basic_auth('user', 'pass')
+    'Basic dXNlcjpwYXNz'
+    >>> basic_auth('user', None)
+    """
+    if (username and password):
+        import base64
+        return 'Basic %s' % base64.b64encode('%s:%s' % (username, password))
+    return None
+
+
+class BodyTooLarge(Exception):
+    """ The reply went past the maximum size, reading was stopped """
+
+    def __init__(self, max_size):
+        Exception.__init__(self, 'reply larger than %s bytes' % max_size)
+        self.max_size = max_size
+
+
+class BodyReader(object):
+    """
+    Read a reply in chunks, decompressing gzip / deflate on the fly into a
+    buffer reused from one reply to the next. Stops as soon as the decoded
+    reply goes past *max_size* bytes.
+    After each read, transferred and decoded hold the byte counts.
+
+    >>> import StringIO
+    >>> gzipper = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    >>> raw = gzipper.compress('{"result": "SUCCESS"}' * 100) + gzipper.flush()
+    >>> reader = BodyReader()
+    >>> reader.decode(StringIO.StringIO(raw), 'gzip') == '{"result": "SUCCESS"}' * 100
+    True
+    >>> reader.transferred < 100 < reader.decoded
+    True
+    >>> BodyReader(max_size=1000).decode(StringIO.StringIO(raw), 'gzip')
+    Traceback (most recent call last):
+        ...
+    BodyTooLarge: reply larger than 1000 bytes
+    """
+
+    def __init__(self, max_size=None, timings=None):
+        self.max_size = max_size
+        self.timings = timings
+        self.buffer = bytearray()
+        self.transferred = 0
+        self.decoded = 0
+
+    def _decompressor(self, encoding):
+        if encoding == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            return zlib.decompressobj()
+        return None
+
+    def _append(self, data):
+        if self.max_size and len(self.buffer) + len(data) > self.max_size:
+            raise BodyTooLarge(self.max_size)
+        self.buffer.extend(data)
+
+    def decode(self, stream, encoding=None):
+        """ Whole decoded body of the file like *stream*, the time it took
+        goes to the read phase of *timings* """
+        if self.timings:
+            return self.timings.timed('read', self._decode, stream, encoding)
+        return self._decode(stream, encoding)
+
+    def _decode(self, stream, encoding):
+        del self.buffer[:]
+        self.transferred = 0
+        decompressor = self._decompressor(encoding)
+        # Never inflate more than what is still allowed, a tiny gzip
+        # bomb must not get the whole decompressed size in memory
+        limit = self.max_size and self.max_size + 1 or 0
+
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.transferred += len(chunk)
+            if decompressor is None:
+                self._append(chunk)
+                continue
+            if encoding == 'deflate' and self.transferred == len(chunk):
+                try:
+                    self._append(decompressor.decompress(chunk, limit))
+                except zlib.error:
+                    # Some servers send raw deflate, without the zlib header
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                    self._append(decompressor.decompress(chunk, limit))
+            else:
+                self._append(decompressor.decompress(chunk, limit))
+            while decompressor.unconsumed_tail:
+                self._append(decompressor.decompress(
+                                decompressor.unconsumed_tail, limit))
+
+        if decompressor is not None:
+            self._append(decompressor.flush())
+        self.decoded = len(self.buffer)
+        return str(self.buffer)
+
+    def read(self, response):
+        """ Decoded body of a urllib2 / httplib response """
+        if hasattr(response, 'getheader'):
+            encoding = response.getheader('Content-Encoding')
+        else:
+            # Not every urllib2 opener gives back mimetools headers
+            encoding = getattr(response.info(), 'getheader',
+                               lambda name: None)('Content-Encoding')
+        return self.decode(response, encoding and encoding.strip().lower())
+
+
+class Timings(object):
+    """
+    Seconds spent in each phase of a check, as Nagios performance data
+
+    >>> timings = Timings()
+    >>> timings.add('parse', 0.0002)
+    >>> timings.add('dns', 0.0011)
+    >>> timings.timed('check', max, 1, 2)
+    2
+    >>> timings.perfdata() # doctest: +ELLIPSIS
+    'dns=0.001100s parse=0.000200s check=0.0...s'
+    """
+
+    PHASES = ('dns', 'connect', 'tls', 'ttfb', 'read', 'parse', 'check')
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def timed(self, phase, function, *args):
+        """ function(*args), the time it took added to *phase* """
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.add(phase, time.time() - start)
+
+    def perfdata(self):
+        """ Only the phases that happened, a cache hit has no dns or tls """
+        return ' '.join(['%s=%.6fs' % (phase, self.phases[phase])
+                         for phase in self.PHASES if phase in self.phases])
+
+
+class Deadline(object):
+    """
+    One time budget for everything a check asks Jenkins, from the first
+    connection to the last byte of the last reply. Connecting and the TLS
+    handshake can be capped further by *connect* and *tls* seconds. *soft*
+    is when a stale reply is good enough, see jenkins_cache.ResponseCache.
+
+    >>> deadline = Deadline(10, connect=3, start=1000)
+    >>> deadline.timeout(deadline.connect, now=1001)
+    3
+    >>> deadline.timeout(now=1008.5)
+    1.5
+    >>> deadline.limit = 1005
+    >>> deadline.timeout(now=1006)
+    Traceback (most recent call last):
+        ...
+    timeout: 10s budget exhausted
+    """
+
+    def __init__(self, budget, connect=None, tls=None, soft=None, start=None):
+        self.budget = budget
+        self.connect = connect
+        self.tls = tls
+        self.soft = soft
+        self.start = start or time.time()
+        # Earlier end while a stale reply is waiting as a fallback
+        self.limit = None
+
+    def remaining(self, now=None):
+        end = self.start + self.budget
+        if self.limit is not None:
+            end = min(end, self.limit)
+        return end - (now or time.time())
+
+    def timeout(self, cap=None, now=None):
+        """ Socket timeout for the next operation, at most *cap* seconds,
+        socket.timeout when the budget is spent """
+        remaining = self.remaining(now)
+        if remaining <= 0:
+            import socket
+            raise socket.timeout('%ss budget exhausted' % self.budget)
+        if cap:
+            return min(cap, remaining)
+        return remaining
+
+
+def is_timeout(error):
+    """ Whether *error* is a timeout, as raised or wrapped by urllib2
+
+    >>> import socket, urllib2
+    >>> is_timeout(urllib2.URLError(socket.timeout('timed out')))
+    True
+    >>> is_timeout(urllib2.URLError('refused'))
+    False
+    """
+    import socket
+    from urllib2 import URLError
+    if isinstance(error, URLError) and not hasattr(error, 'code'):
+        error = error.reason
+    return isinstance(error, socket.timeout)
+
+
+def is_transient(error):
+    """ Whether asking again may get a reply : no connection, a reply cut
+    short, 429 Too Many Requests or any 5xx
+
+    >>> from urllib2 import HTTPError, URLError
+    >>> is_transient(URLError('Connection refused'))
+    True
+    >>> is_transient(HTTPError('http://ci/', 404, 'Not Found', {}, None))
+    False
+    >>> is_transient(HTTPStatusError('http://ci/', 429, 'Too Many Requests'))
+    True
+    >>> is_transient(BodyTooLarge(1000))
+    False
+    """
+    import httplib
+    import socket
+    from urllib2 import URLError
+    code = getattr(error, 'code', None) or getattr(error, 'status', None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return isinstance(error, (URLError, socket.error, httplib.HTTPException))
+
+
+def retry_after(error):
+    """ Seconds the Retry-After header of an error reply asks to wait
+
+    >>> from urllib2 import HTTPError
+    >>> retry_after(HTTPError('http://ci/', 429, 'Too Many', {'Retry-After': '2'}, None))
+    2
+    >>> retry_after(HTTPError('http://ci/', 503, 'Unavailable', {}, None))
+    """
+    headers = getattr(error, 'hdrs', None)
+    value = headers and headers.get('Retry-After')
+    # The http-date form is left to the backoff
+    if value and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=random):
+    """ Wait before retry number *attempt* (from 0), full jitter : checks
+    failing together do not come back together
+
+    >>> [0 <= backoff(attempt) <= min(BACKOFF_CAP, 0.2 * 2 ** attempt) for attempt in range(6)]
+    [True, True, True, True, True, True]
+    """
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def with_retries(function, retries=2, deadline=None, sleep=time.sleep):
+    """
+    function() asked again up to *retries* times while it fails with a
+    transient error, waiting a jittered exponential backoff (or what
+    Retry-After asks) in between. A wait that would go past the
+    jenkins_http.Deadline *deadline* is not made, the error is raised.
+
+    >>> from urllib2 import URLError
+    >>> errors = [URLError('refused'), URLError('refused')]
+    >>> def flaky():
+    ...     if errors:
+    ...         raise errors.pop()
+    ...     return 'reply'
+    >>> with_retries(flaky, 2, sleep=lambda seconds: None)
+    'reply'
+    >>> errors = [URLError('refused')]
+    >>> with_retries(flaky, 2, Deadline(10, start=time.time() - 10))
+    Traceback (most recent call last):
+        ...
+    URLError: <urlopen error refused>
+    """
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except Exception, error:
+            trace = sys.exc_info()[2]
+            if attempt >= retries or not is_transient(error):
+                raise error, None, trace
+            delay = max(backoff(attempt), retry_after(error) or 0)
+            if deadline and deadline.remaining() <= delay:
+                raise error, None, trace
+            sleep(delay)
+            attempt += 1
+
+
+def timed_opener(timings=None, deadline=None):
+    """
+    urllib2 opener whose connections add their dns, connect, tls and ttfb
+    (time to first byte, from the request sent to the status line) phases
+    to *timings*, and keep within the jenkins_http.Deadline *deadline* :
+    every send and receive gets what is left of the budget as its timeout,
+    a reply trickling in cannot outlast it. The name resolution is the one
+    step it cannot bound, getaddrinfo takes no timeout : the time it took
+    is taken from the budget, and the first connect fails if nothing is
+    left.
+    The opener is meant for the requests of one check : give it to
+    open_url rather than installing it, the urllib2 default opener is
+    shared by every thread.
+    """
+    import httplib
+    import socket
+    import urllib2
+
+    timings = timings or Timings()
+
+    class DeadlineSocket(object):
+        """ Socket whose every operation is bounded by the deadline """
+
+        def __init__(self, sock):
+            self._sock = sock
+
+        def _bounded(self, method, *args):
+            self._sock.settimeout(deadline.timeout())
+            return getattr(self._sock, method)(*args)
+
+        def recv(self, *args):
+            return self._bounded('recv', *args)
+
+        def recv_into(self, *args):
+            return self._bounded('recv_into', *args)
+
+        def send(self, *args):
+            return self._bounded('send', *args)
+
+        def sendall(self, *args):
+            return self._bounded('sendall', *args)
+
+        def makefile(self, mode='r', bufsize=-1):
+            if hasattr(self._sock, '_makefile_refs'):
+                # ssl sockets count their files before closing for good
+                self._sock._makefile_refs += 1
+                return socket._fileobject(self, mode, bufsize, close=True)
+            return socket._fileobject(self, mode, bufsize)
+
+        def __getattr__(self, name):
+            return getattr(self._sock, name)
+
+    def bounded(sock):
+        if deadline:
+            return DeadlineSocket(sock)
+        return sock
+
+    def connect(conn):
+        start = time.time()
+        host, port = conn.host, conn.port
+        if getattr(conn, '_tunnel_host', None):
+            host, port = conn._tunnel_host, conn._tunnel_port
+        addresses = socket.getaddrinfo(conn.host, conn.port, 0,
+                                       socket.SOCK_STREAM)
+        resolved = time.time()
+        timings.add('dns', resolved - start)
+        # Every address in turn, like socket.create_connection : a host with
+        # an IPv6 address the network does not route is still reached
+        error = socket.error('getaddrinfo returned no address')
+        for family, socktype, proto, canonname, address in addresses:
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if deadline:
+                    # Each attempt gets what is left of the budget
+                    sock.settimeout(deadline.timeout(deadline.connect))
+                elif conn.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(conn.timeout)
+                if getattr(conn, 'source_address', None):
+                    sock.bind(conn.source_address)
+                sock.connect(address)
+                break
+            except socket.error, error:
+                if sock is not None:
+                    sock.close()
+        else:
+            raise error
+        conn.sock = sock
+        timings.add('connect', time.time() - resolved)
+        if getattr(conn, '_tunnel_host', None):
+            conn._tunnel()
+        return host
+
+    class Timed:
+        # httplib classes are old style, this has to come first in the bases
+
+        def request(self, *args, **kwargs):
+            httplib.HTTPConnection.request(self, *args, **kwargs)
+            self.sent = time.time()
+
+        def getresponse(self, *args, **kwargs):
+            response = httplib.HTTPConnection.getresponse(self, *args,
+                                                          **kwargs)
+            timings.add('ttfb', time.time() - self.sent)
+            return response
+
+    class TimedHTTPConnection(Timed, httplib.HTTPConnection):
+
+        def connect(self):
+            connect(self)
+            self.sock = bounded(self.sock)
+
+    class TimedHTTPSConnection(Timed, httplib.HTTPSConnection):
+
+        def connect(self):
+            host = connect(self)
+            start = time.time()
+            if deadline:
+                self.sock.settimeout(deadline.timeout(deadline.tls))
+            if getattr(self, '_context', None):
+                self.sock = self._context.wrap_socket(self.sock,
+                                                      server_hostname=host)
+            else:
+                import ssl
+                self.sock = ssl.wrap_socket(self.sock, self.key_file,
+                                            self.cert_file)
+            timings.add('tls', time.time() - start)
+            self.sock = bounded(self.sock)
+
+    class TimedHTTPHandler(urllib2.HTTPHandler):
+
+        def http_open(self, req):
+            return self.do_open(TimedHTTPConnection, req)
+
+    class TimedHTTPSHandler(urllib2.HTTPSHandler):
+
+        def https_open(self, req):
+            if getattr(self, '_context', None):
+                return self.do_open(TimedHTTPSConnection, req,
+                                    context=self._context)
+            return self.do_open(TimedHTTPSConnection, req)
+
+    return urllib2.build_opener(TimedHTTPHandler, TimedHTTPSHandler)
+
+
+def open_url(url, username, password, timeout, headers=None, opener=None):
+    """
+    Same request as get_data in check_jenkins.py, but errors are raised
+    instead of leaving the process and the timeout is per request, it is
+    safe to call from several threads. Goes through *opener* (see
+    timed_opener) when given. Returns the urllib2 response.
+    """
+    import urllib2
+    request = urllib2.Request(url)
+    request.add_header('User-Agent', USER_AGENT)
+    request.add_header('Accept-Encoding', ACCEPT_ENCODING)
+    auth = basic_auth(username, password)
+    if auth:
+        request.add_header("Authorization", auth)
+    for name, value in (headers or {}).items():
+        request.add_header(name, value)
+    if opener:
+        return opener.open(request, timeout=timeout)
+    return urllib2.urlopen(request, timeout=timeout)
+
+
+def fetch(url, username, password, timeout, reader=None):
+    """ Decoded body of *url*, see open_url and BodyReader """
+    return (reader or BodyReader()).read(
+                open_url(url, username, password, timeout))
+
+
+def get_reply(url, username, password, timeout, cache=None, reader=None,
+              timings=None, breaker=None, deadline=None, retries=0,
+              flight=None):
+    """
+    Body of *url* for the get_data of the plugins, errors are raised for
+    them to turn into a Nagios status.
+    Go through the jenkins_cache.ResponseCache *cache* when given
+    The reply is read (and decompressed) by the BodyReader *reader*
+    The connection phases are added to the Timings *timings*
+    Fail fast while the jenkins_breaker.CircuitBreaker *breaker* of the
+    host is open, it only hears of the requests that reached for Jenkins :
+    a reply of the cache or of another check tells nothing about the host
+    Everything asked to Jenkins keeps within the Deadline *deadline*, one
+    budget for the connection and every read
+    Transient errors are tried again up to *retries* times, with a
+    jittered backoff within the deadline
+    Concurrent checks of the same url share the fetch of the
+    jenkins_flight.SingleFlight *flight*
+    """
+    reader = reader or BodyReader()
+    # The opener of this check, set once a request is about to leave for
+    # Jenkins
+    connected = []
+
+    def connect():
+        """ Only now are the network modules loaded, returns the opener """
+        if not connected:
+            if breaker:
+                breaker.allow()
+            opener = None
+            if timings or deadline:
+                opener = timed_opener(timings, deadline)
+            connected.append(opener)
+        return connected[0]
+
+    def fetch():
+        if cache:
+            return cache.fetch(url, username, password, timeout, reader,
+                               deadline, connect)
+        return reader.read(open_url(url, username, password, timeout,
+                                    opener=connect()))
+
+    def attempts():
+        return with_retries(fetch, retries, deadline)
+
+    def shared():
+        if not flight:
+            return attempts()
+        from jenkins_flight import flight_key
+        body = flight.call(flight_key(url, username, password), attempts,
+                           deadline)
+        if cache and flight.last_source == 'coalesced':
+            cache.last_source = 'coalesced'
+        return body
+
+    try:
+        body = shared()
+    except Exception, error:
+        trace = sys.exc_info()[2]
+        if breaker and connected:
+            breaker.record(error)
+        raise error, None, trace
+    # A stale reply served at the soft deadline is no news of the host
+    if breaker and connected and not (cache and cache.last_source == 'stale'):
+        breaker.record()
+    return body
+
+
+def describe_error(url, error,
+                   missing='Error on %s does the job exist or ever ran ?'):
+    """ (status, message) get_data prints for *error*, UNKNOWN when it is
+    not an error of Jenkins. *missing* is the message of an url Jenkins
+    has not.
+
+    >>> from urllib2 import URLError
+    >>> describe_error('http://ci/job/x/', URLError('refused'))
+    ('CRITICAL', 'Error on http://ci/job/x/ Double check the server name')
+    >>> import socket
+    >>> describe_error('http://ci/job/x/', socket.timeout('timed out'))
+    ('CRITICAL', 'Error on http://ci/job/x/ timed out')
+    >>> describe_error('http://ci/job/x/', URLError(socket.timeout('timed out')))
+    ('CRITICAL', 'Error on http://ci/job/x/ timed out')
+    """
+    import httplib
+    import socket
+    from urllib2 import HTTPError, URLError
+    from jenkins_breaker import CircuitOpen
+    if isinstance(error, BodyTooLarge):
+        return ('CRITICAL', 'Error on %s %s' % (url, error))
+    elif isinstance(error, CircuitOpen):
+        return ('CRITICAL', 'Not connecting to %s, %s' % (url, error))
+    elif isinstance(error, HTTPError):
+        return ('CRITICAL', missing % url)
+    elif isinstance(error, URLError):
+        if is_timeout(error):
+            return ('CRITICAL', 'Error on %s timed out' % url)
+        return ('CRITICAL', 'Error on %s Double check the server name' % url)
+    elif isinstance(error, (socket.error, httplib.HTTPException)):
+        return ('CRITICAL', 'Error on %s %s' % (url, error))
+    return ('UNKNOWN', 'Error on %s %s' % (url, error))
+
+
+class HTTPStatusError(Exception):
+    """ Jenkins answered, but not with a 200 """
+
+    def __init__(self, url, status, reason):
+        Exception.__init__(self, '%s returned %s %s' % (url, status, reason))
+        self.url = url
+        self.status = status
+
+
+class ConnectionPool(object):
+    """
+    Idle keep-alive connections per (scheme, host, port), shared by threads
+    """
+
+    def __init__(self, timeout=10, size=4):
+        import threading
+        self.timeout = timeout
+        self.size = size
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _key(self, url):
+        from urlparse import urlsplit
+        parts = urlsplit(url)
+        port = parts.port or (parts.scheme == 'https' and 443 or 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % (path, parts.query)
+        return (parts.scheme, parts.hostname, port), path
+
+    def _connect(self, key):
+        import httplib
+        scheme, host, port = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _acquire(self, key):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        finally:
+            self._lock.release()
+        return self._connect(key), False
+
+    def _release(self, key, conn):
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def request(self, url, username=None, password=None, headers=None):
+        """
+        GET *url*, returns (status, headers, body), headers names are
+        lower case. A connection closed by the server while idle is
+        retried once on a fresh one.
+        """
+        import httplib
+        import socket
+        key, path = self._key(url)
+        all_headers = {'User-Agent': USER_AGENT,
+                       'Accept-Encoding': ACCEPT_ENCODING}
+        auth = basic_auth(username, password)
+        if auth:
+            all_headers['Authorization'] = auth
+        all_headers.update(headers or {})
+
+        conn, reused = self._acquire(key)
+        while True:
+            try:
+                conn.request('GET', path, headers=all_headers)
+                response = conn.getresponse()
+                body = BodyReader().read(response)
+                break
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = self._connect(key), False
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return (response.status,
+                dict([(k.lower(), v) for k, v in response.getheaders()]),
+                body)
+
+    def get(self, url, username=None, password=None, headers=None):
+        """ Body of *url*, raises HTTPStatusError on anything but a 200 """
+        import httplib
+        status, headers, body = self.request(url, username, password, headers)
+        if status != 200:
+            raise HTTPStatusError(url, status, httplib.responses.get(status, ''))
+        return body
+
+    def close(self):
+        """ Close every idle connection """
+        self._lock.acquire()
+        try:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
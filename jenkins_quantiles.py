@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Streaming quantiles of the build durations of a job, to derive the
+thresholds from how long the job usually takes instead of tuning -w / -c
+by hand.
+
+The quantiles are estimated with the P-Square algorithm (Jain & Chlamtac,
+"The P2 algorithm for dynamic calculation of quantiles and histograms
+without storing observations", 1985) : five markers per quantile, updated
+in constant time and space for every new build, never sorting a history.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_quantiles.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import json
+import os
+
+from jenkins_common import result_code
+
+
+class P2Quantile(object):
+    """
+    Estimate of the *p* quantile of the values added so far
+
+    >>> median = P2Quantile(0.5)
+    >>> for value in [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]:
+    ...     median.add(value)
+    >>> round(median.value())
+    4.0
+    >>> P2Quantile(0.5).value()
+    """
+
+    def __init__(self, p, state=None):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+        if state:
+            self.count = state['count']
+            self.heights = state['heights']
+            self.positions = state['positions']
+            self.desired = state['desired']
+
+    def state(self):
+        """ What __init__ needs to carry on, JSON serializable """
+        return {'count': self.count, 'heights': self.heights,
+                'positions': self.positions, 'desired': self.desired}
+
+    def add(self, value):
+        self.count += 1
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(float(value))
+            heights.sort()
+            return
+
+        positions = self.positions
+        if value < heights[0]:
+            heights[0] = float(value)
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = float(value)
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            offset = self.desired[i] - positions[i]
+            if ((offset >= 1 and positions[i + 1] - positions[i] > 1) or
+                    (offset <= -1 and positions[i - 1] - positions[i] < -1)):
+                step = offset > 0 and 1 or -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        heights, positions = self.heights, self.positions
+        return heights[i] + float(step) / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + step) *
+            (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i]) +
+            (positions[i + 1] - positions[i] - step) *
+            (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1]))
+
+    def _linear(self, i, step):
+        heights, positions = self.heights, self.positions
+        return heights[i] + step * (heights[i + step] - heights[i]) / (
+                    positions[i + step] - positions[i])
+
+    def value(self):
+        """ The estimate, None before the first value """
+        if not self.heights:
+            return None
+        if self.count < 5:
+            return self.heights[int(round(self.p * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+
+class DurationSketch(object):
+    """
+    p95 and p99 of the durations (seconds) of the successful builds of a
+    job, *last* is the number of the last build added
+
+    >>> sketch = DurationSketch()
+    >>> for number in range(1, 201):
+    ...     sketch.add(number, 600 + number % 100)
+    >>> warning, critical = sketch.thresholds(1.5)
+    >>> 690 < warning < 700 and 1030 < critical < 1050
+    True
+    """
+
+    QUANTILES = (0.95, 0.99)
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.last = state.get('last', 0)
+        self.quantiles = [P2Quantile(p, state.get(str(p)))
+                          for p in self.QUANTILES]
+
+    @property
+    def count(self):
+        return self.quantiles[0].count
+
+    def add(self, number, duration):
+        self.last = max(self.last, number)
+        for quantile in self.quantiles:
+            quantile.add(duration)
+
+    def update(self, history):
+        """ Add the successful builds of a jenkins_history.History newer
+        than the last one added, returns how many were added """
+        success = result_code('SUCCESS')
+        added = 0
+        for number, result, duration in zip(history.numbers, history.results,
+                                            history.durations_ms):
+            if number > self.last and result == success:
+                self.add(number, duration / 1000.0)
+                added += 1
+        self.last = max(self.last, history.watermark)
+        return added
+
+    def thresholds(self, factor):
+        """ (warning, critical) in seconds : p95 and p99 x *factor* """
+        p95, p99 = [quantile.value() for quantile in self.quantiles]
+        return int(p95), int(max(p95, p99 * factor))
+
+    def state(self):
+        state = {'last': self.last}
+        for p, quantile in zip(self.QUANTILES, self.quantiles):
+            state[str(p)] = quantile.state()
+        return state
+
+    @classmethod
+    def load(cls, path):
+        """ Sketch saved in *path*, a new one if there is none """
+        try:
+            return cls(json.load(open(path)))
+        except (IOError, ValueError, KeyError):
+            return cls()
+
+    def save(self, path):
+        temporary = '%s.%s' % (path, os.getpid())
+        handle = open(temporary, 'w')
+        json.dump(self.state(), handle)
+        handle.close()
+        os.rename(temporary, path)
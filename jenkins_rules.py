@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Thresholds per job from a rules file, instead of -w / -c repeated in the
+Nagios configuration of every job. One rule per line, a job name pattern
+then its settings, the first rule matching a job wins :
+
+ # pattern              settings
+ deploy-prod            warning=5m critical=15m
+ nightly-*              warning=2h critical=4h lsb-warning=1d lsb-critical=3d
+ team/data/*            check=lsb lsb-warning=12h lsb-critical=1d
+ re:^release-\d+\.\d+$  warning=10m critical=42m
+ sandbox-*              check=skip
+
+Durations take the units of check_jenkins_lsb.convert_to_timedelta, check
+is build (check_jenkins), lsb (check_jenkins_lsb), both or skip.
+
+The rules are compiled once into an index : a dict for the exact names, a
+trie for the patterns only ending with *, one of the reversed names for
+the patterns only starting with *, and a few combined regular expressions
+for the rest. Looking a job up costs the length of its name,
+not the number of rules. The index is kept next to the rules file, and
+only rebuilt when the file changes.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_rules.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import errno
+import fnmatch
+import json
+import os
+import re
+
+from check_jenkins_lsb import convert_to_timedelta
+from jenkins_common import nagios_exit
+
+CHECKS = ('build', 'lsb', 'both', 'skip')
+SETTINGS = ('check', 'warning', 'critical', 'lsb-warning', 'lsb-critical')
+
+# Bumped when the index changes, an older index file is rebuilt
+INDEX_VERSION = 1
+
+# Python 2 regular expressions hold at most 100 groups
+MAX_GROUPS = 99
+
+
+class RulesError(Exception):
+    """ The rules file cannot be used, the message tells where """
+
+
+def seconds(duration):
+    """ Seconds of a convert_to_timedelta duration
+
+    >>> seconds('2h')
+    7200
+    """
+    delta = convert_to_timedelta(duration)
+    return delta.seconds + delta.days * 86400
+
+
+def parse_settings(words):
+    """ Settings of a rule as stored in the index
+
+    >>> sorted(parse_settings(['warning=2h', 'critical=4h']).items())
+    [('thresholds', [7200, 14400])]
+    >>> parse_settings(['check=skip'])
+    {'check': 'skip'}
+    >>> parse_settings(['warning=2h'])
+    Traceback (most recent call last):
+        ...
+    RulesError: warning and critical go together
+    """
+    values = {}
+    for word in words:
+        name, sep, value = word.partition('=')
+        if not sep or name not in SETTINGS:
+            raise RulesError('unknown setting %s, use %s' % (
+                                word, ', '.join(SETTINGS)))
+        values[str(name)] = str(value)
+
+    settings = {}
+    if 'check' in values:
+        if values['check'] not in CHECKS:
+            raise RulesError('unknown check %s, use %s' % (
+                                values['check'], ', '.join(CHECKS)))
+        settings['check'] = values['check']
+    for first, second in (('warning', 'critical'),
+                          ('lsb-warning', 'lsb-critical')):
+        if (first in values) != (second in values):
+            raise RulesError('%s and %s go together' % (first, second))
+    try:
+        if 'warning' in values:
+            settings['thresholds'] = [seconds(values['warning']),
+                                      seconds(values['critical'])]
+        if 'lsb-warning' in values:
+            # check_jenkins_lsb takes them as they are written
+            seconds(values['lsb-warning'])
+            seconds(values['lsb-critical'])
+            settings['lsb_warning'] = values['lsb-warning']
+            settings['lsb_critical'] = values['lsb-critical']
+    except ValueError, error:
+        raise RulesError(str(error))
+    return settings
+
+
+def parse_rules(lines, source='rules'):
+    """ [(pattern, settings)] in the order of the file
+
+    >>> parse_rules(['# comment', '', 'nightly-*  check=skip'])
+    [(u'nightly-*', {'check': 'skip'})]
+    >>> parse_rules(['nightly-* warning=2X critical=4h'])
+    Traceback (most recent call last):
+        ...
+    RulesError: rules:1: Please use a valid unit
+    """
+    rules = []
+    for number, line in enumerate(lines):
+        if isinstance(line, str):
+            # Job names come as unicode from the api
+            line = line.decode('utf-8')
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        try:
+            if words[0].startswith('re:'):
+                re.compile(words[0][3:])
+            rules.append((words[0], parse_settings(words[1:])))
+        except (RulesError, re.error, UnicodeError), error:
+            raise RulesError('%s:%s: %s' % (source, number + 1, error))
+    return rules
+
+
+def pattern_kind(pattern):
+    """ Where a pattern goes in the index
+
+    >>> [pattern_kind(p) for p in ('deploy', 'nightly-*', '*', '*-nightly', 'a*b', 're:^x')]
+    ['exact', 'prefix', 'prefix', 'suffix', 'regex', 'regex']
+    """
+    if pattern.startswith('re:'):
+        return 'regex'
+    if not re.search(r'[*?[]', pattern):
+        return 'exact'
+    if not re.search(r'[*?[]', pattern[:-1]) and pattern.endswith('*'):
+        return 'prefix'
+    if not re.search(r'[*?[]', pattern[1:]) and pattern.startswith('*'):
+        return 'suffix'
+    return 'regex'
+
+
+def trie_add(trie, key, position):
+    """ Rule *position* for the names starting with *key* """
+    node = trie
+    for char in key:
+        node = node.setdefault(char, {})
+    # A rule with the same key before this one wins anyway
+    node.setdefault('', position)
+
+
+def trie_first(trie, name, best=None):
+    """ First rule of *trie* whose key starts *name*, *best* if earlier
+
+    >>> trie = {}
+    >>> trie_add(trie, 'ab', 3); trie_add(trie, 'a', 5)
+    >>> trie_first(trie, 'abc'), trie_first(trie, 'ax'), trie_first(trie, 'b')
+    (3, 5, None)
+    """
+    node = trie
+    position = 0
+    while node is not None:
+        if '' in node and (best is None or node[''] < best):
+            best = node['']
+        if position == len(name):
+            break
+        node = node.get(name[position])
+        position += 1
+    return best
+
+
+def pattern_regex(pattern):
+    """ Regular expression matching a whole job name, without flags
+
+    >>> pattern_regex('*-nightly')
+    '(?:.*\\\\-nightly)\\\\Z'
+    >>> pattern_regex('re:^release-\\\\d+$')
+    '(?:^release-\\\\d+$)\\\\Z'
+    """
+    if pattern.startswith('re:'):
+        expression = pattern[3:]
+    else:
+        expression = re.sub(r'\\Z\(\?ms\)$', '', fnmatch.translate(pattern))
+    return '(?:%s)\\Z' % expression
+
+
+class RuleIndex(object):
+    """
+    The rules compiled for lookups, the first matching rule wins
+
+    >>> index = RuleIndex(parse_rules(['deploy warning=5m critical=15m',
+    ...                                'team/* check=lsb',
+    ...                                'team/app check=skip',
+    ...                                '*-nightly warning=2h critical=4h',
+    ...                                'db-*ly check=skip']))
+    >>> index.lookup('deploy')
+    {'thresholds': [300, 900]}
+    >>> index.lookup('team/app')
+    {'check': 'lsb'}
+    >>> index.lookup('db-nightly')
+    {'thresholds': [7200, 14400]}
+    >>> index.lookup('db-weekly')
+    {'check': 'skip'}
+    >>> index.lookup('other')
+    """
+
+    def __init__(self, rules=()):
+        self.settings = []
+        self.exact = {}
+        self.trie = {}
+        self.suffixes = {}
+        self.regexes = []
+        pending = []
+        for position, (pattern, settings) in enumerate(rules):
+            self.settings.append(settings)
+            kind = pattern_kind(pattern)
+            if kind == 'exact':
+                self.exact.setdefault(pattern, position)
+            elif kind == 'prefix':
+                trie_add(self.trie, pattern[:-1], position)
+            elif kind == 'suffix':
+                trie_add(self.suffixes, pattern[:0:-1], position)
+            else:
+                pending.append((position, pattern_regex(pattern)))
+        self._combine(pending)
+
+    def _combine(self, pending):
+        """ One alternation per MAX_GROUPS groups, in the order of the
+        rules : the alternative matching is the first matching rule """
+        parts, groups, total = [], {}, 0
+        for position, expression in pending:
+            size = re.compile(expression).groups + 1
+            if parts and total + size > MAX_GROUPS:
+                self.regexes.append(('|'.join(parts), groups))
+                parts, groups, total = [], {}, 0
+            # The group of the whole alternative closes last : lastindex
+            groups[total + 1] = position
+            parts.append('(%s)' % expression)
+            total += size
+        if parts:
+            self.regexes.append(('|'.join(parts), groups))
+        self._compiled = [(re.compile(expression), groups)
+                          for expression, groups in self.regexes]
+
+    def lookup(self, name):
+        """ Settings of the first rule matching *name*, None without one """
+        if isinstance(name, str):
+            name = name.decode('utf-8', 'replace')
+        best = self.exact.get(name)
+        best = trie_first(self.trie, name, best)
+        best = trie_first(self.suffixes, name[::-1], best)
+        for expression, groups in self._compiled:
+            if best is not None and min(groups.values()) > best:
+                break
+            match = expression.match(name)
+            if match:
+                position = groups[match.lastindex]
+                if best is None or position < best:
+                    best = position
+                break
+        if best is None:
+            return None
+        return self.settings[best]
+
+    def state(self):
+        """ Everything lookups need, for json """
+        return {'settings': self.settings, 'exact': self.exact,
+                'trie': self.trie, 'suffixes': self.suffixes,
+                'regexes': [(expression, sorted(groups.items()))
+                            for expression, groups in self.regexes]}
+
+    @classmethod
+    def from_state(cls, state):
+        index = cls()
+        index.settings = state['settings']
+        index.exact = state['exact']
+        index.trie = state['trie']
+        index.suffixes = state['suffixes']
+        index.regexes = [(expression, dict(groups))
+                         for expression, groups in state['regexes']]
+        index._compiled = [(re.compile(expression), groups)
+                           for expression, groups in index.regexes]
+        return index
+
+    @classmethod
+    def load(cls, path, index_path=None):
+        """
+        Index of the rules file *path*, from *index_path* (path.index by
+        default) when it was built from the same version of the file
+        """
+        index_path = index_path or path + '.index'
+        info = os.stat(path)
+        key = [INDEX_VERSION, info.st_mtime, info.st_size]
+        try:
+            stored = json.load(open(index_path))
+            if stored.get('key') == key:
+                return cls.from_state(stored['index'])
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+        index = cls(parse_rules(open(path), path))
+        # Not being able to keep the index only costs the next run a rebuild
+        temporary = '%s.%s' % (index_path, os.getpid())
+        try:
+            handle = open(temporary, 'w')
+            json.dump({'key': key, 'index': index.state()}, handle)
+            handle.close()
+            os.rename(temporary, index_path)
+        except (IOError, OSError), error:
+            if error.errno not in (errno.EACCES, errno.EROFS, errno.ENOENT,
+                                   errno.ENOSPC, errno.EPERM):
+                raise
+        return index
+
+
+class RulesFile(object):
+    """ RuleIndex of a rules file, loaded again once the file changed, for
+    the processes running for a long time. A broken new version leaves
+    the previous index in place. """
+
+    def __init__(self, path):
+        self.path = path
+        self.key = None
+        self.index = None
+        self.error = None
+
+    def current(self):
+        try:
+            info = os.stat(self.path)
+            key = (info.st_mtime, info.st_size)
+            if key != self.key:
+                self.index = RuleIndex.load(self.path)
+                self.key = key
+            self.error = None
+        except (RulesError, IOError, OSError), error:
+            self.error = str(error)
+            if self.index is None:
+                raise
+        return self.index
+
+
+def load_index(path):
+    """ RuleIndex of *path* for a plugin, UNKNOWN when it cannot be used """
+    try:
+        return RuleIndex.load(path)
+    except (RulesError, IOError, OSError), error:
+        print 'UNKNOWN - Rules not loaded : %s' % error
+        nagios_exit('UNKNOWN')
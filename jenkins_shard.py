@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Share the jobs between several monitoring nodes : every node runs
+check_jenkins_daemon.py with its own id and the same member list, each
+job belongs to one node, the one polling it and keeping its last build.
+
+Jobs go to nodes by consistent hashing : every node gets *vnodes* points
+on a ring, a job belongs to the first point after the hash of its master
+and name. Adding a node only moves the jobs landing on its points, about
+one job in (number of nodes) instead of nearly all of them with a modulo.
+
+A check of a job can be sent to any node, it is forwarded to the owner
+over TCP with the same json lines as the local socket.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_shard.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+import bisect
+import hashlib
+
+# Points per node, more spreads the jobs more evenly
+VNODES = 100
+
+
+def ring_hash(text):
+    """ Position on the ring of *text*, the first 8 bytes of its md5
+
+    >>> ring_hash('ci/nightly') == ring_hash(u'ci/nightly')
+    True
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return int(hashlib.md5(text).hexdigest()[:16], 16)
+
+
+def parse_members(members):
+    """ {id: (host, port)} of ID=HOST:PORT members
+
+    >>> sorted(parse_members(['a=mon1:9120', 'b=10.0.0.2:9120']).items())
+    [('a', ('mon1', 9120)), ('b', ('10.0.0.2', 9120))]
+    >>> parse_members(['a'])
+    Traceback (most recent call last):
+        ...
+    ValueError: member a is not ID=HOST:PORT
+    """
+    parsed = {}
+    for member in members:
+        node, sep, address = member.partition('=')
+        host, colon, port = address.rpartition(':')
+        if not (sep and node and colon and port.isdigit()):
+            raise ValueError('member %s is not ID=HOST:PORT' % member)
+        parsed[node] = (host, int(port))
+    return parsed
+
+
+def job_key(hostname, job):
+    """ What is hashed, jobs of every master spread on the same ring """
+    return u'%s/%s' % (hostname, job)
+
+
+class HashRing(object):
+    """
+    Nodes owning the keys, *vnodes* points per node
+
+    >>> ring = HashRing(['a', 'b', 'c'])
+    >>> ring.owner(job_key('ci', 'nightly')) in ('a', 'b', 'c')
+    True
+    >>> keys = [job_key('ci', 'job-%s' % i) for i in range(1000)]
+    >>> before = [ring.owner(key) for key in keys]
+    >>> after = [HashRing(['a', 'b', 'c', 'd']).owner(key) for key in keys]
+    >>> moved = [old for old, new in zip(before, after) if old != new]
+    >>> 150 < len(moved) < 350
+    True
+    >>> set(after[i] for i in range(1000) if before[i] != after[i])
+    set(['d'])
+    """
+
+    def __init__(self, nodes, vnodes=VNODES):
+        points = sorted([(ring_hash('%s#%s' % (node, replica)), node)
+                         for node in nodes for replica in range(vnodes)])
+        self.nodes = sorted(nodes)
+        self.hashes = [point for point, node in points]
+        self.owners = [node for point, node in points]
+
+    def owner(self, key):
+        """ Node of the first point after the hash of *key* """
+        if not self.hashes:
+            return None
+        position = bisect.bisect(self.hashes, ring_hash(key))
+        return self.owners[position % len(self.hashes)]
+
+
+class Shard(object):
+    """
+    The place of this *node* among the *members* ({id: (host, port)})
+    """
+
+    def __init__(self, node, members, vnodes=VNODES, timeout=10):
+        if node not in members:
+            raise ValueError('node %s is not a member' % node)
+        self.node = node
+        self.members = members
+        self.ring = HashRing(members.keys(), vnodes)
+        self.timeout = timeout
+
+    def owner(self, hostname, job):
+        return self.ring.owner(job_key(hostname, job))
+
+    def owns(self, hostname, job):
+        return self.owner(hostname, job) == self.node
+
+    def forward(self, owner, request):
+        """ Reply of the *owner* node to a client *request* """
+        import socket
+        from check_jenkins_client import query_daemon
+        address = self.members[owner]
+        try:
+            reply = query_daemon(address, dict(request, forwarded=True),
+                                 self.timeout)
+        except (socket.error, ValueError), error:
+            return {'error': '%s polled by node %s, not reachable on %s:%s : %s' % (
+                        request.get('job'), owner, address[0], address[1],
+                        error)}
+        reply['node'] = owner
+        return reply
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+
+Compact record of a build for the processes keeping every job in memory
+(check_jenkins_daemon.py, check_jenkins_webhook.py) : only what the checks
+read, in __slots__ objects instead of the dicts of the api reply.
+
+The result is a small integer, the url is the job url, interned, plus the
+build number : a 100k jobs daemon holds about 250 bytes per build instead
+of one dict, its keys and its strings. benchmarks/bench_memory.py shows
+the bytes per job of each representation.
+
+A record is read like the api dict it comes from, check_result takes
+either.
+
+Few doctests, run with :
+ $ python -m doctest jenkins_state.py -v
+
+"""
+__author__ = 'Julien Rottenberg'
+
+__version__ = "1.0"
+
+from jenkins_common import RESULTS, result_code
+
+FIELDS = ('number', 'building', 'result', 'timestamp', 'duration', 'url')
+
+
+def intern_text(text):
+    """ One string for every build of a job, and for every poll """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return intern(text)
+
+
+class BuildState(object):
+    """
+    The fields of a build the checks need, None when the reply had not
+    the field
+
+    >>> build = BuildState.from_build({'number': 745, 'building': False,
+    ...     'result': u'FAILURE', 'timestamp': 1328483562000, 'duration': 17852,
+    ...     'url': u'http://ci/job/test/745/', 'actions': []})
+    >>> build['result'], build['url'], build.base
+    ('FAILURE', 'http://ci/job/test/745/', 'http://ci/job/test/')
+    >>> build == BuildState.from_build(build.as_dict())
+    True
+    >>> BuildState.from_build({'number': 6}).as_dict()
+    {'number': 6}
+    >>> build['executor']
+    Traceback (most recent call last):
+        ...
+    KeyError: 'executor'
+    """
+    __slots__ = ('number', 'building', 'result', 'timestamp', 'duration',
+                 'base', 'own_url')
+
+    def __init__(self, number=None, building=None, result=None,
+                 timestamp=None, duration=None, url=None):
+        self.number = number
+        self.building = building
+        self.result = result_code(result)
+        self.timestamp = timestamp
+        self.duration = duration
+        self.base = None
+        self.own_url = None
+        if url is None:
+            return
+        suffix = '%s/' % number
+        if number is not None and url.endswith('/' + suffix):
+            self.base = intern_text(url[:-len(suffix)])
+        else:
+            # Not the shape Jenkins gives, kept whole
+            self.own_url = url
+
+    @classmethod
+    def from_build(cls, build):
+        """ Record of a build of the api reply, None for None """
+        if build is None:
+            return None
+        timestamp = build.get('timestamp')
+        if timestamp is not None:
+            # Older replies give it as a string
+            timestamp = int(timestamp)
+        return cls(build.get('number'), build.get('building'),
+                   build.get('result'), timestamp, build.get('duration'),
+                   build.get('url'))
+
+    @property
+    def url(self):
+        if self.base is not None:
+            return '%s%s/' % (self.base, self.number)
+        return self.own_url
+
+    def get(self, field, default=None):
+        if field == 'result':
+            value = RESULTS[self.result]
+        elif field in FIELDS:
+            value = getattr(self, field)
+        else:
+            return default
+        if value is None:
+            return default
+        return value
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None and not (field == 'result' and self.building):
+            raise KeyError(field)
+        return value
+
+    def as_dict(self):
+        """ The api dict, the fields the reply had """
+        return dict([(field, self.get(field)) for field in FIELDS
+                     if self.get(field) is not None])
+
+    def __eq__(self, other):
+        return (isinstance(other, BuildState) and
+                self.as_dict() == other.as_dict())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'BuildState(%s)' % ', '.join(['%s=%r' % item for item in
+                                             sorted(self.as_dict().items())])
@@ -11,7 +11,12 @@ import urllib2
 from urllib2 import HTTPError, URLError
 from urllib import quote
 import base64
-from check_jenkins import CheckJenkins
+import zlib
+from httplib import HTTPMessage
+import json
+from check_jenkins import CheckJenkins, BUILD_TREE
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_http import BodyReader, Timings
 from StringIO import StringIO
 
 
@@ -41,6 +46,15 @@ class TestCheckJenkins(unittest.TestCase):
                 resp.code = 200
                 resp.msg = "OK"
                 return resp
+            if req.get_full_url() == "http://localhost/gzip":
+                gzipper = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                body = gzipper.compress('{"result": "SUCCESS"}' * 100) + gzipper.flush()
+                resp = urllib2.addinfourl(StringIO(body),
+                        HTTPMessage(StringIO("Content-Encoding: gzip\r\n\r\n")),
+                        req.get_full_url())
+                resp.code = 200
+                resp.msg = "OK"
+                return resp
             if req.get_full_url() == "http://localhost/typo":
                 resp = urllib2.addinfourl(StringIO("mock file"), "mock message", req.get_full_url())
                 resp.code = 404
@@ -56,6 +70,22 @@ class TestCheckJenkins(unittest.TestCase):
         dl_ok = self.cj.get_data('http://localhost/test', 'user', 'pass', 1)
 
 
+    def test_get_data_gzip(self):
+        my_opener = urllib2.build_opener(self.MyHTTPHandler)
+        urllib2.install_opener(my_opener)
+        reader = BodyReader()
+        dl_gzip = self.cj.get_data('http://localhost/gzip', 'user', 'pass', 1,
+                                   reader=reader)
+        self.assertEqual('{"result": "SUCCESS"}' * 100, dl_gzip)
+        self.assertEqual(2100, reader.decoded)
+        self.assertTrue(reader.transferred < 100)
+
+    def test_get_data_too_large(self):
+        my_opener = urllib2.build_opener(self.MyHTTPHandler)
+        urllib2.install_opener(my_opener)
+        self.assertRaises(SystemExit, self.cj.get_data, 'http://localhost/gzip',
+                          'user', 'pass', 1, reader=BodyReader(max_size=1000))
+
     def test_get_data_typo(self):
         my_opener = urllib2.build_opener(self.MyHTTPHandler)
         urllib2.install_opener(my_opener)
@@ -74,6 +104,56 @@ class TestCheckJenkins(unittest.TestCase):
 
 
 
+    def test_get_data_fake_jenkins(self):
+        urllib2.install_opener(None)
+        jenkins = FakeJenkins(jobs=5)
+        server = serve_in_thread(jenkins)
+        try:
+            url = '%sjob/job-00003/lastBuild/api/json?tree=%s' % (server.url,
+                                                                  BUILD_TREE)
+            build = json.loads(self.cj.get_data(url, 'user', 'pass', 1))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(jenkins.last_build('job-00003'), build)
+        in_p = dict(self.in_p, now=datetime.fromtimestamp(jenkins.now))
+        status, msg = self.cj.check_result(in_p, build)
+        self.assertTrue(status in ('OK', 'WARNING', 'CRITICAL', 'UNKNOWN'))
+        self.assertTrue(msg.startswith('test '))
+
+    def test_get_data_timings(self):
+        jenkins = FakeJenkins(jobs=5)
+        server = serve_in_thread(jenkins)
+        timings = Timings()
+        try:
+            url = '%sjob/job-00001/lastBuild/api/json?tree=%s' % (server.url,
+                                                                  BUILD_TREE)
+            body = self.cj.get_data(url, None, None, 1,
+                                    reader=BodyReader(timings=timings),
+                                    timings=timings)
+        finally:
+            urllib2.install_opener(None)
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(jenkins.last_build('job-00001'), json.loads(body))
+        self.assertEqual(['connect', 'dns', 'read', 'ttfb'],
+                         sorted(timings.phases))
+        self.assertTrue(timings.perfdata().startswith('dns='))
+
+    def test_check_result_adaptive(self):
+        # Running for 00:59:59, usually done in 10 to 30 minutes
+        in_p = dict(self.in_p, thresholds=(1800, 3000))
+        result = self.cj.check_result(in_p, {'building': True, 'result': '', 'timestamp': '1328483562000', 'url': 'http://localhost/job/test/6/'})
+        self.assertEqual('CRITICAL', result[0])
+        self.assertEqual('duration=17s;1800;3000;0',
+                         self.cj.perfdata(in_p, {'building': False, 'duration': 17852}))
+
+    def test_perfdata(self):
+        build = {'building': False, 'result': 'SUCCESS', 'duration': 17852}
+        self.assertEqual('duration=17s;3600;7200;0',
+                         self.cj.perfdata(self.in_p, build))
+
+
     def test_seconds2human(self):
         for integer, string in self.test_suite_seconds2human:                
             self.assertEqual(string, self.cj.seconds2human(integer))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import os
+import subprocess
+import sys
+import time
+import urllib2
+from datetime import datetime, timedelta
+from mock import patch
+
+import check_jenkins_batch
+from fake_jenkins import FakeJenkins, serve_in_thread
+
+
+class TestCheckJenkinsBatch(unittest.TestCase):
+
+    in_p = {'jobs': [], 'warning': 60, 'critical': 120,
+            'lsb_warning': None, 'lsb_critical': None,
+            'now': datetime.fromtimestamp(1328483562) +
+                   timedelta(hours=1, microseconds=-1)}
+
+    reply = {'jobs': [
+        {'name': 'ok', 'url': 'http://localhost/job/ok/',
+         'lastBuild': {'building': False, 'result': 'SUCCESS',
+                       'duration': 17852, 'timestamp': 1328483562000,
+                       'url': 'http://localhost/job/ok/6/'},
+         'lastSuccessfulBuild': {'timestamp': 1328483562000,
+                                 'url': 'http://localhost/job/ok/6/'}},
+        {'name': 'broken', 'url': 'http://localhost/job/broken/',
+         'lastBuild': {'building': False, 'result': 'FAILURE',
+                       'duration': 17852, 'timestamp': 1328483562000,
+                       'url': 'http://localhost/job/broken/3/'},
+         'lastSuccessfulBuild': None},
+        {'name': 'slow', 'url': 'http://localhost/job/slow/',
+         'lastBuild': {'building': True, 'result': None,
+                       'duration': 0, 'timestamp': 1328479962000,
+                       'url': 'http://localhost/job/slow/9/'},
+         'lastSuccessfulBuild': {'timestamp': 1328400000000,
+                                 'url': 'http://localhost/job/slow/8/'}},
+    ]}
+
+    def test_tree_url(self):
+        url = check_jenkins_batch.tree_url('http://localhost:80/')
+        self.assertTrue(url.startswith('http://localhost:80/api/json?tree=jobs['))
+        for field in ('lastBuild[', 'lastSuccessfulBuild[', 'building',
+                      'timestamp', 'duration', 'result'):
+            self.assertTrue(field in url)
+
+    def test_check_jobs_all(self):
+        results = check_jenkins_batch.check_jobs(self.in_p, self.reply)
+        self.assertEqual([('broken', 'CRITICAL'), ('ok', 'OK'), ('slow', 'WARNING')],
+                         [(name, status) for name, status, msg in results])
+        self.assertEqual('CRITICAL - 3 jobs: 1 critical, 1 warning, 0 unknown, 1 ok',
+                         check_jenkins_batch.summary(results))
+
+    def test_check_jobs_selection(self):
+        in_p = dict(self.in_p, jobs=['ok', 'missing'])
+        results = check_jenkins_batch.check_jobs(in_p, self.reply)
+        self.assertEqual([('ok', 'OK', 'ok exited normally after 00:00:17'),
+                          ('missing', 'UNKNOWN', 'missing does not exist')],
+                         results)
+
+    def test_check_jobs_lsb(self):
+        in_p = dict(self.in_p, jobs=['ok', 'slow', 'broken'],
+                    lsb_warning='1h', lsb_critical='2d')
+        results = check_jenkins_batch.check_jobs(in_p, self.reply)
+        self.assertEqual(['OK', 'WARNING', 'CRITICAL'],
+                         [status for name, status, msg in results])
+        self.assertTrue('broken never ran successfully' in results[2][2])
+
+    def test_main_trickling_reply_stopped(self):
+        # A few bytes at a time, each read quick, for several seconds
+        jenkins = FakeJenkins(jobs=20, drip=100)
+        server = serve_in_thread(jenkins)
+        argv = ['check_jenkins_batch.py', '-H', server.server_address[0],
+                '-P', str(server.server_address[1]), '-w', '10', '-c', '20',
+                '-t', '1']
+        start = time.time()
+        try:
+            with patch('sys.argv', argv):
+                self.assertRaises(SystemExit, check_jenkins_batch.main)
+        finally:
+            urllib2.install_opener(None)
+            server.shutdown()
+            server.server_close()
+        self.assertTrue(time.time() - start < 1.5)
+
+    def test_main_non_ascii_job_on_a_pipe(self):
+        jenkins = FakeJenkins(jobs=3, prefix='caf\xc3\xa9-')
+        server = serve_in_thread(jenkins)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'check_jenkins_batch.py')
+        try:
+            process = subprocess.Popen([sys.executable, script,
+                        '-H', server.server_address[0],
+                        '-P', str(server.server_address[1]),
+                        '-w', '100000', '-c', '200000'],
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, errors = process.communicate()
+        finally:
+            server.shutdown()
+            server.server_close()
+        # Not a UnicodeEncodeError and its exit code 1, a WARNING to Nagios
+        self.assertEqual('', errors)
+        self.assertEqual(4, len(output.splitlines()))
+        self.assertTrue('caf\xc3\xa9-00001' in output, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+import urllib2
+from datetime import datetime
+
+from check_jenkins import CheckJenkins
+from check_jenkins_combined import combined_url, check_combined, perfdata
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_common import worst_status
+import check_jenkins_lsb
+
+
+class TestCheckJenkinsCombined(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.jenkins = FakeJenkins(jobs=20)
+        self.server = serve_in_thread(self.jenkins)
+        host, port = self.server.server_address
+        self.in_p = {'hostname': host, 'port': port, 'prefix': '/',
+                     'ssl': False, 'warning': 60, 'critical': 120,
+                     'lsb_warning': '1d', 'lsb_critical': '3d',
+                     'now': datetime.fromtimestamp(self.jenkins.now)}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_one_request_both_rules(self):
+        for name in self.jenkins.job_names:
+            params = dict(self.in_p, job=name)
+            before = self.jenkins.requests
+            job = json.loads(CheckJenkins().get_data(combined_url(params),
+                                                     None, None, 2))
+            self.assertEqual(before + 1, self.jenkins.requests)
+            self.assertEqual(self.jenkins.last_build(name), job['lastBuild'])
+
+            status, msg = check_combined(params, job)
+            expected = [CheckJenkins().check_result(params, job['lastBuild'])[0]]
+            if job['lastSuccessfulBuild']:
+                lsb_params = dict(params, warning='1d', critical='3d')
+                expected.append(check_jenkins_lsb.check_result(
+                                    lsb_params, job['lastSuccessfulBuild'])[0])
+            # Never better than either of the two checks
+            self.assertEqual(status, worst_status(expected + [status]))
+            self.assertTrue(msg.startswith(name))
+            self.assertTrue(perfdata(params, job).startswith('duration='))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+
+from check_jenkins_daemon import StatusCache, StatusServer, Poller
+from check_jenkins_client import query_daemon
+from jenkins_http import ConnectionPool, HTTPStatusError
+
+
+class JenkinsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    reply = {'jobs': [{'name': 'test',
+                       'lastBuild': {'building': False, 'result': 'SUCCESS'}}]}
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        self.server.clients.add(self.client_address)
+        if self.path.startswith('/api/json'):
+            code, body = 200, json.dumps(self.reply)
+        else:
+            code, body = 404, 'Not Found'
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCheckJenkinsDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.jenkins = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), JenkinsHandler)
+        self.jenkins.paths = []
+        self.jenkins.clients = set()
+        thread = threading.Thread(target=self.jenkins.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%s/' % self.jenkins.server_address[1]
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.jenkins.shutdown()
+        self.jenkins.server_close()
+        shutil.rmtree(self.tmp)
+
+    def test_pool_keep_alive(self):
+        pool = ConnectionPool(timeout=2)
+        for i in range(3):
+            self.assertEqual(JenkinsHandler.reply,
+                             json.loads(pool.get(self.url + 'api/json')))
+        pool.close()
+        self.assertEqual(3, len(self.jenkins.paths))
+        self.assertEqual(1, len(self.jenkins.clients))
+
+    def test_pool_error(self):
+        pool = ConnectionPool(timeout=2)
+        self.assertRaises(HTTPStatusError, pool.get, self.url + 'job/nope/')
+
+    def test_poll_and_query(self):
+        cache = StatusCache('jenkins')
+        poller = Poller(cache, self.url + 'api/json?tree=jobs[name]', None,
+                        None, 60, ConnectionPool(timeout=2))
+        poller.poll()
+
+        path = os.path.join(self.tmp, 'daemon.sock')
+        server = StatusServer(path, cache)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            reply = query_daemon(path, {'hostname': 'jenkins', 'job': 'test'}, 2)
+            self.assertEqual({'building': False, 'result': 'SUCCESS'},
+                             reply['build'])
+            reply = query_daemon(path, {'hostname': 'jenkins', 'job': 'x'}, 2)
+            self.assertTrue('error' in reply)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_poll_error_reported(self):
+        cache = StatusCache('jenkins')
+        Poller(cache, self.url + 'job/nope/', None, None, 60,
+               ConnectionPool(timeout=2)).poll()
+        self.assertTrue('404' in cache.lookup('jenkins', 'test')['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import gzip
+import threading
+import urllib2
+from StringIO import StringIO
+
+from check_jenkins_exporter import MetricsPage, MetricsServer, Refresher
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_http import ConnectionPool
+
+
+class TestCheckJenkinsExporter(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.jenkins = FakeJenkins(jobs=50)
+        self.server = serve_in_thread(self.jenkins)
+        host, port = self.server.server_address
+        self.in_p = {'hostname': host, 'port': port, 'prefix': '/',
+                     'ssl': False, 'view': None, 'folder': None, 'jobs': [],
+                     'username': None, 'password': None,
+                     'warning': 60, 'critical': 120,
+                     'lsb_warning': None, 'lsb_critical': None,
+                     'recursive': False, 'workers': 4, 'interval': 60,
+                     'discovery_interval': 3600}
+        self.page = MetricsPage()
+        self.metrics = MetricsServer(('127.0.0.1', 0), self.page)
+        thread = threading.Thread(target=self.metrics.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%s/metrics' % self.metrics.server_address[1]
+
+    def tearDown(self):
+        self.metrics.shutdown()
+        self.metrics.server_close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def scrape(self, gzipped=False):
+        request = urllib2.Request(self.url)
+        if gzipped:
+            request.add_header('Accept-Encoding', 'gzip')
+        response = urllib2.urlopen(request, timeout=2)
+        body = response.read()
+        if gzipped:
+            self.assertEqual('gzip', response.info().getheader('Content-Encoding'))
+            body = gzip.GzipFile(fileobj=StringIO(body)).read()
+        return response.info().getheader('Content-Type'), body
+
+    def test_scrapes_served_from_memory(self):
+        refresher = Refresher(self.in_p, self.page, ConnectionPool(timeout=2))
+        refresher.refresh()
+        self.assertEqual(1, self.jenkins.requests)
+
+        content_type, body = self.scrape()
+        self.assertTrue(content_type.startswith('text/plain; version=0.0.4'))
+        self.assertEqual((content_type, body), self.scrape(gzipped=True))
+        # Scrapes never reach Jenkins
+        self.assertEqual(1, self.jenkins.requests)
+
+        lines = body.splitlines()
+        self.assertEqual(50, len([line for line in lines
+                                  if line.startswith('jenkins_job_status{')]))
+        self.assertEqual(50, len([line for line in lines
+                                  if line.startswith('jenkins_job_building{')]))
+        self.assertTrue('jenkins_exporter_up 1' in lines)
+
+        # A failed refresh keeps the job metrics and says so
+        self.server.shutdown()
+        self.server.server_close()
+        refresher.pool.close()
+        refresher.refresh()
+        content_type, after = self.scrape()
+        lines = after.splitlines()
+        self.assertTrue('jenkins_exporter_up 0' in lines)
+        self.assertTrue('jenkins_exporter_refresh_errors_total 1' in lines)
+        self.assertEqual(50, len([line for line in lines
+                                  if line.startswith('jenkins_job_status{')]))
+
+        self.server = serve_in_thread(self.jenkins)
+
+    def test_unknown_path(self):
+        self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                          self.url.replace('/metrics', '/other'), None, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
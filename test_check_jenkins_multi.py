@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import threading
+import time
+import urllib2
+from StringIO import StringIO
+from datetime import datetime
+from mock import patch
+
+import check_jenkins_multi
+from fake_jenkins import FakeJenkins, serve_in_thread
+
+
+class TestCheckJenkinsMulti(unittest.TestCase):
+
+    in_p = {'warning': 60, 'critical': 120, 'username': 'user',
+            'password': 'pass', 'timeout': 1, 'port': 80, 'prefix': '/',
+            'ssl': False, 'now': datetime(2012, 2, 5, 16, 12, 41, 999999)}
+
+    class MyHTTPHandler(urllib2.HTTPHandler):
+        def http_open(self, req):
+            if req.get_host() == 'ci-ok:80':
+                body = '{"building": false, "result": "SUCCESS", "duration": 17852, "url": "http://ci-ok/job/test/6/"}'
+                resp = urllib2.addinfourl(StringIO(body), "mock message", req.get_full_url())
+                resp.code = 200
+                resp.msg = "OK"
+                return resp
+            if req.get_host() == 'ci-typo:80':
+                resp = urllib2.addinfourl(StringIO("Not Found"), "mock message", req.get_full_url())
+                resp.code = 404
+                resp.msg = "Not Found"
+                return resp
+            raise urllib2.URLError('Name or service not known')
+
+    def setUp(self):
+        urllib2.install_opener(urllib2.build_opener(self.MyHTTPHandler))
+
+    def tearDown(self):
+        urllib2.install_opener(None)
+
+    def test_check_target_errors_are_results(self):
+        self.assertEqual(('OK', 'test on ci-ok exited normally after 00:00:17'),
+                         check_jenkins_multi.check_target(self.in_p, ('ci-ok', 'test')))
+        status, msg = check_jenkins_multi.check_target(self.in_p, ('ci-typo', 'test'))
+        self.assertEqual('CRITICAL', status)
+        self.assertTrue('does the job exist' in msg)
+        status, msg = check_jenkins_multi.check_target(self.in_p, ('ci-dead', 'test'))
+        self.assertEqual('CRITICAL', status)
+        self.assertTrue('Double check the server name' in msg)
+
+    def test_per_master_limit(self):
+        running = {}
+        peak = {}
+        lock = threading.Lock()
+
+        def work(target):
+            lock.acquire()
+            running[target[0]] = running.get(target[0], 0) + 1
+            peak[target[0]] = max(peak.get(target[0], 0), running[target[0]])
+            lock.release()
+            time.sleep(0.01)
+            lock.acquire()
+            running[target[0]] -= 1
+            lock.release()
+            return target[1]
+
+        targets = [('slow', i) for i in range(6)] + [('fast', i) for i in range(6)]
+        results = check_jenkins_multi.fan_out(targets, work, workers=8, per_master=2)
+        self.assertEqual([t[1] for t in targets], results)
+        self.assertEqual({'slow': 2, 'fast': 2}, peak)
+
+    def test_slow_master_does_not_block_others(self):
+        finished = []
+
+        def work(target):
+            if target[0] == 'slow':
+                time.sleep(0.3)
+            finished.append(target[0])
+
+        check_jenkins_multi.fan_out([('slow', 1), ('fast', 1), ('fast', 2)],
+                                    work, workers=2, per_master=1)
+        self.assertEqual(['fast', 'fast', 'slow'], finished)
+
+    def test_main_one_budget_for_every_target(self):
+        urllib2.install_opener(None)
+        # Each reply trickles in for about a second, each read quick
+        jenkins = FakeJenkins(jobs=4, drip=100)
+        server = serve_in_thread(jenkins)
+        host, port = server.server_address
+        argv = ['check_jenkins_multi.py', '-P', str(port), '-w', '10',
+                '-c', '20', '-t', '1', '--per-master', '1']
+        for name in jenkins.job_names:
+            argv.extend(['-T', '%s %s' % (host, name)])
+        start = time.time()
+        try:
+            with patch('sys.argv', argv):
+                self.assertRaises(SystemExit, check_jenkins_multi.main)
+        finally:
+            server.shutdown()
+            server.server_close()
+        # Not a second per target, one after the other
+        self.assertTrue(time.time() - start < 1.6, time.time() - start)
+
+
+if __name__ == '__main__':
+    unittest.main()
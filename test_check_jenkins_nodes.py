@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+import urllib2
+
+from check_jenkins import CheckJenkins
+from check_jenkins_nodes import computer_url, check_nodes, label_usage
+from fake_jenkins import FakeJenkins, serve_in_thread
+
+
+class TestCheckJenkinsNodes(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.jenkins = FakeJenkins(jobs=10, nodes=20)
+        self.server = serve_in_thread(self.jenkins)
+        host, port = self.server.server_address
+        self.in_p = {'hostname': host, 'port': port, 'prefix': '/',
+                     'ssl': False, 'warning': 80, 'critical': 95,
+                     'offline_warning': None, 'offline_critical': None,
+                     'labels': []}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_labels_from_one_request(self):
+        reply = json.loads(CheckJenkins().get_data(computer_url(self.in_p),
+                                                   None, None, 2))
+        self.assertEqual(1, self.jenkins.requests)
+
+        results = check_nodes(self.in_p, reply)
+        self.assertEqual(['all', 'docker', 'linux', 'windows'],
+                         [label for label, status, msg in results])
+
+        computers = self.jenkins.computers()
+        usage = label_usage(reply)
+        self.assertEqual(len(computers),
+                         usage['all']['online'] + usage['all']['offline'])
+        self.assertEqual(len([c for c in computers if c['offline']]),
+                         usage['all']['offline'])
+        self.assertEqual(sum([len([e for e in c['executors'] if not e['idle']])
+                              for c in computers]), usage['all']['busy'])
+
+        params = dict(self.in_p, labels=['linux', 'gpu'])
+        results = check_nodes(params, reply)
+        self.assertEqual(['linux', 'gpu'],
+                         [label for label, status, msg in results])
+        self.assertEqual('UNKNOWN', results[1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
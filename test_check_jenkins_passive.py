@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+from check_jenkins_passive import CommandFileSink, NscaSink, command_lines
+from check_jenkins_passive import nsca_lines, passive_results
+
+
+class TestCheckJenkinsPassive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.checks = [('ci', 'Jenkins job-%05d' % i, i % 4,
+                        'OK - job-%05d exited normally after 00:01:00' % i)
+                       for i in range(500)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_command_file_fifo(self):
+        path = os.path.join(self.tmp, 'nagios.cmd')
+        os.mkfifo(path)
+        received = []
+
+        def nagios():
+            received.append(open(path).read())
+        thread = threading.Thread(target=nagios)
+        thread.start()
+        CommandFileSink(path).submit(self.checks, 1328483562)
+        thread.join()
+        self.assertEqual(command_lines(self.checks, 1328483562), received[0])
+        self.assertEqual(500, received[0].count('PROCESS_SERVICE_CHECK_RESULT'))
+
+    def test_non_ascii_job(self):
+        checks = passive_results({'nagios_host': 'ci',
+                                  'service_format': 'Jenkins %s'},
+                                 [(u'caf\xe9', 'OK', u'caf\xe9 exited normally')])
+        path = os.path.join(self.tmp, 'nagios.cmd')
+        open(path, 'w').close()
+        CommandFileSink(path).submit(checks, 1328483562)
+        self.assertEqual('[1328483562] PROCESS_SERVICE_CHECK_RESULT;ci;'
+                         'Jenkins caf\xc3\xa9;0;OK - caf\xc3\xa9 exited normally\n',
+                         open(path).read())
+        self.assertEqual('ci\tJenkins caf\xc3\xa9\t0\t'
+                         'OK - caf\xc3\xa9 exited normally\n', nsca_lines(checks))
+
+    def test_chunks_whole_lines(self):
+        data = command_lines(self.checks, 1328483562)
+        chunks = list(CommandFileSink(None).chunks(data, 4096))
+        self.assertEqual(data, ''.join(chunks))
+        for chunk in chunks:
+            self.assertTrue(len(chunk) <= 4096)
+            self.assertTrue(chunk.endswith('\n'))
+
+    def test_nsca(self):
+        script = os.path.join(self.tmp, 'send_nsca')
+        output = os.path.join(self.tmp, 'sent')
+        open(script, 'w').write('#!/bin/sh\necho "$@" > %s.args\ncat > %s\n' % (
+                                    output, output))
+        os.chmod(script, stat.S_IRWXU)
+        NscaSink('nagios.example.com', script).submit(self.checks[:2], 0)
+        self.assertEqual('-H nagios.example.com\n', open(output + '.args').read())
+        self.assertEqual('ci\tJenkins job-00000\t0\t'
+                         'OK - job-00000 exited normally after 00:01:00\n',
+                         open(output).readline())
+
+    def test_nsca_failure(self):
+        self.assertRaises(IOError, NscaSink('nagios', 'false').submit,
+                          self.checks, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+import urllib2
+from datetime import datetime
+
+from check_jenkins import CheckJenkins
+from check_jenkins_queue import queue_url, check_queue, index_queue
+from fake_jenkins import FakeJenkins, serve_in_thread
+
+
+class TestCheckJenkinsQueue(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.jenkins = FakeJenkins(jobs=200, folders=3)
+        self.server = serve_in_thread(self.jenkins)
+        host, port = self.server.server_address
+        self.in_p = {'hostname': host, 'port': port, 'prefix': '/',
+                     'ssl': False, 'warning': 30, 'critical': 90, 'jobs': [],
+                     'now': datetime.fromtimestamp(self.jenkins.now)}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_queue_once_every_job(self):
+        reply = json.loads(CheckJenkins().get_data(queue_url(self.in_p),
+                                                   None, None, 2))
+        self.assertEqual(1, self.jenkins.requests)
+        queued = sorted([item['task']['url'] for item in self.jenkins.queue()])
+        self.assertTrue(queued)
+
+        results = check_queue(self.in_p, reply)
+        self.assertEqual(len(queued), len(results))
+        self.assertTrue(results[0][0].startswith('folder-'))
+
+        # Every job asked for, queued or not, from the same reply
+        params = dict(self.in_p, jobs=self.jenkins.job_names)
+        results = check_queue(params, reply)
+        self.assertEqual(200, len(results))
+        waiting = [name for name, status, msg in results
+                   if 'waiting in the queue for' in msg]
+        self.assertEqual(sorted(index_queue(reply)), sorted(waiting))
+        for name, status, msg in results:
+            if name not in waiting:
+                self.assertEqual('OK', status)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import httplib
+import json
+import threading
+from mock import patch
+
+from check_jenkins_batch import tree_url
+from check_jenkins_webhook import (JobStates, JobMonitor, Reconciler,
+                                   WebhookServer)
+from fake_jenkins import FakeJenkins, serve_in_thread, replay
+from jenkins_http import ConnectionPool
+
+
+class ListSink(object):
+    """ Keeps the submitted checks """
+
+    def __init__(self):
+        self.checks = []
+
+    def submit(self, checks, now):
+        self.checks.extend(checks)
+
+
+class TestCheckJenkinsWebhook(unittest.TestCase):
+
+    def setUp(self):
+        self.jenkins = FakeJenkins(jobs=50)
+        self.server = serve_in_thread(self.jenkins)
+        self.in_p = {'warning': 60, 'critical': 120, 'lsb_warning': None,
+                     'lsb_critical': None, 'jobs': [],
+                     'username': None, 'password': None,
+                     'nagios_host': 'ci', 'service_format': 'Jenkins %s'}
+        self.sink = ListSink()
+        self.states = JobStates()
+        self.monitor = JobMonitor(self.in_p, self.states, self.sink)
+        self.reconciler = Reconciler(self.monitor, tree_url(self.server.url),
+                                     ConnectionPool(timeout=2))
+        self.webhook = WebhookServer(('127.0.0.1', 0), self.monitor, 's3cret')
+        thread = threading.Thread(target=self.webhook.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%s/?token=s3cret' % (
+                        self.webhook.server_address[1])
+
+    def tearDown(self):
+        self.reconciler.pool.close()
+        self.webhook.shutdown()
+        self.webhook.server_close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_only_changed_jobs_checked(self):
+        self.reconciler.tick()
+        self.assertEqual(1, self.jenkins.requests)
+        self.assertEqual(50, len(self.sink.checks))
+
+        del self.sink.checks[:]
+        payloads = list(self.jenkins.notifications(30, seed=4))
+        requests = self.jenkins.requests
+        self.assertEqual([200] * 30, replay(self.url, payloads))
+        # No request to Jenkins, one check per notification
+        self.assertEqual(requests, self.jenkins.requests)
+        self.assertEqual(['Jenkins %s' % payload['name'] for payload in payloads],
+                         [service for host, service, code, output
+                          in self.sink.checks])
+
+        # The state built from notifications is the one Jenkins serves
+        fresh = JobStates()
+        fresh.reconcile(json.loads(self.reconciler.pool.get(self.reconciler.url)))
+        names = sorted(set([payload['name'] for payload in payloads]))
+        for name in names:
+            self.assertEqual(fresh.job(name)['lastBuild'],
+                             self.states.job(name)['lastBuild'])
+
+    def test_rejected_notifications(self):
+        self.reconciler.tick()
+        del self.sink.checks[:]
+        payload = self.jenkins.notify('job-00001')
+        self.assertEqual([403], replay(self.url.split('?')[0], [payload]))
+        self.assertEqual([400], replay(self.url, ['not a notification']))
+        late = dict(payload, build=dict(payload['build'],
+                                        number=payload['build']['number'] - 1))
+        self.assertEqual([200], replay(self.url, [late]))
+        self.assertEqual([], self.sink.checks)
+        self.assertEqual(1, self.states.ignored)
+
+        # Lost notifications are caught up by the reconciliation
+        self.reconciler.poll()
+        self.assertEqual(self.jenkins.last_build('job-00001')['building'],
+                         self.states.job(u'job-00001')['lastBuild']['building'])
+
+    def post(self, body, length):
+        """ Status and body of a POST sending *length* as Content-Length """
+        connection = httplib.HTTPConnection(
+                        '127.0.0.1', self.webhook.server_address[1], timeout=5)
+        try:
+            connection.putrequest('POST', '/?token=s3cret')
+            if length is not None:
+                connection.putheader('Content-Length', length)
+            connection.endheaders()
+            connection.send(body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def test_bad_content_length(self):
+        body = json.dumps(self.jenkins.notify('job-00001'))
+        self.assertEqual(400, self.post(body, 'abc')[0])
+        self.assertEqual(400, self.post(body, None)[0])
+        self.assertEqual(400, self.post(body, '-1')[0])
+        self.assertEqual(200, self.post(body, str(len(body)))[0])
+
+    def test_non_ascii_reply(self):
+        with patch.object(self.monitor, 'notify') as notify:
+            notify.return_value = [(u'caf\xe9', 'OK',
+                                    u'caf\xe9 exited normally')]
+            status, body = self.post('{}', '2')
+        self.assertEqual(200, status)
+        self.assertEqual('OK - caf\xc3\xa9 exited normally\n', body)
+
+    def test_finalized_checked_once(self):
+        self.reconciler.tick()
+        del self.sink.checks[:]
+        payload = self.jenkins.notify('job-00001')
+        if payload['build']['phase'] == 'STARTED':
+            payload = self.jenkins.notify('job-00001')
+        finalized = dict(payload, build=dict(payload['build'],
+                                             phase='FINALIZED'))
+        self.assertEqual([200, 200], replay(self.url, [payload, finalized]))
+        self.assertEqual(1, len(self.sink.checks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+import urllib2
+
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_http import fetch
+
+
+class TestFakeJenkins(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.jenkins = FakeJenkins(jobs=50, payload_size=20000)
+        self.server = serve_in_thread(self.jenkins)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        return json.loads(fetch(self.server.url + path, None, None, 5))
+
+    def test_last_build_projection(self):
+        build = self.get('job/job-00007/lastBuild/api/json?tree=number,building,result')
+        self.assertEqual(['building', 'number', 'result'], sorted(build))
+        self.assertEqual(self.jenkins.last_build('job-00007')['number'],
+                         build['number'])
+
+    def test_full_record_payload_size(self):
+        body = fetch(self.server.url + 'job/job-00007/lastSuccessfulBuild/api/json',
+                     None, None, 5)
+        self.assertTrue(len(body) > 20000)
+        self.assertEqual('SUCCESS', json.loads(body)['result'])
+
+    def test_api_python(self):
+        body = fetch(self.server.url + 'job/job-00007/lastBuild/api/python?tree=number',
+                     None, None, 5)
+        self.assertEqual({'number': self.jenkins.last_build('job-00007')['number']},
+                         eval(body))
+
+    def test_jobs_tree(self):
+        reply = self.get('api/json?tree=jobs[name,lastBuild[number],builds[number]{0,3}]')
+        self.assertEqual(50, len(reply['jobs']))
+        self.assertEqual(3, len(reply['jobs'][0]['builds']))
+        self.assertEqual(reply['jobs'][0]['lastBuild'], reply['jobs'][0]['builds'][0])
+
+    def test_folder_urls(self):
+        jenkins = FakeJenkins(jobs=4, folders=2)
+        name = [name for name in jenkins.job_names if '/' in name][0]
+        folder, _, job = name.partition('/')
+        path = 'job/%s/job/%s/' % (folder, job)
+        build = jenkins.last_build(name)
+        self.assertEqual('http://jenkins/' + path, jenkins.job(name)['url'])
+        self.assertEqual('http://jenkins/%s%s/' % (path, build['number']),
+                         build['url'])
+        self.assertEqual(['http://jenkins/job/%s/' % folder],
+                         [item['url'] for item in jenkins.children('')
+                          if item['name'] == folder])
+
+    def test_errors(self):
+        self.assertRaises(urllib2.HTTPError, self.get, 'job/nope/lastBuild/api/json')
+        self.jenkins.error_rate = 1
+        try:
+            self.get('job/job-00001/lastBuild/api/json')
+        except urllib2.HTTPError, error:
+            self.assertEqual(500, error.code)
+        else:
+            self.fail('error_rate ignored')
+
+
+if __name__ == '__main__':
+    unittest.main()
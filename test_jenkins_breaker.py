@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import socket
+import tempfile
+import urllib2
+from mock import patch
+
+from check_jenkins import CheckJenkins
+from jenkins_breaker import CircuitBreaker
+from jenkins_cache import ResponseCache
+
+
+class TestJenkinsBreaker(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.tmp = tempfile.mkdtemp()
+        # A port nobody listens on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:%s/job/test/lastBuild/api/json' % (
+                        sock.getsockname()[1])
+        sock.close()
+        self.breaker = CircuitBreaker(self.tmp, self.url, failures=2,
+                                      cooldown=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_fail_fast_once_open(self):
+        for attempt in range(2):
+            self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                              None, None, 1, breaker=self.breaker)
+        with patch('urllib2.urlopen') as urlopen:
+            self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                              None, None, 1, breaker=self.breaker)
+            # Another check of the same host shares the state
+            other = self.url.replace('test', 'other')
+            self.assertRaises(SystemExit, CheckJenkins().get_data, other,
+                              None, None, 1,
+                              breaker=CircuitBreaker(self.tmp, other, 2, 60))
+            self.assertFalse(urlopen.called)
+
+        # A fresh reply in the cache is still served
+        cache = ResponseCache(os.path.join(self.tmp, 'cache.db'))
+        cache.put(self.url, None, None, '{"number": 1}')
+        self.assertEqual('{"number": 1}', CheckJenkins().get_data(self.url,
+                            None, None, 1, cache, breaker=self.breaker))
+
+    def test_cache_hit_is_not_counted(self):
+        cache = ResponseCache(os.path.join(self.tmp, 'cache.db'))
+        cached = self.url.replace('test', 'cached')
+        cache.put(cached, None, None, '{"number": 1}')
+        self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                          None, None, 1, cache, breaker=self.breaker)
+        # Same host, answered without connecting : neither a success nor a
+        # look at the state file
+        with patch.object(CircuitBreaker, '_update') as update:
+            self.assertEqual('{"number": 1}', CheckJenkins().get_data(cached,
+                                None, None, 1, cache, breaker=self.breaker))
+            self.assertFalse(update.called)
+        self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                          None, None, 1, cache, breaker=self.breaker)
+        with patch('urllib2.urlopen') as urlopen:
+            self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                              None, None, 1, cache, breaker=self.breaker)
+            self.assertFalse(urlopen.called)
+
+    def test_answer_closes(self):
+        self.breaker.failure()
+        with patch('urllib2.urlopen') as urlopen:
+            urlopen.side_effect = urllib2.HTTPError(self.url, 404, 'Not Found',
+                                                    {}, None)
+            self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                              None, None, 1, breaker=self.breaker)
+        # The 404 was an answer, the failure before it is forgotten
+        self.breaker.failure()
+        self.breaker.allow()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import sqlite3
+import tempfile
+import time
+import urllib2
+from httplib import HTTPMessage
+from StringIO import StringIO
+
+from jenkins_cache import ResponseCache, open_cache
+from jenkins_common import fetch_context
+
+
+def headers(*lines):
+    return HTTPMessage(StringIO(''.join([line + '\r\n' for line in lines])))
+
+
+class JenkinsHandler(urllib2.HTTPHandler):
+    etag_url = 'http://localhost/job/etag/lastBuild/api/json?tree=number,url'
+    etag_body = '{"number": 7, "url": "http://localhost/job/etag/7/"}'
+    plain_url = 'http://localhost/job/plain/lastBuild/api/json?tree=number,url'
+    plain_body = '{"number": 42, "url": "http://localhost/job/plain/42/"}'
+    requests = []
+
+    def http_open(self, req):
+        url = req.get_full_url()
+        if url == self.etag_url:
+            JenkinsHandler.requests.append((req.get_header('If-none-match'),
+                                            req.get_header('If-modified-since')))
+            if req.get_header('If-none-match') == '"v1"':
+                raise urllib2.HTTPError(url, 304, 'Not Modified', {}, None)
+            resp = urllib2.addinfourl(StringIO(self.etag_body),
+                                      headers('ETag: "v1"'), url)
+        elif url == self.plain_url:
+            resp = urllib2.addinfourl(StringIO(self.plain_body), headers(), url)
+        elif url == self.plain_url.replace('number,url', 'number'):
+            resp = urllib2.addinfourl(StringIO('{"number": 42}'), headers(), url)
+        else:
+            raise urllib2.HTTPError(url, 404, 'Not Found', {}, None)
+        resp.code = 200
+        resp.msg = "OK"
+        return resp
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        JenkinsHandler.requests = []
+        urllib2.install_opener(urllib2.build_opener(JenkinsHandler))
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache.db')
+        self.cache = ResponseCache(self.path, ttl=60, size=2)
+
+    def tearDown(self):
+        urllib2.install_opener(None)
+        shutil.rmtree(self.tmp)
+
+    def test_private_file(self):
+        self.assertEqual(0600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_ttl(self):
+        self.cache.put('http://ci/a', 'user', 'pass', 'body', now=1000)
+        self.assertEqual('body', self.cache.get('http://ci/a', 'user', 'pass', now=1060))
+        self.assertEqual(None, self.cache.get('http://ci/a', 'user', 'pass', now=1061))
+
+    def test_credentials(self):
+        self.cache.put('http://ci/a', 'user', 'pass', 'body', now=1000)
+        self.assertEqual(None, self.cache.get('http://ci/a', None, None, now=1000))
+
+    def test_lru_eviction(self):
+        self.cache.put('http://ci/a', None, None, 'a', now=1000)
+        self.cache.put('http://ci/b', None, None, 'b', now=1001)
+        # The use of an entry is written again once it is ttl/2 old
+        self.cache.get('http://ci/a', None, None, now=1031)
+        self.cache.put('http://ci/c', None, None, 'c', now=1032)
+        self.assertEqual('a', self.cache.get('http://ci/a', None, None, now=1033))
+        self.assertEqual(None, self.cache.get('http://ci/b', None, None, now=1033))
+        self.assertEqual('c', self.cache.get('http://ci/c', None, None, now=1033))
+
+    def test_hit_does_not_write(self):
+        self.cache.put('http://ci/a', None, None, 'a')
+        # Another process in the middle of a write, readers still get through
+        writer = sqlite3.connect(self.path, timeout=0)
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            start = time.time()
+            self.assertEqual('a', self.cache.get('http://ci/a', None, None))
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            writer.rollback()
+            writer.close()
+
+    def test_corrupt_file_no_cache(self):
+        open(self.path, 'wb').write('not a database' * 100)
+        self.assertEqual(None, open_cache(self.path))
+        context = fetch_context({'url': 'http://ci/', 'timeout': 10,
+                                 'cache': self.path, 'cache_ttl': 60,
+                                 'cache_size': 10})
+        self.assertEqual(None, context['cache'])
+
+    def test_shared_between_instances(self):
+        ResponseCache(self.path).put('http://ci/a', None, None, 'body')
+        other = ResponseCache(self.path, ttl=60, size=2)
+        self.assertEqual('body', other.fetch('http://ci/a', None, None, 1))
+        self.assertEqual('cache', other.last_source)
+        self.assertEqual([], JenkinsHandler.requests)
+
+    def test_broken_cache_still_fetches(self):
+        self.cache.db.execute("DROP TABLE responses")
+        self.assertEqual(JenkinsHandler.etag_body,
+                         self.cache.fetch(JenkinsHandler.etag_url, None, None, 1))
+        self.assertEqual('jenkins', self.cache.last_source)
+
+    def test_etag_not_modified(self):
+        url = JenkinsHandler.etag_url
+        self.cache.put(url, None, None, 'old', etag='"v1"', now=1000)
+        self.assertEqual('old', self.cache.fetch(url, None, None, 1))
+        self.assertEqual('not modified', self.cache.last_source)
+        self.assertEqual([('"v1"', None)], JenkinsHandler.requests)
+        # fresh again for a ttl
+        self.assertEqual('old', self.cache.fetch(url, None, None, 1))
+        self.assertEqual('cache', self.cache.last_source)
+
+    def test_etag_modified(self):
+        url = JenkinsHandler.etag_url
+        self.cache.put(url, None, None, 'old', etag='"v0"', now=1000)
+        self.assertEqual(JenkinsHandler.etag_body,
+                         self.cache.fetch(url, None, None, 1))
+        self.assertEqual('jenkins', self.cache.last_source)
+        self.assertEqual('"v1"', self.cache.stale(url, None, None)['etag'])
+
+    def test_number_probe(self):
+        url = JenkinsHandler.plain_url
+        self.cache.put(url, None, None, 'old', number=42, now=1000)
+        self.assertEqual('old', self.cache.fetch(url, None, None, 1))
+        self.assertEqual('same build', self.cache.last_source)
+
+        self.cache.put(url, None, None, 'old', number=41, now=1000)
+        self.assertEqual(JenkinsHandler.plain_body,
+                         self.cache.fetch(url, None, None, 1))
+        self.assertEqual('jenkins', self.cache.last_source)
+        self.assertEqual(42, self.cache.stale(url, None, None)['number'])
+
+    def test_hit_loads_no_network_module(self):
+        script = ('import sys\n'
+                  'sys.argv = ["check_jenkins.py", "-H", "ci", "-j", "x", '
+                  '"-w", "1", "-c", "2", "--cache", sys.argv[1]]\n'
+                  'try:\n'
+                  '    execfile("check_jenkins.py", {"__name__": "__main__"})\n'
+                  'except SystemExit:\n'
+                  '    pass\n'
+                  'print [module for module in ("urllib", "urllib2", "httplib", '
+                  '"ssl", "socket", "base64") if sys.modules.get(module)]\n')
+        from check_jenkins import BUILD_TREE
+        self.cache.put('http://ci:80/job/x/lastBuild/api/json?tree=%s' % (
+                        BUILD_TREE), None, None, '{"building": false, '
+                        '"result": "SUCCESS", "duration": 1000}')
+        here = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.Popen([sys.executable, '-c', script, self.path],
+                                  cwd=here, stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(['OK - x exited normally after 00:00:01', '[]'],
+                         [line.split(' |')[0] for line in output.splitlines()])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import urllib2
+from mock import patch
+
+from check_jenkins import CheckJenkins, BUILD_TREE
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_cache import ResponseCache
+from jenkins_http import Deadline
+
+
+class TestJenkinsDeadline(unittest.TestCase):
+
+    def setUp(self):
+        # About 10 pieces, 50ms apart
+        self.jenkins = FakeJenkins(jobs=1, drip=50, payload_size=0)
+        self.server = serve_in_thread(self.jenkins)
+        self.url = '%sjob/job-00000/lastBuild/api/json?tree=%s' % (
+                        self.server.url, BUILD_TREE)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        urllib2.install_opener(None)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def test_trickling_reply_stopped(self):
+        # Each read is quick, a timeout per read never fires
+        body = CheckJenkins().get_data(self.url, None, None, 0.2)
+        self.assertEqual(self.jenkins.last_build('job-00000'), json.loads(body))
+
+        start = time.time()
+        self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                          None, None, 0.2, deadline=Deadline(0.2))
+        self.assertTrue(time.time() - start < 0.4)
+
+    def test_default_opener_untouched(self):
+        urllib2.install_opener(None)
+        CheckJenkins().get_data(self.url, None, None, 5, deadline=Deadline(5))
+        # Other threads keep urllib2 as it was, without this deadline
+        self.assertEqual(None, urllib2._opener)
+
+    def test_next_address_tried(self):
+        # A port nobody listens on, as an address the network does not route
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        closed = sock.getsockname()
+        sock.close()
+        getaddrinfo = socket.getaddrinfo
+
+        def resolve(host, port, *args):
+            return ([(socket.AF_INET, socket.SOCK_STREAM, 6, '', closed)] +
+                    getaddrinfo(host, port, *args))
+        with patch('socket.getaddrinfo', resolve):
+            body = CheckJenkins().get_data(self.url, None, None, 5,
+                                           deadline=Deadline(5))
+        self.assertEqual(self.jenkins.last_build('job-00000'), json.loads(body))
+
+    def test_soft_deadline_stale_reply(self):
+        cache = ResponseCache(os.path.join(self.tmp, 'cache.db'), ttl=60)
+        cache.put(self.url, None, None, '{"number": 1}', now=time.time() - 120)
+
+        start = time.time()
+        body = CheckJenkins().get_data(self.url, None, None, 5, cache,
+                                       deadline=Deadline(5, soft=0.2))
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual('{"number": 1}', body)
+        self.assertEqual('stale', cache.last_source)
+
+        # Without an expired reply to fall back on, the whole budget is used
+        cache.db.execute("DELETE FROM responses")
+        body = CheckJenkins().get_data(self.url, None, None, 5, cache,
+                                       deadline=Deadline(5, soft=0.2))
+        self.assertEqual('jenkins', cache.last_source)
+        self.assertEqual(self.jenkins.last_build('job-00000'), json.loads(body))
+
+
+if __name__ == '__main__':
+    unittest.main()
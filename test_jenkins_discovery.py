@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import tempfile
+import urllib2
+from datetime import datetime
+
+from check_jenkins_batch import check_jobs
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_cache import ResponseCache
+from jenkins_discovery import discover, discover_cached, fetch_builds
+from jenkins_http import fetch
+
+
+class TestJenkinsDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.jenkins = FakeJenkins(jobs=60, folders=4)
+        self.server = serve_in_thread(self.jenkins)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def get(self, url):
+        return fetch(url, None, None, 2)
+
+    def test_discover_and_check(self):
+        jobs = discover(self.server.url, self.get, workers=3)
+        self.assertEqual(sorted(self.jenkins.job_names),
+                         sorted([name for name, url in jobs]))
+        # Root + 4 folders
+        self.assertEqual(5, self.jenkins.requests)
+
+        reply = fetch_builds(jobs, self.get, workers=3)
+        self.assertEqual(9, self.jenkins.requests)
+        by_name = dict([(job['name'], job) for job in reply['jobs']])
+        self.assertEqual(self.jenkins.last_build('folder-02/job-00006')['number'],
+                         by_name['folder-02/job-00006']['lastBuild']['number'])
+
+        params = {'warning': 60, 'critical': 120, 'lsb_warning': None,
+                  'lsb_critical': None, 'jobs': ['folder-01/job-00001'],
+                  'now': datetime.fromtimestamp(self.jenkins.now)}
+        [(name, status, msg)] = check_jobs(params, reply)
+        self.assertEqual('folder-01/job-00001', name)
+        self.assertTrue(msg.startswith('folder-01/job-00001 '))
+
+    def test_discover_cached(self):
+        cache = ResponseCache(os.path.join(self.tmp, 'cache.db'), ttl=3600)
+        first = discover_cached(self.server.url, self.get, 2, cache, None, None)
+        requests = self.jenkins.requests
+        second = discover_cached(self.server.url, self.get, 2, cache, None, None)
+        self.assertEqual(requests, self.jenkins.requests)
+        self.assertEqual([tuple(job) for job in first],
+                         [tuple(job) for job in second])
+
+    def test_discover_cached_non_ascii(self):
+        jenkins = FakeJenkins(jobs=6, folders=2, prefix='caf\xc3\xa9-')
+        server = serve_in_thread(jenkins)
+        cache = ResponseCache(os.path.join(self.tmp, 'cache.db'), ttl=3600)
+        try:
+            for run in range(2):
+                # The second run gets the jobs from the cache
+                jobs = discover_cached(server.url, self.get, 2, cache, None,
+                                       None)
+                reply = fetch_builds(jobs, self.get, 2)
+                self.assertEqual(sorted(jenkins.job_names),
+                                 sorted([job['name'] for job in reply['jobs']]))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_discover_error(self):
+        self.assertRaises(urllib2.HTTPError, discover,
+                          self.server.url + 'job/nope/', self.get)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+import BaseHTTPServer
+import SocketServer
+from mock import patch
+
+from check_jenkins import CheckJenkins
+from jenkins_flight import SingleFlight
+from jenkins_http import Deadline
+
+
+class JenkinsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers the codes of server.codes first, then 200 after server.delay """
+
+    def do_GET(self):
+        server = self.server
+        server.lock.acquire()
+        server.requests += 1
+        code = server.codes and server.codes.pop(0) or 200
+        server.lock.release()
+        time.sleep(server.delay)
+        body = code == 200 and '{"number": 42}' or 'Unavailable'
+        self.send_response(code)
+        if code == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class JenkinsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestJenkinsFlight(unittest.TestCase):
+
+    def setUp(self):
+        urllib2.install_opener(None)
+        self.tmp = tempfile.mkdtemp()
+        self.jenkins = JenkinsServer(('127.0.0.1', 0), JenkinsHandler)
+        self.jenkins.lock = threading.Lock()
+        self.jenkins.requests = 0
+        self.jenkins.codes = []
+        self.jenkins.delay = 0
+        thread = threading.Thread(target=self.jenkins.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%s/job/test/lastBuild/api/json' % (
+                        self.jenkins.server_address[1])
+
+    def tearDown(self):
+        self.jenkins.shutdown()
+        self.jenkins.server_close()
+        shutil.rmtree(self.tmp)
+
+    def test_threads_share_one_request(self):
+        self.jenkins.delay = 0.3
+        bodies = []
+
+        def check():
+            bodies.append(CheckJenkins().get_data(self.url, None, None, 5,
+                            flight=SingleFlight(self.tmp)))
+        threads = [threading.Thread(target=check) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['{"number": 42}'] * 10, bodies)
+        self.assertEqual(1, self.jenkins.requests)
+
+    def test_processes_share_one_request(self):
+        self.jenkins.delay = 0.5
+        script = ('from check_jenkins import CheckJenkins\n'
+                  'from jenkins_flight import SingleFlight\n'
+                  'import sys\n'
+                  'sys.stdout.write(CheckJenkins().get_data(sys.argv[1], None, '
+                  'None, 5, flight=SingleFlight(sys.argv[2])))\n')
+        here = os.path.dirname(os.path.abspath(__file__))
+        processes = [subprocess.Popen([sys.executable, '-c', script, self.url,
+                                       self.tmp], cwd=here,
+                                      stdout=subprocess.PIPE)
+                     for i in range(6)]
+        outputs = [process.communicate()[0] for process in processes]
+        self.assertEqual(['{"number": 42}'] * 6, outputs)
+        self.assertEqual(1, self.jenkins.requests)
+
+    def test_retries(self):
+        self.jenkins.codes = [503, 429]
+        self.assertEqual('{"number": 42}', CheckJenkins().get_data(
+                            self.url, None, None, 5, retries=2))
+        self.assertEqual(3, self.jenkins.requests)
+
+        # Not transient, not tried again
+        self.jenkins.codes = [404]
+        self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                          None, None, 5, retries=2)
+        self.assertEqual(4, self.jenkins.requests)
+
+        # No retry past the deadline
+        self.jenkins.codes = [503] * 50
+        started = time.time()
+        self.assertRaises(SystemExit, CheckJenkins().get_data, self.url,
+                          None, None, 1, retries=50,
+                          deadline=Deadline(1))
+        self.assertTrue(time.time() - started < 1.5)
+        self.assertTrue(self.jenkins.requests < 4 + 50)
+
+    def test_old_files_pruned(self):
+        flight = SingleFlight(self.tmp)
+        self.assertEqual('old', flight.call('old', lambda: 'old'))
+        for name in os.listdir(self.tmp):
+            os.utime(os.path.join(self.tmp, name), (0, 0))
+        open(os.path.join(self.tmp, 'old.reply.123'), 'w').close()
+        os.utime(os.path.join(self.tmp, 'old.reply.123'), (0, 0))
+        # The fetch pruning the directory keeps its own files
+        with patch('random.random', return_value=0.0):
+            self.assertEqual('new', flight.call('new', lambda: 'new'))
+        self.assertEqual(['new.lock', 'new.reply'], sorted(os.listdir(self.tmp)))
+
+
+if __name__ == '__main__':
+    unittest.main()
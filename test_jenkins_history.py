@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+import os
+import random
+import shutil
+import tempfile
+import urllib2
+
+from check_jenkins import CheckJenkins
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_history import HistoryStore, history_url
+from jenkins_http import fetch
+
+
+def build(number, result='SUCCESS', duration=60000, building=False):
+    return {'number': number, 'result': result, 'timestamp': number * 3600000,
+            'duration': duration, 'building': building}
+
+
+class TestJenkinsHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = HistoryStore(self.tmp, retention=10, segments=3)
+        self.key = 'http://localhost/job/test/'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_append_only_newer(self):
+        self.assertEqual(2, self.store.append(self.key, [build(2), build(1)]))
+        self.assertEqual(1, self.store.append(self.key, [build(3), build(2)]))
+        history = self.store.load(self.key)
+        self.assertEqual([1, 2, 3], list(history.numbers))
+        self.assertEqual(3, history.watermark)
+        self.assertEqual(2, history.segments)
+
+    def test_running_build_holds_watermark(self):
+        # 5 is still running, 6 finished first : 6 waits for 5
+        self.store.append(self.key, [build(6), build(5, building=True),
+                                     build(4)])
+        self.assertEqual(4, self.store.load(self.key).watermark)
+        self.store.append(self.key, [build(6), build(5), build(4)])
+        self.assertEqual([4, 5, 6], list(self.store.load(self.key).numbers))
+
+    def test_compaction_and_retention(self):
+        for number in range(1, 26):
+            self.store.append(self.key, [build(number)])
+        history = self.store.load(self.key)
+        self.assertTrue(history.segments <= 3)
+        self.assertTrue(len(history) <= 10 + 3)
+        self.assertEqual(25, history.watermark)
+        self.assertEqual(range(26 - len(history), 26), list(history.numbers))
+
+    def test_truncated_segment_ignored(self):
+        self.store.append(self.key, [build(1)])
+        self.store.append(self.key, [build(2)])
+        path = self.store.path(self.key)
+        data = open(path, 'rb').read()
+        open(path, 'wb').write(data[:-3])
+        self.assertEqual([1], list(self.store.load(self.key).numbers))
+
+    def test_update_pages_down_to_watermark(self):
+        self.store.append(self.key, [build(3)])
+        jenkins = [build(number) for number in range(20, 0, -1)]
+        calls = []
+
+        def fetch_builds(start, end):
+            calls.append((start, end))
+            return jenkins[start:end]
+
+        history = self.store.update(self.key, fetch_builds, page=5)
+        self.assertEqual([(0, 5), (5, 10)], calls)
+        self.assertEqual(range(3, 4) + range(11, 21), list(history.numbers))
+        # Already up to date, no request at all
+        self.store.update(self.key, fetch_builds, page=5, latest=20)
+        self.assertEqual(2, len(calls))
+
+    def test_update_while_building(self):
+        # check_jenkins passes the build before the running one
+        self.store.append(self.key, [build(6, building=True), build(5)])
+        calls = []
+
+        def fetch_builds(start, end):
+            calls.append((start, end))
+            return [build(6, building=True), build(5)]
+        running = {'number': 6, 'building': True}
+        self.store.update(self.key, fetch_builds,
+                          latest=CheckJenkins().last_finished(running))
+        self.assertEqual([], calls)
+
+    def test_prune(self):
+        self.store.append(self.key, [build(1)])
+        self.store.append('http://localhost/job/other/', [build(1)])
+        os.utime(self.store.path(self.key), (0, 0))
+        self.assertEqual(1, self.store.prune(max_age=86400))
+        self.assertEqual(0, len(self.store.load(self.key)))
+
+    def test_maybe_prune_sampled(self):
+        self.store.append(self.key, [build(1)])
+        os.utime(self.store.path(self.key), (0, 0))
+        self.assertEqual(None, self.store.maybe_prune(86400, chance=0.01,
+                                rng=random.Random(1)))
+        self.assertEqual(1, len(self.store.load(self.key)))
+        pruned = [self.store.maybe_prune(86400, chance=0.01,
+                                         rng=random.Random(seed))
+                  for seed in range(1000)]
+        self.assertTrue(0 < len([p for p in pruned if p is not None]) < 30)
+        self.assertEqual(0, len(self.store.load(self.key)))
+
+    def test_update_fake_jenkins(self):
+        urllib2.install_opener(None)
+        jenkins = FakeJenkins(jobs=3, history=50)
+        server = serve_in_thread(jenkins)
+        job_url = server.url + 'job/job-00001/'
+        try:
+            history = self.store.update(job_url, lambda start, end: json.loads(
+                fetch(history_url(job_url, start, end), None, None, 2))['builds'])
+        finally:
+            server.shutdown()
+            server.server_close()
+        finished = [record['number'] for record in
+                    jenkins.builds('job-00001')[:10] if not record['building']]
+        self.assertEqual(sorted(finished), list(history.numbers))
+        self.assertEqual(1, jenkins.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import os
+import random
+import shutil
+import tempfile
+
+from jenkins_history import History
+from jenkins_quantiles import P2Quantile, DurationSketch
+
+
+class TestJenkinsQuantiles(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(42)
+        self.durations = [rng.lognormvariate(6, 0.5) for i in range(2000)]
+
+    def test_p2_close_to_exact(self):
+        ordered = sorted(self.durations)
+        for p in (0.5, 0.95, 0.99):
+            quantile = P2Quantile(p)
+            for duration in self.durations:
+                quantile.add(duration)
+            exact = ordered[int(p * len(ordered))]
+            self.assertTrue(abs(quantile.value() - exact) < exact * 0.05,
+                            (p, quantile.value(), exact))
+
+    def test_p2_state_round_trip(self):
+        whole, first = P2Quantile(0.95), P2Quantile(0.95)
+        for duration in self.durations:
+            whole.add(duration)
+        for duration in self.durations[:1000]:
+            first.add(duration)
+        second = P2Quantile(0.95, first.state())
+        for duration in self.durations[1000:]:
+            second.add(duration)
+        self.assertEqual(whole.value(), second.value())
+
+    def test_sketch_update_incremental(self):
+        history = History([1, 2, 3, 4], [1, 3, 1, 1], [0] * 4,
+                          [60000, 999000, 120000, 90000])
+        sketch = DurationSketch()
+        self.assertEqual(3, sketch.update(history))
+        self.assertEqual(0, sketch.update(history))
+        self.assertEqual(4, sketch.last)
+        self.assertEqual(3, sketch.count)
+
+    def test_sketch_save_load(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'job.sketch')
+            self.assertEqual(0, DurationSketch.load(path).count)
+            sketch = DurationSketch()
+            for number, duration in enumerate(self.durations):
+                sketch.add(number, duration)
+            sketch.save(path)
+            loaded = DurationSketch.load(path)
+            self.assertEqual(sketch.thresholds(1.5), loaded.thresholds(1.5))
+            self.assertEqual(len(self.durations) - 1, loaded.last)
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import fnmatch
+import os
+import random
+import re
+import shutil
+import tempfile
+from datetime import datetime
+from mock import patch
+
+from check_jenkins_batch import check_jobs
+from jenkins_rules import RuleIndex, RulesError, parse_rules
+
+
+def first_match(rules, name):
+    """ What the index must find, one rule after the other """
+    for pattern, settings in rules:
+        if pattern.startswith('re:'):
+            if re.match('(?:%s)\\Z' % pattern[3:], name):
+                return settings
+        elif fnmatch.fnmatchcase(name, pattern):
+            return settings
+    return None
+
+
+class TestJenkinsRules(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'rules')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_same_as_first_match(self):
+        rng = random.Random(42)
+        lines = []
+        for i in range(3000):
+            kind = rng.choice(('exact', 'prefix', 'glob', 're'))
+            name = 'team-%02d/job-%04d' % (rng.randrange(30), rng.randrange(500))
+            pattern = {'exact': name,
+                       'prefix': name[:rng.randrange(1, len(name))] + '*',
+                       'glob': '*' + name[rng.randrange(len(name)):],
+                       're': 're:%s.*-(\\d)' % name[:rng.randrange(len(name))]
+                      }[kind]
+            lines.append('%s warning=%sm critical=%sm' % (pattern, i + 1, i + 2))
+        rules = parse_rules(lines)
+        index = RuleIndex(rules)
+        # More regular expressions than one of them can hold groups
+        self.assertTrue(len(index.regexes) > 1)
+        for i in range(2000):
+            name = 'team-%02d/job-%04d-%s' % (rng.randrange(30),
+                                              rng.randrange(500),
+                                              rng.randrange(3))
+            for candidate in (name, name[:-2]):
+                self.assertEqual(first_match(rules, candidate),
+                                 index.lookup(candidate))
+
+    def test_index_kept_until_the_file_changes(self):
+        open(self.path, 'w').write('nightly-* warning=2h critical=4h\n')
+        self.assertEqual([7200, 14400],
+                         RuleIndex.load(self.path).lookup('nightly-db')['thresholds'])
+        self.assertTrue(os.path.exists(self.path + '.index'))
+
+        with patch('jenkins_rules.parse_rules') as parse:
+            index = RuleIndex.load(self.path)
+            self.assertFalse(parse.called)
+        self.assertEqual([7200, 14400], index.lookup(u'nightly-db')['thresholds'])
+
+        open(self.path, 'w').write('nightly-* check=skip\nbroken warning\n')
+        self.assertRaises(RulesError, RuleIndex.load, self.path)
+        open(self.path, 'w').write('nightly-* check=skip\n')
+        self.assertEqual({'check': 'skip'},
+                         RuleIndex.load(self.path).lookup('nightly-db'))
+
+    def test_batch_with_rules(self):
+        index = RuleIndex(parse_rules(['sandbox-* check=skip',
+                                       'slow warning=10h critical=20h']))
+        running = {'building': True, 'timestamp': '1328483562000',
+                   'url': 'http://localhost/job/x/6/'}
+        reply = {'jobs': [{'name': name, 'lastBuild': running}
+                          for name in ('sandbox-1', 'slow', 'fast')]}
+        params = {'warning': 10, 'critical': 20, 'lsb_warning': None,
+                  'lsb_critical': None, 'jobs': [], 'rules': index,
+                  'now': datetime.fromtimestamp(1328483562 + 3600)}
+        self.assertEqual([('fast', 'CRITICAL'), ('slow', 'OK')],
+                         [(name, status) for name, status, msg
+                          in check_jobs(params, reply)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import threading
+
+from check_jenkins_client import query_daemon
+from check_jenkins_daemon import StatusCache, StatusTCPServer, ShardPoller
+from fake_jenkins import FakeJenkins, serve_in_thread
+from jenkins_http import ConnectionPool
+from jenkins_shard import Shard
+
+
+class LoggedJenkins(FakeJenkins):
+    """ Keeps the paths requested """
+
+    def handle(self, path):
+        self.paths.append(path)
+        return FakeJenkins.handle(self, path)
+
+
+class TestJenkinsShard(unittest.TestCase):
+
+    def setUp(self):
+        self.jenkins = LoggedJenkins(jobs=300)
+        self.jenkins.paths = []
+        self.server = serve_in_thread(self.jenkins)
+        self.nodes = {}
+        for node in ('a', 'b', 'c'):
+            cache = StatusCache('ci')
+            server = StatusTCPServer(('127.0.0.1', 0), cache)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.setDaemon(True)
+            thread.start()
+            self.nodes[node] = server
+        members = dict([(node, server.server_address)
+                        for node, server in self.nodes.items()])
+        self.pool = ConnectionPool(timeout=2)
+        for node, server in self.nodes.items():
+            server.cache.shard = Shard(node, members, timeout=2)
+            ShardPoller(server.cache, self.server.url, None, None, 60,
+                        self.pool).poll()
+
+    def tearDown(self):
+        self.pool.close()
+        for server in self.nodes.values():
+            server.shutdown()
+            server.server_close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_each_job_on_one_node(self):
+        kept = [set(server.cache._jobs) for server in self.nodes.values()]
+        self.assertEqual(set(self.jenkins.job_names), set.union(*kept))
+        self.assertEqual(300, sum([len(jobs) for jobs in kept]))
+        for jobs in kept:
+            # 100 vnodes keep the nodes within reach of a third each
+            self.assertTrue(50 < len(jobs) < 150, len(jobs))
+
+    def test_own_jobs_requested_only(self):
+        del self.jenkins.paths[:]
+        members = {'a': self.nodes['a'].server_address,
+                   'b': self.nodes['b'].server_address}
+        cache = StatusCache('ci', shard=Shard('a', members))
+        poller = ShardPoller(cache, self.server.url, None, None, 60,
+                             self.pool, discovery=600)
+        poller.poll()
+        poller.poll()
+        owned = set([name for name in self.jenkins.job_names
+                     if cache.shard.owns('ci', name)])
+        self.assertTrue(100 < len(owned) < 200, len(owned))
+        self.assertEqual(owned, set(cache._jobs))
+        # One listing of the names, then only the jobs of a, at every poll
+        self.assertEqual(['/api/json?tree=jobs[name]'],
+                         [path for path in self.jenkins.paths
+                          if path.startswith('/api/')])
+        requested = [path.split('/')[2] for path in self.jenkins.paths
+                     if path.startswith('/job/')]
+        self.assertEqual(2 * len(owned), len(requested))
+        self.assertEqual(owned, set(requested))
+
+    def test_any_node_answers(self):
+        shard = self.nodes['a'].cache.shard
+        for name in self.jenkins.job_names[:30]:
+            reply = query_daemon(self.nodes['a'].server_address,
+                                 {'hostname': 'ci', 'job': name}, 2)
+            self.assertEqual(self.jenkins.last_build(name)['number'],
+                             reply['build']['number'])
+            self.assertEqual(shard.owner('ci', name),
+                             reply.get('node', 'a'))
+
+    def test_owner_down(self):
+        shard = self.nodes['a'].cache.shard
+        name = [name for name in self.jenkins.job_names
+                if shard.owner('ci', name) == 'c'][0]
+        self.nodes['c'].shutdown()
+        self.nodes['c'].server_close()
+        reply = query_daemon(self.nodes['a'].server_address,
+                             {'hostname': 'ci', 'job': name}, 2)
+        self.assertTrue('polled by node c' in reply['error'], reply)
+
+
+if __name__ == '__main__':
+    unittest.main()
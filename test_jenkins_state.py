@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import unittest
+import json
+from datetime import datetime
+
+from check_jenkins import CheckJenkins
+from check_jenkins_batch import BUILD_FIELDS
+import check_jenkins_lsb
+from fake_jenkins import FakeJenkins
+from jenkins_state import BuildState
+
+
+class TestJenkinsState(unittest.TestCase):
+
+    def setUp(self):
+        self.jenkins = FakeJenkins(jobs=300)
+        self.in_p = {'warning': 60, 'critical': 120,
+                     'now': datetime.fromtimestamp(self.jenkins.now)}
+
+    def reply(self, build):
+        """ The build as json.loads gives it """
+        return json.loads(json.dumps(dict([(field, build[field])
+                                           for field in BUILD_FIELDS.split(',')])))
+
+    def test_same_checks_as_the_api_dict(self):
+        for name in self.jenkins.job_names:
+            params = dict(self.in_p, job=name)
+            build = self.reply(self.jenkins.last_build(name))
+            state = BuildState.from_build(build)
+            self.assertEqual(CheckJenkins().check_result(params, build),
+                             CheckJenkins().check_result(params, state))
+
+            success = self.jenkins.last_successful_build(name)
+            if success:
+                params = dict(params, warning='1d', critical='3d')
+                self.assertEqual(
+                    check_jenkins_lsb.check_result(params, self.reply(success)),
+                    check_jenkins_lsb.check_result(params,
+                        BuildState.from_build(self.reply(success))))
+
+    def test_url_base_shared(self):
+        name = self.jenkins.job_names[0]
+        builds = [BuildState.from_build(self.reply(build))
+                  for build in self.jenkins.builds(name)]
+        self.assertEqual([build['url'] for build in self.jenkins.builds(name)],
+                         [state['url'] for state in builds])
+        # One string for the job, whichever build or poll it came from
+        self.assertTrue(all([state.base is builds[0].base for state in builds]))
+        self.assertFalse(hasattr(builds[0], '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()